@@ -0,0 +1,147 @@
+"""
+Benchmark de la orquestación de partidas con SyntheticModel (sin red).
+
+Mide partidas/segundo, tiempo por fase (extracción JSON, comparación de soluciones,
+bocadillos con --render, escritura del registro y construcción de prompts) y memoria pico
+para partidas de 10, 100 y 1000 turnos, además de casos degenerados
+(respuestas muy largas y JSON malformado).
+
+Uso:
+    uv run benchmarks/bench_game.py
+    uv run benchmarks/bench_game.py --turns 10 100 --games 50 --render
+"""
+import argparse
+import builtins
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+# Funciones de main.py agrupadas por fase; se envuelven para medir su tiempo acumulado
+PHASES = {
+    "json": [(main, "parse_story_response"), (main, "parse_detective_response"), (main.JsonStreamDetector, "__call__")],
+    "comparar": [(main.SolutionMatcher, "__init__"), (main.SolutionMatcher, "matches")],
+    "bocadillos": [(main, "get_bubble_ascii"), (main.StreamingBubble, "feed"), (main.StreamingBubble, "close")],
+    "registro": [(main.TranscriptWriter, "write"), (main.TranscriptWriter, "create"), (main.TranscriptWriter, "flush")],
+    "prompts": [(main, "build_detective_turn_message"), (main, "build_judge_question_message")],
+}
+
+SCENARIOS = {
+    "normal": dict(response_chars=400, response_chars_stddev=100),
+    "respuestas largas": dict(response_chars=50_000, response_chars_stddev=5_000),
+    "JSON malformado": dict(response_chars=400, malformed_rate=0.3),
+}
+
+class PhaseTimer:
+    """Envuelve las funciones de cada fase y acumula su tiempo de ejecución."""
+    def __init__(self):
+        self.totals = {phase: 0.0 for phase in PHASES}
+        self._originals = []
+
+    def install(self):
+        for phase, targets in PHASES.items():
+            for owner, attribute in targets:
+                original = getattr(owner, attribute)
+                self._originals.append((owner, attribute, original))
+                setattr(owner, attribute, self._wrap(phase, original))
+
+    def uninstall(self):
+        for owner, attribute, original in reversed(self._originals):
+            setattr(owner, attribute, original)
+        self._originals = []
+
+    def _wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.totals[phase] += time.perf_counter() - start
+        return timed
+
+    def reset(self):
+        self.totals = {phase: 0.0 for phase in PHASES}
+
+def play(games, turns, scenario, render, latency):
+    """Juega `games` partidas sintéticas y retorna la lista de resultados."""
+    juez = main.SyntheticModel("juez-sintetico", latency=latency, seed=1, **scenario)
+    detective = main.SyntheticModel("detective-sintetico", latency=latency, seed=2, **scenario)
+    results = []
+    for game_index in range(games):
+        results.append(main.play_game(juez, detective, interactive=render, game_tag=f"bench-{game_index}", max_turns=turns))
+    return results
+
+def run_case(name, scenario, turns, games, render, latency, timer):
+    """Ejecuta un caso: una pasada cronometrada y otra con tracemalloc para la memoria pico."""
+    timer.reset()
+    start = time.perf_counter()
+    results = play(games, turns, scenario, render, latency)
+    elapsed = time.perf_counter() - start
+    phase_totals = dict(timer.totals)
+
+    tracemalloc.start()
+    play(1, turns, scenario, render, latency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    played_turns = sum(r["turns"] for r in results)
+    aborted = sum(1 for r in results if r["outcome"] in ("error", "formato_invalido_detective"))
+    return {
+        "name": name,
+        "turns": turns,
+        "games": games,
+        "games_per_sec": games / elapsed if elapsed else 0.0,
+        "turns_per_sec": played_turns / elapsed if elapsed else 0.0,
+        "phase_ms": {phase: total / games * 1000 for phase, total in phase_totals.items()},
+        "aborted": aborted,
+        "peak_mb": peak / (1024 * 1024),
+    }
+
+def print_report(rows, render):
+    # Los bocadillos solo se dibujan con --render: sin él, la columna siempre sería 0
+    phase_names = [name for name in PHASES if render or name != "bocadillos"]
+    header = f"{'Escenario':<18} {'Turnos':>6} {'Partidas':>8} {'part/s':>9} {'turnos/s':>10} " + \
+        " ".join(f"{name + ' ms':>13}" for name in phase_names) + f" {'Abort.':>6} {'Pico MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        phases = " ".join(f"{row['phase_ms'][name]:>13.3f}" for name in phase_names)
+        print(f"{row['name']:<18} {row['turns']:>6} {row['games']:>8} {row['games_per_sec']:>9.1f} "
+              f"{row['turns_per_sec']:>10.0f} {phases} {row['aborted']:>6} {row['peak_mb']:>8.2f}")
+    print("Tiempos por fase en ms por partida." + ("" if render else " Usa --render para medir también los bocadillos."))
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark de la orquestación de Black Story con un modelo sintético.")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000], help="Límites de turnos a medir (por defecto: 10 100 1000).")
+    parser.add_argument("--games", type=int, default=20, help="Partidas para el caso de 10 turnos; se reduce proporcionalmente para más turnos.")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), action="append", help="Escenarios a medir (por defecto: todos).")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia simulada por llamada en segundos (por defecto: 0, solo orquestación).")
+    parser.add_argument("--render", action="store_true", help="Incluye el dibujo de bocadillos (modo interactivo con la salida descartada).")
+    args = parser.parse_args()
+
+    timer = PhaseTimer()
+    rows = []
+    with tempfile.TemporaryDirectory() as stories_dir, open(os.devnull, "w") as devnull:
+        main.PROMPTS_DIR = stories_dir
+        original_input = builtins.input
+        builtins.input = lambda prompt="": ""
+        timer.install()
+        try:
+            for name in args.scenario or list(SCENARIOS):
+                for turns in args.turns:
+                    games = max(1, args.games * 10 // turns)
+                    with contextlib.redirect_stdout(devnull):
+                        rows.append(run_case(name, SCENARIOS[name], turns, games, args.render, args.latency, timer))
+        finally:
+            timer.uninstall()
+            builtins.input = original_input
+    print_report(rows, args.render)
+
+if __name__ == "__main__":
+    main_bench()
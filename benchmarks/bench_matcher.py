@@ -0,0 +1,90 @@
+"""
+Benchmark de la comparación de soluciones: precisión y rendimiento.
+
+Mide exactitud, precisión, exhaustividad y F1 sobre intentos etiquetados a mano
+(benchmarks/data/solution_attempts.jsonl) para la comparación original por solapamiento
+de palabras y para SolutionMatcher (con y sin IDF) en varios umbrales, y el número de
+intentos puntuados por segundo llamada a llamada y con la API por lotes.
+
+Uso:
+    uv run benchmarks/bench_matcher.py
+    uv run benchmarks/bench_matcher.py --repeat 500 --thresholds 0.4 0.5 0.6
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "solution_attempts.jsonl")
+
+def legacy_compare(detective_solution, actual_solution, threshold=0.6):
+    """La comparación anterior: fracción de palabras de la solución presentes en el intento."""
+    detective_words = set(re.findall(r'\b\w+\b', detective_solution.lower()))
+    actual_words = set(re.findall(r'\b\w+\b', actual_solution.lower()))
+    if not actual_words:
+        return True
+    return len(detective_words & actual_words) / len(actual_words) >= threshold
+
+def load_attempts(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def classification_metrics(predictions, labels):
+    tp = sum(1 for p, l in zip(predictions, labels) if p and l)
+    fp = sum(1 for p, l in zip(predictions, labels) if p and not l)
+    fn = sum(1 for p, l in zip(predictions, labels) if not p and l)
+    accuracy = sum(1 for p, l in zip(predictions, labels) if bool(p) == l) / len(labels)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return accuracy, precision, recall, f1
+
+def throughput(func, count):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark de la comparación de soluciones.")
+    parser.add_argument("--data", default=DATA_PATH, help="Archivo JSONL con intentos etiquetados (solution, attempt, correct).")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.4, 0.5, 0.6, 0.7], help="Umbrales de SolutionMatcher a evaluar.")
+    parser.add_argument("--repeat", type=int, default=200, help="Veces que se replica el conjunto para medir el rendimiento.")
+    args = parser.parse_args()
+
+    rows = load_attempts(args.data)
+    attempts = [row["attempt"] for row in rows]
+    solutions = [row["solution"] for row in rows]
+    labels = [row["correct"] for row in rows]
+    idf = main.build_idf(sorted(set(solutions)))
+
+    print(f"{len(rows)} intentos etiquetados ({sum(labels)} correctos) sobre {len(set(solutions))} soluciones.\n")
+    print(f"{'Método':<32} {'Umbral':>6} {'Exact.':>7} {'Prec.':>7} {'Exh.':>7} {'F1':>7}")
+    print("-" * 70)
+    accuracy, precision, recall, f1 = classification_metrics([legacy_compare(a, s) for a, s in zip(attempts, solutions)], labels)
+    print(f"{'solapamiento de palabras (antes)':<32} {0.6:>6.2f} {accuracy:>7.3f} {precision:>7.3f} {recall:>7.3f} {f1:>7.3f}")
+    for name, weights in (("SolutionMatcher", None), ("SolutionMatcher + IDF", idf)):
+        for threshold in args.thresholds:
+            _, hits = main.score_solution_pairs(attempts, solutions, threshold, weights)
+            accuracy, precision, recall, f1 = classification_metrics(list(hits), labels)
+            print(f"{name:<32} {threshold:>6.2f} {accuracy:>7.3f} {precision:>7.3f} {recall:>7.3f} {f1:>7.3f}")
+
+    many_attempts = attempts * args.repeat
+    many_solutions = solutions * args.repeat
+    count = len(many_attempts)
+    matchers = {solution: main.SolutionMatcher(solution) for solution in set(solutions)}
+    print(f"\nRendimiento sobre {count} intentos (intentos/s):")
+    print(f"  solapamiento de palabras (antes):     {throughput(lambda: [legacy_compare(a, s) for a, s in zip(many_attempts, many_solutions)], count):>12,.0f}")
+    print(f"  compare_solutions_flexible:           {throughput(lambda: [main.compare_solutions_flexible(a, s) for a, s in zip(many_attempts, many_solutions)], count):>12,.0f}")
+    print(f"  SolutionMatcher.matches (precalc.):   {throughput(lambda: [matchers[s].matches(a) for a, s in zip(many_attempts, many_solutions)], count):>12,.0f}")
+    print(f"  score_solution_pairs (por lotes):     {throughput(lambda: main.score_solution_pairs(many_attempts, many_solutions), count):>12,.0f}")
+    if main._numpy() is None:
+        print("  (NumPy no está instalado: la API por lotes usa el cálculo en Python puro)")
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,85 @@
+"""
+Benchmark del arranque del CLI.
+
+Mide, en procesos nuevos, cuánto tarda `main.py --help` en llegar al análisis de argumentos
+y desglosa el tiempo de importación con `python -X importtime`. Como referencia, mide también
+lo que costaría importar los SDK de los proveedores al arrancar (como se hacía antes de cargarlos
+solo al seleccionar el proveedor).
+
+Uso:
+    uv run benchmarks/bench_startup.py
+    uv run benchmarks/bench_startup.py --runs 20 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+
+# SDK que el CLI importaba siempre al arrancar
+PROVIDER_SDKS = ["google.generativeai", "ollama"]
+
+def wall_times(command, runs):
+    """Tiempos de pared (s) de `runs` ejecuciones del comando en procesos nuevos."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def import_times(module):
+    """
+    Importa `module` con -X importtime y retorna ({submódulo: ms acumulados} de lo que importa
+    directamente, ms acumulados del propio módulo).
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    children = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, raw_name = line[len("import time:"):].split("|")
+        # La sangría indica la profundidad: un módulo de primer nivel lleva 1 espacio y lo que
+        # importa 3; los hijos se listan antes que su padre
+        depth = len(raw_name) - len(raw_name.lstrip(" "))
+        if depth == 1:
+            if raw_name.strip() == module:
+                return children, int(cumulative) / 1000
+            children = {}
+        elif depth == 3:
+            children[raw_name.strip()] = int(cumulative) / 1000
+    return children, 0.0
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark del arranque del CLI.")
+    parser.add_argument("--runs", type=int, default=10, help="Ejecuciones de cada comando (se informa la mediana).")
+    parser.add_argument("--top", type=int, default=10, help="Módulos más lentos a mostrar en el desglose de importaciones.")
+    args = parser.parse_args()
+
+    help_times = wall_times([sys.executable, MAIN, "--help"], args.runs)
+    baseline_times = wall_times([sys.executable, "-c", "pass"], args.runs)
+    sdk_times = wall_times([sys.executable, "-c", "import " + ", ".join(PROVIDER_SDKS)], args.runs)
+    help_ms = statistics.median(help_times) * 1000
+    baseline_ms = statistics.median(baseline_times) * 1000
+    sdk_ms = statistics.median(sdk_times) * 1000 - baseline_ms
+
+    print(f"Mediana de {args.runs} ejecuciones:")
+    print(f"  intérprete vacío:                     {baseline_ms:8.1f} ms")
+    print(f"  main.py --help:                       {help_ms:8.1f} ms  ({help_ms - baseline_ms:.1f} ms sobre el intérprete)")
+    print(f"  importar los SDK ({', '.join(PROVIDER_SDKS)}): {sdk_ms:8.1f} ms más (lo que costaba cada arranque)")
+
+    modules, total_ms = import_times("main")
+    print(f"\nImportar main.py: {total_ms:.1f} ms. Sus importaciones directas más lentas (ms acumulados):")
+    for name, ms in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<30} {ms:8.1f}")
+    loaded_sdks = [name for name in PROVIDER_SDKS if name in modules or name.split(".")[0] in modules]
+    if loaded_sdks:
+        print(f"\nAviso: se importaron al arrancar: {', '.join(loaded_sdks)}")
+
+if __name__ == "__main__":
+    main_bench()
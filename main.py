@@ -1,73 +1,1369 @@
 import argparse
+import asyncio
+import inspect
+import importlib
 import os
+import json
+import hashlib
+import sqlite3
+import uuid
+import queue
+import atexit
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
 from datetime import datetime
 import textwrap
 from colorama import Fore, Style, init
 from dotenv import load_dotenv
-import google.generativeai as genai
-import ollama
 import re # Importar el módulo re para expresiones regulares
 import time
+import random
+import math
+import functools
+import unicodedata
 import threading
+import weakref
 import sys
 
 # Inicializar colorama
 init(autoreset=True)
 
+# --- Clientes Compartidos, Límites de Uso y Reintentos ---
+
+# Códigos HTTP que indican un error pasajero (cuota, sobrecarga o fallo temporal del servidor)
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Excepciones de las librerías cliente que se consideran pasajeras aunque no traigan código
+TRANSIENT_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+                         "InternalServerError", "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError"}
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0 # Segundos; se duplica en cada reintento
+RETRY_MAX_DELAY = 30.0
+
+def is_transient_error(error):
+    """True si merece la pena reintentar la llamada que lanzó `error`."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    for attribute in ("status_code", "code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int) and value in TRANSIENT_STATUS_CODES:
+            return True
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+def retry_delay(attempt):
+    """Espera antes del reintento `attempt` (0, 1, ...): backoff exponencial con jitter completo."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+class TokenBucket:
+    """Limitador de ritmo: `rate` peticiones por segundo con ráfagas de hasta `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Consume un token si lo hay y retorna 0; si no, retorna los segundos hasta el siguiente."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible y lo consume."""
+        while wait := self._take():
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """Como acquire(), pero cede el bucle de eventos mientras espera."""
+        while wait := self._take():
+            await asyncio.sleep(wait)
+
+class SharedSemaphore:
+    """
+    Semáforo de plazas compartido por hilos y bucles de eventos, por orden de llegada: al liberar
+    una plaza se entrega directamente al primero que espera, sea un hilo o una corrutina.
+    """
+    def __init__(self, value):
+        self._value = value
+        self._waiters = deque() # Funciones que entregan la plaza; retornan False si ya no se puede
+        self._lock = threading.Lock()
+
+    def _try_take(self):
+        # Sin esperas en cola para que quien llega no adelante a quien ya estaba esperando
+        if self._value and not self._waiters:
+            self._value -= 1
+            return True
+        return False
+
+    def acquire(self):
+        with self._lock:
+            if self._try_take():
+                return
+            event = threading.Event()
+            self._waiters.append(lambda: event.set() or True)
+        event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def deliver():
+            if granted.cancelled():
+                self.release() # La corrutina se canceló mientras se le entregaba la plaza
+            else:
+                granted.set_result(None)
+
+        def grant():
+            try:
+                loop.call_soon_threadsafe(deliver)
+                return True
+            except RuntimeError:
+                return False # Bucle cerrado: la plaza pasa al siguiente
+
+        with self._lock:
+            if self._try_take():
+                return
+            self._waiters.append(grant)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._lock:
+                if grant in self._waiters:
+                    self._waiters.remove(grant)
+                    raise
+            if granted.done() and not granted.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                if self._waiters.popleft()():
+                    return
+            self._value += 1
+
+class BackendLimiter:
+    """
+    Límites de un backend (un servidor Ollama o una API key de Gemini) compartidos por todas las
+    partidas del proceso: máximo de llamadas simultáneas, ritmo de peticiones y reintentos con
+    backoff ante errores pasajeros.
+    """
+    def __init__(self, max_concurrency=None, requests_per_minute=None):
+        self.semaphore = SharedSemaphore(max_concurrency) if max_concurrency else None
+        self.bucket = TokenBucket(requests_per_minute / 60.0) if requests_per_minute else None
+        self.retries = 0
+
+    def _acquire(self):
+        if self.bucket:
+            self.bucket.acquire()
+        if self.semaphore:
+            self.semaphore.acquire()
+
+    def _release(self):
+        if self.semaphore:
+            self.semaphore.release()
+
+    async def _aacquire(self):
+        if self.bucket:
+            await self.bucket.aacquire()
+        if self.semaphore:
+            await self.semaphore.aacquire()
+
+    def _retry_delay(self, error, attempt):
+        """Segundos a esperar antes de reintentar, o None si el error no se reintenta."""
+        if attempt >= MAX_RETRIES or not is_transient_error(error):
+            return None
+        self.retries += 1
+        return retry_delay(attempt)
+
+    def _should_retry(self, error, attempt):
+        delay = self._retry_delay(error, attempt)
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    async def _ashould_retry(self, error, attempt):
+        delay = self._retry_delay(error, attempt)
+        if delay is None:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    def call(self, func, *args, **kwargs):
+        """Ejecuta `func` respetando los límites y reintentando los errores pasajeros."""
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = e
+            finally:
+                self._release()
+            if not self._should_retry(error, attempt):
+                raise error
+            attempt += 1
+
+    def stream(self, start):
+        """
+        Emite los fragmentos del stream que abre `start()`, ocupando una plaza de concurrencia
+        mientras dura. Solo se reintenta si el error llega antes del primer fragmento: después
+        ya se ha entregado texto y repetir la llamada lo duplicaría.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            received = False
+            try:
+                for chunk in start():
+                    received = True
+                    yield chunk
+                return
+            except Exception as e:
+                if received:
+                    raise
+                error = e
+            finally:
+                self._release()
+            if not self._should_retry(error, attempt):
+                raise error
+            attempt += 1
+
+    async def acall(self, func, *args, **kwargs):
+        """Como call(), para una función asíncrona."""
+        attempt = 0
+        while True:
+            await self._aacquire()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                error = e
+            finally:
+                self._release()
+            if not await self._ashould_retry(error, attempt):
+                raise error
+            attempt += 1
+
+    async def astream(self, start):
+        """Como stream(), para un stream asíncrono: `await start()` retorna un iterable asíncrono."""
+        attempt = 0
+        while True:
+            await self._aacquire()
+            received = False
+            try:
+                async for chunk in await start():
+                    received = True
+                    yield chunk
+                return
+            except Exception as e:
+                if received:
+                    raise
+                error = e
+            finally:
+                self._release()
+            if not await self._ashould_retry(error, attempt):
+                raise error
+            attempt += 1
+
+class ClientRegistry:
+    """
+    Registro de clientes y limitadores compartidos por todo el proceso. Los clientes se indexan
+    por (backend, servidor o API key, modelo) para reutilizar sus conexiones HTTP entre partidas;
+    los limitadores por (backend, servidor o API key), porque los límites son del servidor o de la cuota.
+    """
+    def __init__(self):
+        self._clients = {}
+        self._loop_clients = weakref.WeakKeyDictionary() # bucle -> {(backend, servidor): cliente}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def client(self, backend, endpoint, model, factory):
+        """Retorna el cliente registrado para la clave o lo crea con `factory()`."""
+        key = (backend, endpoint, model)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = factory()
+            return self._clients[key]
+
+    def loop_client(self, backend, endpoint, factory):
+        """
+        Como client(), para clientes asíncronos, que quedan ligados al bucle de eventos en que se
+        usan: uno por bucle, que se cierra con close_loop_clients() y se olvida si el bucle desaparece.
+        """
+        loop = asyncio.get_running_loop()
+        key = (backend, endpoint)
+        with self._lock:
+            clients = self._loop_clients.setdefault(loop, {})
+            if key not in clients:
+                clients[key] = factory()
+            return clients[key]
+
+    async def close_loop_clients(self):
+        """Cierra los clientes asíncronos del bucle actual."""
+        with self._lock:
+            clients = self._loop_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            closed = client.close()
+            if inspect.isawaitable(closed):
+                await closed
+
+    def limiter(self, backend, endpoint):
+        """Retorna el BackendLimiter de un servidor o API key, con los límites configurados en .env."""
+        key = (backend, endpoint)
+        with self._lock:
+            if key not in self._limiters:
+                max_concurrency, requests_per_minute = BACKEND_LIMITS.get(backend, (None, None))
+                self._limiters[key] = BackendLimiter(max_concurrency, requests_per_minute)
+            return self._limiters[key]
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._loop_clients.clear()
+            self._limiters.clear()
+
+# Registro compartido por todas las partidas del proceso
+CLIENTS = ClientRegistry()
+
+def run_async(coroutine):
+    """asyncio.run() que al terminar cierra los clientes asíncronos creados en su bucle."""
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await CLIENTS.close_loop_clients()
+    return asyncio.run(run_and_close())
+
 # --- Clases de Modelos de IA ---
 
+def estimate_tokens(text):
+    """Estimación aproximada de tokens (~4 caracteres por token) cuando el backend no los informa."""
+    return max(1, len(text) // 4) if text else 0
+
+async def iterate_in_thread(iterator):
+    """
+    Recorre un iterador síncrono (p. ej. el stream de un SDK sin cliente asíncrono) en un hilo
+    del ejecutor y entrega sus elementos al bucle de eventos. Si el consumidor deja de leer,
+    el hilo se detiene y cierra el iterador al recibir el siguiente elemento.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        try:
+            loop.call_soon_threadsafe(items.put_nowait, (item, error))
+        except RuntimeError:
+            stopped.set() # El bucle ya se cerró
+
+    def produce():
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                put(item)
+        except Exception as e:
+            put(done, e)
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+        put(done)
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item, error = await items.get()
+            if item is done:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+class ModelUnavailable(RuntimeError):
+    """El modelo no existe en su backend, o el backend no responde o rechaza la API key."""
+
+def import_sdk(module_name, package):
+    """
+    Importa el SDK de un proveedor al seleccionar uno de sus modelos. Si no está instalado lanza
+    ValueError (el mismo error que un argumento de modelo mal escrito) indicando qué instalar.
+    """
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        raise ValueError(f"Falta el paquete '{package}' para usar este modelo; instálalo con: uv add {package}") from e
+
 class BaseModel:
     def __init__(self, name):
         self.name = name
 
-    def generate(self, prompt, **kwargs):
+    def warmup(self):
+        """
+        Comprueba que el modelo está disponible y, si el backend lo permite, lo deja cargado en
+        memoria para que la primera llamada de la partida no pague el arranque en frío. Lanza
+        ModelUnavailable si no lo está. Por defecto no hace nada.
+        """
+
+    def chat(self, messages, system=None, usage=None, **kwargs):
+        """
+        Genera la respuesta a los mensajes {'role', 'content'} y rellena `usage` con los tokens si se pasa.
+        Admite `response_schema` (salida JSON), `max_tokens` y `choices` (restringir a una de esas palabras)
+        en los backends que lo permiten.
+        """
         raise NotImplementedError
 
+    def chat_stream(self, messages, system=None, usage=None, **kwargs):
+        """Como chat(), pero por fragmentos. Por defecto emite la respuesta completa de una vez."""
+        yield self.chat(messages, system=system, usage=usage, **kwargs)
+
+    async def achat(self, messages, system=None, usage=None, **kwargs):
+        """Versión asíncrona de chat(). Por defecto ejecuta chat() en un hilo del ejecutor."""
+        return await asyncio.to_thread(self.chat, messages, system=system, usage=usage, **kwargs)
+
+    async def achat_stream(self, messages, system=None, usage=None, **kwargs):
+        """Versión asíncrona de chat_stream(). Por defecto recorre el stream síncrono en un hilo."""
+        async for chunk in iterate_in_thread(self.chat_stream(messages, system=system, usage=usage, **kwargs)):
+            yield chunk
+
+    def generate(self, prompt, **kwargs):
+        return self.chat([{'role': 'user', 'content': prompt}], **kwargs)
+
+    def generate_stream(self, prompt, **kwargs):
+        """Genera la respuesta a un único prompt por fragmentos."""
+        yield from self.chat_stream([{'role': 'user', 'content': prompt}], **kwargs)
+
+    @staticmethod
+    def _messages(messages, system):
+        """Lista de mensajes con el system prompt como primer mensaje (APIs de estilo OpenAI/Ollama)."""
+        if system:
+            return [{'role': 'system', 'content': system}] + list(messages)
+        return list(messages)
+
+    def start_session(self, system_prompt=None, messages=None):
+        """Abre una conversación multi-turno con este modelo."""
+        return ChatSession(self, system_prompt, messages)
+
+class ChatSession:
+    """
+    Conversación multi-turno con un modelo. El system prompt va en su propio rol y cada turno
+    se añade como mensaje, de modo que el prefijo de la conversación no cambia entre turnos y
+    el backend puede reutilizar su caché en lugar de procesar de nuevo todo el prompt.
+    """
+    def __init__(self, model, system_prompt=None, messages=None):
+        self.model = model
+        self.system_prompt = system_prompt
+        self.messages = list(messages) if messages else []
+        self.turn_usage = [] # Un diccionario de uso por llamada al modelo
+
+    def _record_usage(self, usage, new_content, response):
+        if usage.get('prompt_tokens') is None:
+            # El backend no informó (p. ej. stream cortado antes del final): se estima el contexto completo
+            context = (self.system_prompt or "") + "".join(m['content'] for m in self.messages[:-1])
+            usage['prompt_tokens'] = estimate_tokens(context)
+            usage['estimated'] = True
+        if usage.get('completion_tokens') is None:
+            usage['completion_tokens'] = estimate_tokens(response)
+        usage['new_tokens'] = estimate_tokens(new_content)
+        self.turn_usage.append(usage)
+
+    def send(self, content, **kwargs):
+        """Envía un mensaje del usuario y retorna la respuesta completa del modelo."""
+        self.messages.append({'role': 'user', 'content': content})
+        usage = {}
+        response = self.model.chat(self.messages, system=self.system_prompt, usage=usage, **kwargs)
+        self.messages.append({'role': 'assistant', 'content': response})
+        self._record_usage(usage, content, response)
+        return response
+
+    def send_stream(self, content, **kwargs):
+        """
+        Envía un mensaje del usuario y emite la respuesta por fragmentos. Si el consumidor deja
+        de leer, en el historial queda solo la parte de la respuesta ya recibida.
+        """
+        self.messages.append({'role': 'user', 'content': content})
+        usage = {}
+        received = []
+        stream = self.model.chat_stream(self.messages, system=self.system_prompt, usage=usage, **kwargs)
+        try:
+            for chunk in stream:
+                received.append(chunk)
+                yield chunk
+        finally:
+            stream.close()
+            response = "".join(received)
+            self.messages.append({'role': 'assistant', 'content': response})
+            self._record_usage(usage, content, response)
+
+    async def asend_stream(self, content, **kwargs):
+        """Versión asíncrona de send_stream()."""
+        self.messages.append({'role': 'user', 'content': content})
+        usage = {}
+        received = []
+        stream = self.model.achat_stream(self.messages, system=self.system_prompt, usage=usage, **kwargs)
+        try:
+            async for chunk in stream:
+                received.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+            response = "".join(received)
+            self.messages.append({'role': 'assistant', 'content': response})
+            self._record_usage(usage, content, response)
+
+    def record(self, content, response):
+        """Añade un turno ya resuelto (p. ej. servido desde una caché) sin llamar al modelo."""
+        self.messages.append({'role': 'user', 'content': content})
+        self.messages.append({'role': 'assistant', 'content': response})
+
+    @property
+    def last_prompt_tokens(self):
+        return self.turn_usage[-1]['prompt_tokens'] if self.turn_usage else 0
+
+    @property
+    def total_prompt_tokens(self):
+        return sum(u['prompt_tokens'] for u in self.turn_usage)
+
 class OllamaModel(BaseModel):
     def __init__(self, name, base_url):
         super().__init__(name)
-        self.client = ollama.Client(host=base_url)
+        ollama = import_sdk("ollama", "ollama") # El SDK solo se importa si se usa un modelo de Ollama
+        self.ollama = ollama
+        self.base_url = base_url
+        # Un cliente (y su pool de conexiones) por servidor, compartido por todos sus modelos
+        self.client = CLIENTS.client("ollama", base_url, None, lambda: ollama.Client(host=base_url))
+        self.limiter = CLIENTS.limiter("ollama", base_url)
 
-    def generate(self, prompt, **kwargs):
-        response = self.client.chat(
-            model=self.name,
-            messages=[{'role': 'user', 'content': prompt}],
-            options=kwargs.get('options', {})
-        )
+    @staticmethod
+    def _fill_usage(usage, response):
+        # prompt_eval_count solo cuenta los tokens que no estaban ya en la caché KV del servidor
+        if usage is not None:
+            usage['prompt_tokens'] = response.get('prompt_eval_count')
+            usage['completion_tokens'] = response.get('eval_count')
+
+    def _arguments(self, messages, system, kwargs):
+        options = dict(kwargs.get('options', {}))
+        if kwargs.get('max_tokens'):
+            options['num_predict'] = kwargs['max_tokens']
+        response_format = kwargs.get('response_schema')
+        if not response_format and kwargs.get('choices'):
+            # La gramática solo admite una de las palabras, entre comillas (es un string JSON)
+            response_format = {"type": "string", "enum": list(kwargs['choices'])}
+        return {
+            "model": self.name,
+            "messages": self._messages(messages, system),
+            "options": options,
+            "format": response_format,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+        }
+
+    def warmup(self):
+        # Sin reintentos: un modelo que falta o un servidor caído deben detectarse al momento
+        try:
+            self.client.show(self.name)
+        except Exception as e:
+            if getattr(e, 'status_code', None) == 404:
+                raise ModelUnavailable(f"El modelo '{self.name}' no está en el servidor Ollama ({self.base_url}){self._available_models()}. "
+                                       f"Descárgalo con: ollama pull {self.name}") from e
+            raise ModelUnavailable(f"No se puede consultar el modelo '{self.name}' en Ollama ({self.base_url}): {e}") from e
+        try:
+            # Una petición sin prompt solo carga los pesos en memoria; keep_alive los mantiene cargados
+            self.client.generate(model=self.name, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+        except Exception as e:
+            raise ModelUnavailable(f"Ollama ({self.base_url}) no ha podido cargar el modelo '{self.name}': {e}") from e
+
+    def _available_models(self):
+        try:
+            names = [model.get('model') or model.get('name') for model in self.client.list()['models']]
+        except Exception:
+            return ""
+        return f" (disponibles: {', '.join(names)})" if names else " (no hay ningún modelo descargado)"
+
+    def _async_client(self):
+        return CLIENTS.loop_client("ollama", self.base_url, lambda: self.ollama.AsyncClient(host=self.base_url))
+
+    def chat(self, messages, system=None, usage=None, **kwargs):
+        response = self.limiter.call(self.client.chat, **self._arguments(messages, system, kwargs))
+        self._fill_usage(usage, response)
+        return response['message']['content']
+
+    def _content(self, chunk, usage):
+        """Texto de un fragmento del stream; el último trae el uso de tokens."""
+        if chunk.get('done'):
+            self._fill_usage(usage, chunk)
+        return chunk['message']['content']
+
+    def chat_stream(self, messages, system=None, usage=None, **kwargs):
+        stream = self.limiter.stream(lambda: self.client.chat(stream=True, **self._arguments(messages, system, kwargs)))
+        for chunk in stream:
+            content = self._content(chunk, usage)
+            if content:
+                yield content
+
+    async def achat(self, messages, system=None, usage=None, **kwargs):
+        response = await self.limiter.acall(self._async_client().chat, **self._arguments(messages, system, kwargs))
+        self._fill_usage(usage, response)
         return response['message']['content']
 
+    async def achat_stream(self, messages, system=None, usage=None, **kwargs):
+        client = self._async_client()
+        stream = self.limiter.astream(lambda: client.chat(stream=True, **self._arguments(messages, system, kwargs)))
+        try:
+            async for chunk in stream:
+                content = self._content(chunk, usage)
+                if content:
+                    yield content
+        finally:
+            await stream.aclose()
+
+# Modelos de Gemini que razonan antes de responder
+GEMINI_THINKING_PREFIXES = ("gemini-2.5", "gemini-3")
+
 class GeminiModel(BaseModel):
     def __init__(self, name, api_key):
         super().__init__(name)
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name=name)
+        genai = import_sdk("google.generativeai", "google-generativeai") # Es la importación más lenta: solo si se usa Gemini
+        # En el registro la API key se identifica por su hash, nunca en claro
+        self.key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
 
-    def generate(self, prompt, **kwargs):
-        generation_config = kwargs.get('generation_config', {})
+        def configure():
+            # La configuración de genai es global al proceso: se hace una sola vez por API key
+            genai.configure(api_key=api_key)
+            return genai
+
+        self.genai = CLIENTS.client("gemini", self.key_id, None, configure)
+        self.limiter = CLIENTS.limiter("gemini", self.key_id)
+        self.model = self._model_for(None)
+
+    def _model_for(self, system):
+        """
+        El system prompt va en system_instruction; se reutiliza un GenerativeModel por cada
+        (modelo, system prompt) en todo el proceso.
+        """
+        def create():
+            if system:
+                return self.genai.GenerativeModel(model_name=self.name, system_instruction=system)
+            return self.genai.GenerativeModel(model_name=self.name)
+        return CLIENTS.client("gemini", self.key_id, (self.name, system), create)
+
+    def warmup(self):
+        # Gemini no tiene pesos que cargar: basta con comprobar que el modelo existe y la API key vale
+        try:
+            self.genai.get_model(f"models/{self.name}")
+        except Exception as e:
+            problem = "no existe" if type(e).__name__ == "NotFound" else "no está disponible con esta API key"
+            raise ModelUnavailable(f"El modelo de Gemini '{self.name}' {problem}: {e}") from e
+
+    @staticmethod
+    def _contents(messages):
+        return [
+            {'role': 'model' if m['role'] == 'assistant' else 'user', 'parts': [m['content']]}
+            for m in messages
+        ]
+
+    @staticmethod
+    def _schema(schema):
+        """Adapta un JSON Schema al subconjunto OpenAPI de Gemini (tipos en mayúsculas, sin claves no soportadas)."""
+        if isinstance(schema, dict):
+            return {
+                key: (value.upper() if key == 'type' else GeminiModel._schema(value))
+                for key, value in schema.items()
+                if key not in ('additionalProperties', '$schema', 'title')
+            }
+        if isinstance(schema, list):
+            return [GeminiModel._schema(item) for item in schema]
+        return schema
+
+    @property
+    def thinks(self):
+        """True si el modelo razona antes de responder (Gemini 2.5 en adelante)."""
+        return self.name.startswith(GEMINI_THINKING_PREFIXES) or "thinking" in self.name
+
+    def _generation_config(self, kwargs):
+        generation_config = dict(kwargs.get('generation_config', {}))
+        if kwargs.get('response_schema'):
+            generation_config['response_mime_type'] = 'application/json'
+            generation_config['response_schema'] = self._schema(kwargs['response_schema'])
+        elif kwargs.get('choices'):
+            generation_config['response_mime_type'] = 'text/x.enum'
+            generation_config['response_schema'] = {'type': 'STRING', 'enum': list(kwargs['choices'])}
+        # Los tokens de razonamiento cuentan en max_output_tokens y este SDK no permite desactivarlo:
+        # con un límite pequeño el modelo lo gastaría pensando y la respuesta llegaría vacía
+        if kwargs.get('max_tokens') and not self.thinks:
+            generation_config['max_output_tokens'] = kwargs['max_tokens']
+        return generation_config
+
+    @staticmethod
+    def _fill_usage(usage, response):
+        metadata = getattr(response, 'usage_metadata', None)
+        if usage is not None and metadata is not None:
+            # Los tokens servidos desde la caché implícita de Gemini no se vuelven a procesar
+            cached = getattr(metadata, 'cached_content_token_count', 0) or 0
+            usage['prompt_tokens'] = metadata.prompt_token_count - cached
+            usage['cached_tokens'] = cached
+            usage['completion_tokens'] = metadata.candidates_token_count
+
+    def chat(self, messages, system=None, usage=None, **kwargs):
+        generation_config = self._generation_config(kwargs)
         safety_settings = kwargs.get('safety_settings', [])
-        response = self.model.generate_content(
-            prompt,
+        response = self.limiter.call(
+            self._model_for(system).generate_content,
+            self._contents(messages),
             generation_config=generation_config,
             safety_settings=safety_settings
         )
+        self._fill_usage(usage, response)
         return response.text
 
-def load_model(model_arg, api_key, ollama_base_url):
-    """Carga un modelo de IA basado en el argumento de línea de comandos."""
+    def chat_stream(self, messages, system=None, usage=None, **kwargs):
+        generation_config = self._generation_config(kwargs)
+        safety_settings = kwargs.get('safety_settings', [])
+        response = self.limiter.stream(lambda: self._model_for(system).generate_content(
+            self._contents(messages),
+            generation_config=generation_config,
+            safety_settings=safety_settings,
+            stream=True
+        ))
+        for chunk in response:
+            content = self._content(chunk, usage)
+            if content:
+                yield content
+
+    def _content(self, chunk, usage):
+        self._fill_usage(usage, chunk)
+        try:
+            return chunk.text
+        except ValueError:
+            return "" # Fragmento sin texto (p. ej. solo metadatos de seguridad)
+
+    async def achat(self, messages, system=None, usage=None, **kwargs):
+        response = await self.limiter.acall(
+            self._model_for(system).generate_content_async,
+            self._contents(messages),
+            generation_config=self._generation_config(kwargs),
+            safety_settings=kwargs.get('safety_settings', [])
+        )
+        self._fill_usage(usage, response)
+        return response.text
+
+    async def achat_stream(self, messages, system=None, usage=None, **kwargs):
+        stream = self.limiter.astream(lambda: self._model_for(system).generate_content_async(
+            self._contents(messages),
+            generation_config=self._generation_config(kwargs),
+            safety_settings=kwargs.get('safety_settings', []),
+            stream=True
+        ))
+        try:
+            async for chunk in stream:
+                content = self._content(chunk, usage)
+                if content:
+                    yield content
+        finally:
+            await stream.aclose()
+
+class OpenAICompatibleModel(BaseModel):
+    """
+    Modelo servido por una API compatible con OpenAI (/chat/completions): OpenAI o servidores
+    locales como llama.cpp, vLLM o LM Studio. Usa urllib, así que no necesita ningún SDK.
+    """
+    def __init__(self, name, base_url, api_key=None):
+        super().__init__(name)
+        self.base_url = base_url.rstrip("/")
+        self.url = self.base_url + "/chat/completions"
+        self.api_key = api_key
+        self.limiter = CLIENTS.limiter("openai", base_url)
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def warmup(self):
+        """
+        Comprueba que el servidor responde y acepta la API key. No se comprueba el nombre del
+        modelo: los servidores locales (llama.cpp, LM Studio) sirven su modelo con cualquier nombre.
+        """
+        import urllib.error
+        import urllib.request
+        request = urllib.request.Request(self.base_url + "/models", headers=self._headers())
+        try:
+            urllib.request.urlopen(request, timeout=WARMUP_TIMEOUT).close()
+        except urllib.error.HTTPError as e:
+            if e.code in (401, 403):
+                raise ModelUnavailable(f"{self.base_url} rechaza la API key (HTTP {e.code}).") from e
+            # Cualquier otra respuesta HTTP (p. ej. 404 si no implementa /models) indica que el servidor está
+        except OSError as e:
+            raise ModelUnavailable(f"No se puede conectar con {self.base_url}: {e}") from e
+
+    def _request(self, messages, system, stream, kwargs):
+        body = {"model": self.name, "messages": self._messages(messages, system), "stream": stream}
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        if kwargs.get('response_schema'):
+            body["response_format"] = {"type": "json_schema", "json_schema": {"name": "respuesta", "schema": kwargs['response_schema']}}
+        # `choices` no tiene equivalente portable (json_schema exige un objeto): basta con max_tokens
+        if kwargs.get('max_tokens'):
+            body["max_tokens"] = kwargs['max_tokens']
+        import urllib.request # Importa http.client y ssl: solo si se usa este proveedor
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode("utf-8"), headers=self._headers())
+        return urllib.request.urlopen(request, timeout=OPENAI_TIMEOUT)
+
+    @staticmethod
+    def _fill_usage(usage, payload):
+        if usage is not None and payload.get("usage"):
+            usage['prompt_tokens'] = payload["usage"].get("prompt_tokens")
+            usage['completion_tokens'] = payload["usage"].get("completion_tokens")
+
+    def chat(self, messages, system=None, usage=None, **kwargs):
+        def call():
+            with self._request(messages, system, False, kwargs) as response:
+                return json.load(response)
+        payload = self.limiter.call(call)
+        self._fill_usage(usage, payload)
+        return payload["choices"][0]["message"]["content"]
+
+    def chat_stream(self, messages, system=None, usage=None, **kwargs):
+        def events():
+            # Eventos SSE: una línea "data: {json}" por fragmento y "data: [DONE]" al final
+            with self._request(messages, system, True, kwargs) as response:
+                for line in response:
+                    line = line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    yield json.loads(data)
+        for payload in self.limiter.stream(events):
+            self._fill_usage(usage, payload)
+            for choice in payload.get("choices", []):
+                content = choice.get("delta", {}).get("content")
+                if content:
+                    yield content
+
+class AnthropicModel(BaseModel):
+    """
+    Modelo de Anthropic (Messages API). El SDK `anthropic` solo se importa al seleccionarlo.
+    No se pide salida estructurada nativa: el prompt ya exige el JSON y extract_json_object lo recupera.
+    """
+    def __init__(self, name, api_key):
+        super().__init__(name)
+        anthropic = import_sdk("anthropic", "anthropic")
+        key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+        self.client = CLIENTS.client("anthropic", key_id, None, lambda: anthropic.Anthropic(api_key=api_key))
+        self.limiter = CLIENTS.limiter("anthropic", key_id)
+
+    def warmup(self):
+        models = getattr(self.client, "models", None)
+        if models is None:
+            return # Versión del SDK sin la API de modelos: no se puede comprobar
+        try:
+            models.retrieve(self.name)
+        except Exception as e:
+            problem = "no existe" if type(e).__name__ == "NotFoundError" else "no está disponible con esta API key"
+            raise ModelUnavailable(f"El modelo de Anthropic '{self.name}' {problem}: {e}") from e
+
+    def _arguments(self, messages, system, kwargs):
+        arguments = {"model": self.name, "messages": list(messages), "max_tokens": kwargs.get('max_tokens') or ANTHROPIC_MAX_TOKENS}
+        if system:
+            arguments["system"] = system
+        return arguments
+
+    @staticmethod
+    def _fill_usage(usage, message):
+        if usage is not None and getattr(message, "usage", None) is not None:
+            usage['prompt_tokens'] = message.usage.input_tokens
+            usage['completion_tokens'] = message.usage.output_tokens
+
+    def chat(self, messages, system=None, usage=None, **kwargs):
+        message = self.limiter.call(self.client.messages.create, **self._arguments(messages, system, kwargs))
+        self._fill_usage(usage, message)
+        return "".join(block.text for block in message.content if getattr(block, "type", "") == "text")
+
+    def chat_stream(self, messages, system=None, usage=None, **kwargs):
+        def texts():
+            with self.client.messages.stream(**self._arguments(messages, system, kwargs)) as stream:
+                yield from stream.text_stream
+                self._fill_usage(usage, stream.get_final_message())
+        yield from self.limiter.stream(texts)
+
+# --- Cassette de Grabación/Reproducción de Llamadas ---
+
+class CassetteMiss(LookupError):
+    """La llamada no está grabada en el cassette y el modo es 'replay'."""
+
+class Cassette:
+    """
+    Almacén en disco de respuestas de modelos: un archivo JSONL solo de añadido con las entradas
+    y un índice (clave -> desplazamiento) en `<ruta>.idx`. El índice se carga la primera vez que
+    se necesita y cada respuesta se lee con un único seek, de modo que la búsqueda es O(1).
+    Opcionalmente expulsa las entradas más antiguas por número (max_entries) o por edad en segundos (max_age).
+    """
+    def __init__(self, path, max_entries=None, max_age=None):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._index = None # clave -> [desplazamiento, longitud, creado]
+        self._dead_bytes = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name, messages, system, options):
+        payload = json.dumps(
+            {"model": model_name, "system": system, "messages": messages, "options": options},
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _data_size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        data_size = self._data_size()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            # El índice solo es válido si corresponde al archivo de datos actual
+            if stored.get("data_size") == data_size:
+                self._index = stored["entries"]
+                self._dead_bytes = stored.get("dead_bytes", 0)
+                return
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        self._index = {}
+        self._dead_bytes = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r+b") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Cola a medio escribir: se recorta para que el siguiente put no se pegue a ella
+                    f.truncate(offset)
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    entry = None # Línea truncada por una escritura interrumpida
+                if entry is not None:
+                    if entry["key"] in self._index:
+                        self._dead_bytes += self._index[entry["key"]][1]
+                    self._index[entry["key"]] = [offset, len(line), entry["created"]]
+                else:
+                    self._dead_bytes += len(line)
+                offset += len(line)
+        self._dirty = True
+
+    def _expired(self, created):
+        return self.max_age is not None and time.time() - created > self.max_age
+
+    def get(self, key):
+        """Retorna la entrada grabada para la clave o None si no existe o ha caducado."""
+        with self._lock:
+            self._ensure_index()
+            location = self._index.get(key)
+            if location is None:
+                return None
+            offset, length, created = location
+            if self._expired(created):
+                self._forget(key)
+                return None
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length))
+
+    def put(self, key, model_name, response, usage=None):
+        entry = {"key": key, "model": model_name, "created": time.time(), "response": response, "usage": usage or {}}
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._ensure_index()
+            if key in self._index:
+                self._forget(key)
+            offset = self._data_size()
+            with open(self.path, "ab") as f:
+                f.write(line)
+            self._index[key] = [offset, len(line), entry["created"]]
+            self._dirty = True
+            self._evict()
+
+    def _forget(self, key):
+        self._dead_bytes += self._index.pop(key)[1]
+        self._dirty = True
+
+    def _evict(self):
+        if self.max_age is not None:
+            for key in [k for k, (_, _, created) in self._index.items() if self._expired(created)]:
+                self._forget(key)
+        if self.max_entries is not None and len(self._index) > self.max_entries:
+            oldest = sorted(self._index, key=lambda k: self._index[k][2])
+            for key in oldest[:len(self._index) - self.max_entries]:
+                self._forget(key)
+        # Se compacta cuando la mitad del archivo son entradas expulsadas o sustituidas
+        if self._dead_bytes and self._dead_bytes > self._data_size() // 2:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        new_index = {}
+        with open(self.path, "rb") as source, open(tmp_path, "wb") as target:
+            for key, (offset, length, created) in sorted(self._index.items(), key=lambda item: item[1][0]):
+                source.seek(offset)
+                new_index[key] = [target.tell(), length, created]
+                target.write(source.read(length))
+        os.replace(tmp_path, self.path)
+        self._index = new_index
+        self._dead_bytes = 0
+        self._dirty = True
+
+    def flush(self):
+        """Guarda el índice en disco si ha cambiado."""
+        with self._lock:
+            if self._index is None or not self._dirty:
+                return
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"data_size": self._data_size(), "dead_bytes": self._dead_bytes, "entries": self._index}, f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+
+    def close(self):
+        self.flush()
+
+class CassetteModel(BaseModel):
+    """
+    Envuelve cualquier BaseModel para grabar o reproducir sus llamadas.
+    - record: sirve desde el cassette si la llamada ya está grabada; si no, llama al modelo y la graba.
+    - replay: solo sirve desde el cassette; una llamada no grabada lanza CassetteMiss.
+    - passthrough: llama siempre al modelo sin tocar el cassette.
+    """
+    MODES = ("record", "replay", "passthrough")
+
+    def __init__(self, inner, cassette, mode="record"):
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de cassette no soportado: {mode}. Use uno de {', '.join(self.MODES)}.")
+        super().__init__(inner.name)
+        self.inner = inner
+        self.cassette = cassette
+        self.mode = mode
+
+    def warmup(self):
+        # En modo replay el modelo interno es un BaseModel sin backend y no hace nada
+        self.inner.warmup()
+
+    def _lookup(self, messages, system, usage, kwargs):
+        key = Cassette.make_key(self.name, messages, system, kwargs)
+        entry = self.cassette.get(key)
+        if entry is None and self.mode == "replay":
+            raise CassetteMiss(f"No hay respuesta grabada para esta llamada a {self.name}.")
+        if entry is not None and usage is not None:
+            usage.update(entry["usage"])
+        return key, entry
+
+    def chat(self, messages, system=None, usage=None, **kwargs):
+        if self.mode == "passthrough":
+            return self.inner.chat(messages, system=system, usage=usage, **kwargs)
+        key, entry = self._lookup(messages, system, usage, kwargs)
+        if entry is not None:
+            return entry["response"]
+        inner_usage = {}
+        response = self.inner.chat(messages, system=system, usage=inner_usage, **kwargs)
+        self.cassette.put(key, self.name, response, inner_usage)
+        if usage is not None:
+            usage.update(inner_usage)
+        return response
+
+    def chat_stream(self, messages, system=None, usage=None, **kwargs):
+        if self.mode == "passthrough":
+            yield from self.inner.chat_stream(messages, system=system, usage=usage, **kwargs)
+            return
+        key, entry = self._lookup(messages, system, usage, kwargs)
+        if entry is not None:
+            yield entry["response"]
+            return
+        # Se graba lo recibido aunque el consumidor corte el stream: es justo lo que usó la partida
+        inner_usage = {}
+        received = []
+        completed = False
+        stream = self.inner.chat_stream(messages, system=system, usage=inner_usage, **kwargs)
+        try:
+            for chunk in stream:
+                received.append(chunk)
+                yield chunk
+            completed = True
+        except GeneratorExit:
+            completed = True
+            raise
+        finally:
+            stream.close()
+            if completed:
+                self.cassette.put(key, self.name, "".join(received), inner_usage)
+            if usage is not None:
+                usage.update(inner_usage)
+
+    async def achat_stream(self, messages, system=None, usage=None, **kwargs):
+        if self.mode != "passthrough":
+            key, entry = self._lookup(messages, system, usage, kwargs)
+            if entry is not None:
+                yield entry["response"]
+                return
+        inner_usage = {} if self.mode != "passthrough" else usage
+        received = []
+        completed = False
+        stream = self.inner.achat_stream(messages, system=system, usage=inner_usage, **kwargs)
+        try:
+            async for chunk in stream:
+                received.append(chunk)
+                yield chunk
+            completed = True
+        except GeneratorExit:
+            completed = True
+            raise
+        finally:
+            await stream.aclose()
+            if self.mode != "passthrough":
+                if completed:
+                    self.cassette.put(key, self.name, "".join(received), inner_usage)
+                if usage is not None:
+                    usage.update(inner_usage)
+
+# --- Modelo Sintético (benchmarks sin red) ---
+
+class SyntheticModel(BaseModel):
+    """
+    Modelo local que imita al Juez y al Detective sin red, para medir el coste de la orquestación, con
+    latencia, tamaño de respuesta, tasa de JSON roto (malformed_rate) y de acierto (solve_rate) configurables.
+    """
+    SOLUTION = "El hombre murió al caer del tren en marcha mientras dormía en el vagón."
+    FILLER = "El viento soplaba sobre el campo mientras alguien observaba en silencio. "
+
+    def __init__(self, name="synthetic", latency=0.0, latency_jitter=0.0, response_chars=400,
+                 response_chars_stddev=0.0, malformed_rate=0.0, solve_rate=0.0, chunk_chars=16, seed=None):
+        super().__init__(name)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.response_chars = response_chars
+        self.response_chars_stddev = response_chars_stddev
+        self.malformed_rate = malformed_rate
+        self.solve_rate = solve_rate
+        self.chunk_chars = chunk_chars
+        self.random = random.Random(seed)
+        self._lock = threading.Lock() # random.Random no es seguro entre hilos
+
+    def _filler(self):
+        with self._lock:
+            size = max(0, int(self.random.gauss(self.response_chars, self.response_chars_stddev)))
+        return (self.FILLER * (size // len(self.FILLER) + 1))[:size]
+
+    def _chance(self, probability):
+        with self._lock:
+            return self.random.random() < probability
+
+    def _latency(self):
+        if not (self.latency or self.latency_jitter):
+            return 0.0
+        with self._lock:
+            jitter = self.random.uniform(-self.latency_jitter, self.latency_jitter)
+        return max(0.0, self.latency + jitter)
+
+    def _wait(self):
+        latency = self._latency()
+        if latency:
+            time.sleep(latency)
+
+    def warmup(self):
+        self._wait() # Simula la carga con la misma latencia que una llamada
+
+    def _json_block(self, payload):
+        body = json.dumps(payload, ensure_ascii=False, indent=4)
+        if self._chance(self.malformed_rate):
+            body = body[:len(body) // 2] # JSON cortado a la mitad
+        return f"```json\n{body}\n```"
+
+    def _respond(self, messages, system):
+        prompt = messages[-1]['content'] if messages else ""
+        if system and "IA Juez" in system:
+            if "Pregunta del Detective" in prompt:
+                with self._lock:
+                    return self.random.choice(VALID_JUDGE_ANSWERS)
+            return self._json_block({"HISTORIA_CORTA": "Un hombre aparece muerto en medio de un campo.",
+                                     "HISTORIA_LARGA": self._filler(), "SOLUCION": self.SOLUTION})
+        if "DEBES intentar una solución" in prompt or self._chance(self.solve_rate):
+            action, text = "SOLUCION", self.SOLUTION
+        else:
+            action, text = "PREGUNTA", "¿Había alguien más en el campo?"
+        return self._json_block({"RAZONAMIENTO": self._filler(), "TIPO": action, "TEXTO": text})
+
+    def _complete(self, messages, system, usage):
+        response = self._respond(messages, system)
+        if usage is not None:
+            prompt_chars = len(system or "") + sum(len(m['content']) for m in messages)
+            usage['prompt_tokens'] = prompt_chars // 4
+            usage['completion_tokens'] = estimate_tokens(response)
+        return response
+
+    def chat(self, messages, system=None, usage=None, **kwargs):
+        self._wait()
+        return self._complete(messages, system, usage)
+
+    def chat_stream(self, messages, system=None, usage=None, **kwargs):
+        response = self.chat(messages, system=system, usage=usage, **kwargs)
+        for i in range(0, len(response), self.chunk_chars):
+            yield response[i:i + self.chunk_chars]
+
+    async def achat(self, messages, system=None, usage=None, **kwargs):
+        # La latencia se simula sin bloquear el bucle de eventos
+        await asyncio.sleep(self._latency())
+        return self._complete(messages, system, usage)
+
+    async def achat_stream(self, messages, system=None, usage=None, **kwargs):
+        response = await self.achat(messages, system=system, usage=usage, **kwargs)
+        for i in range(0, len(response), self.chunk_chars):
+            yield response[i:i + self.chunk_chars]
+
+def parse_model_arg(model_arg):
+    """Separa el argumento de línea de comandos en (tipo de modelo, nombre del modelo)."""
     parts = model_arg.split(' ', 1)
     model_type = parts[0]
     model_name = parts[1].strip().strip('"') if len(parts) > 1 else model_type
+    return model_type, model_name
+
+# Proveedores de modelos por prefijo del tipo: (prefijo, fábrica, ejemplo de uso).
+# Cada fábrica recibe (tipo, nombre, ajustes) e importa su SDK solo cuando se selecciona.
+PROVIDERS = []
 
-    if model_type == "ollama":
-        if not ollama_base_url:
-            raise ValueError("OLLAMA_BASE_URL no está configurado en .env para modelos Ollama.")
-        return OllamaModel(model_name, ollama_base_url)
-    elif model_type.startswith("gemini"):
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY no está configurado en .env para modelos Gemini.")
-        return GeminiModel(model_name, api_key)
+def register_provider(prefix, usage):
+    """
+    Decorador que registra una fábrica de modelos para los tipos `prefix` o `prefix-...`
+    (p. ej. 'gemini' atiende a 'gemini-2.5-flash').
+    """
+    def decorator(factory):
+        PROVIDERS.append((prefix, factory, usage))
+        return factory
+    return decorator
+
+def find_provider(model_type):
+    """Retorna la fábrica registrada para el tipo de modelo (el prefijo más largo que encaje) o None."""
+    matches = [(prefix, factory) for prefix, factory, _ in PROVIDERS
+               if model_type == prefix or model_type.startswith(prefix + "-")]
+    return max(matches, key=lambda match: len(match[0]))[1] if matches else None
+
+@register_provider("ollama", 'ollama "nombre_modelo"')
+def ollama_provider(model_type, model_name, settings):
+    if not settings.get("ollama_base_url"):
+        raise ValueError("OLLAMA_BASE_URL no está configurado en .env para modelos Ollama.")
+    return OllamaModel(model_name, settings["ollama_base_url"])
+
+@register_provider("gemini", "gemini-nombre_modelo")
+def gemini_provider(model_type, model_name, settings):
+    if not settings.get("gemini_api_key"):
+        raise ValueError("GEMINI_API_KEY no está configurado en .env para modelos Gemini.")
+    return GeminiModel(model_name, settings["gemini_api_key"])
+
+@register_provider("openai", 'openai "nombre_modelo"')
+def openai_provider(model_type, model_name, settings):
+    return OpenAICompatibleModel(model_name, settings.get("openai_base_url") or OPENAI_BASE_URL, settings.get("openai_api_key"))
+
+@register_provider("anthropic", 'anthropic "nombre_modelo"')
+def anthropic_provider(model_type, model_name, settings):
+    if not settings.get("anthropic_api_key"):
+        raise ValueError("ANTHROPIC_API_KEY no está configurado en .env para modelos de Anthropic.")
+    return AnthropicModel(model_name, settings["anthropic_api_key"])
+
+@register_provider("synthetic", "synthetic")
+def synthetic_provider(model_type, model_name, settings):
+    return SyntheticModel(model_name)
+
+def load_model(model_arg, api_key, ollama_base_url):
+    """Carga un modelo de IA basado en el argumento de línea de comandos."""
+    model_type, model_name = parse_model_arg(model_arg)
+    factory = find_provider(model_type)
+    if factory is None:
+        usages = ", ".join(f"'{usage}'" for _, _, usage in PROVIDERS)
+        raise ValueError(f"Tipo de modelo no soportado: {model_type}. Use uno de: {usages}.")
+    settings = {
+        "gemini_api_key": api_key,
+        "ollama_base_url": ollama_base_url,
+        "openai_base_url": OPENAI_BASE_URL,
+        "openai_api_key": OPENAI_API_KEY,
+        "anthropic_api_key": ANTHROPIC_API_KEY,
+    }
+    return factory(model_type, model_name, settings)
+
+def load_model_with_cassette(model_arg, cassette=None, cassette_mode="passthrough"):
+    """
+    Carga un modelo y, si hay cassette, lo envuelve en un CassetteModel.
+    En modo 'replay' no se construye ningún cliente: no hace falta backend ni API key.
+    """
+    if cassette is None or cassette_mode == "passthrough":
+        return load_model(model_arg, GEMINI_API_KEY, OLLAMA_BASE_URL)
+    if cassette_mode == "replay":
+        inner = BaseModel(parse_model_arg(model_arg)[1])
     else:
-        raise ValueError(f"Tipo de modelo no soportado: {model_type}. Use 'ollama \"nombre_modelo\"' o 'gemini-nombre_modelo'.")
+        inner = load_model(model_arg, GEMINI_API_KEY, OLLAMA_BASE_URL)
+    return CassetteModel(inner, cassette, cassette_mode)
+
+def warmup_models(models, on_ready=None):
+    """
+    Comprueba y precarga a la vez los modelos de `models` ({etiqueta: modelo}) con su warmup(),
+    cada uno en un hilo. Retorna {etiqueta: segundos que tardó en estar listo} y llama a
+    on_ready(etiqueta, segundos) a medida que terminan. Si alguno no está disponible lanza
+    ModelUnavailable en cuanto falla, sin esperar a los que siguen cargando.
+    """
+    finished = queue.Queue()
+
+    def warm(label, model):
+        start = time.perf_counter()
+        try:
+            model.warmup()
+            finished.put((label, time.perf_counter() - start, None))
+        except Exception as e:
+            finished.put((label, time.perf_counter() - start, e))
+
+    for label, model in models.items():
+        # Hilos daemon: si otro modelo falla, el programa puede terminar sin esperar a estos
+        threading.Thread(target=warm, args=(label, model), name=f"warmup-{label}", daemon=True).start()
+    load_times = {}
+    for _ in models:
+        label, seconds, error = finished.get()
+        if isinstance(error, ModelUnavailable):
+            raise error
+        if error is not None:
+            raise ModelUnavailable(f"{label}: {error}") from error
+        load_times[label] = seconds
+        if on_ready:
+            on_ready(label, seconds)
+    return load_times
+
+def prepare_models(model_args, model_loader):
+    """
+    Carga los modelos (uno por argumento distinto) y los comprueba y precarga a la vez con
+    warmup_models, mostrando el tiempo de carga de cada uno. Retorna {argumento: modelo};
+    lanza ValueError o ModelUnavailable si alguno no se puede usar.
+    """
+    models = {}
+    for model_arg in model_args:
+        if model_arg not in models:
+            models[model_arg] = model_loader(model_arg)
+    load_times = loading_animation("Comprobando y cargando los modelos...", warmup_models, models)
+    for model_arg, seconds in load_times.items():
+        print_color(f"Modelo {model_arg} listo en {seconds:.1f}s.", Fore.CYAN)
+    return models
 
 
 # --- Funciones de Utilidad para Estilo Visual ---
@@ -105,7 +1401,6 @@ def loading_animation(message, func, *args, **kwargs):
         sys.stdout.write('\r' + ' ' * (len(message) + 3) + '\r') # Limpiar la línea
         sys.stdout.flush()
 
-    import itertools # Importar itertools aquí para que esté dentro del scope de la función si es necesario, o al principio del archivo.
     t = threading.Thread(target=animate)
     t.start()
     
@@ -116,347 +1411,2591 @@ def loading_animation(message, func, *args, **kwargs):
         t.join()
     return result
 
+class StreamingBubble:
+    """
+    Bocadillo ASCII que se dibuja de forma incremental a medida que llega el texto.
+    Usa un ancho fijo porque no se conoce la longitud final del mensaje.
+    """
+    def __init__(self, speaker_name, color, width=60):
+        self.speaker_name = speaker_name
+        self.color = color
+        self.width = max(width, len(speaker_name) + 2)
+        self.pending = ""
+        self.opened = False
+
+    def _print_line(self, line):
+        print_color(f" | {line}{' ' * (self.width - len(line))} |", self.color)
+
+    def open(self):
+        if self.opened:
+            return
+        self.opened = True
+        print_color("  " + "_" * (self.width + 2), self.color)
+        print_color(f" / {self.speaker_name}:{' ' * (self.width - len(self.speaker_name))} \\", self.color)
+        print_color(" | " + " " * self.width + " |", self.color)
+
+    def feed(self, text):
+        """Añade texto y dibuja todas las líneas que ya están completas."""
+        self.open()
+        self.pending += text
+        lines = textwrap.wrap(self.pending, width=self.width)
+        # La última línea puede seguir creciendo; solo se dibujan las anteriores
+        for line in lines[:-1]:
+            self._print_line(line)
+        trailing_space = " " if self.pending[-1:].isspace() else ""
+        self.pending = (lines[-1] + trailing_space) if lines else ""
+
+    def close(self):
+        self.open()
+        for line in textwrap.wrap(self.pending, width=self.width):
+            self._print_line(line)
+        self.pending = ""
+        print_color(" | " + " " * self.width + " |", self.color)
+        print_color("  \\" + "_" * (self.width + 2) + "/", self.color)
+
 # --- Carga de Variables de Entorno ---
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Tiempo que Ollama mantiene el modelo (y su caché de contexto) cargado entre llamadas
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Proveedores opcionales: API compatible con OpenAI (también servidores locales) y Anthropic
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "300"))
+# Segundos de espera de las comprobaciones de disponibilidad que no cargan el modelo
+WARMUP_TIMEOUT = 10
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+ANTHROPIC_MAX_TOKENS = 4096
+
+def env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+# Límites por backend: (llamadas simultáneas, peticiones por minuto); None es sin límite
+BACKEND_LIMITS = {
+    "ollama": (env_int("OLLAMA_MAX_CONCURRENCY", 4), env_int("OLLAMA_REQUESTS_PER_MINUTE")),
+    "gemini": (env_int("GEMINI_MAX_CONCURRENCY", 8), env_int("GEMINI_REQUESTS_PER_MINUTE", 60)),
+    "openai": (env_int("OPENAI_MAX_CONCURRENCY", 8), env_int("OPENAI_REQUESTS_PER_MINUTE")),
+    "anthropic": (env_int("ANTHROPIC_MAX_CONCURRENCY", 8), env_int("ANTHROPIC_REQUESTS_PER_MINUTE", 50)),
+}
 
 # --- Configuración de la Carpeta de Prompts ---
 PROMPTS_DIR = "stories"
 os.makedirs(PROMPTS_DIR, exist_ok=True)
+# --- Prompts del Sistema ---
 
-# --- Lógica Principal del Juego ---
-
-def main():
-    parser = argparse.ArgumentParser(description="Juego Black Story CLI con IA Juez y Detective.")
-    parser.add_argument("-m1", required=True, help="Modelo para la IA Juez (ej. 'ollama \"gemma3:270m\"' o 'gemini-2.5-flash')")
-    parser.add_argument("-m2", required=True, help="Modelo para la IA Detective (ej. 'ollama \"qwen3\"' o 'gemini-2.5-flash')")
-    args = parser.parse_args()
+JUDGE_SYSTEM_PROMPT = textwrap.dedent("""
+    Eres la IA Juez en un juego de Black Story. Tu rol es crear un misterio y responder a las preguntas del Detective.
+    Restricciones CRÍTICAS:
+    1.  Idioma de Salida: SIEMPRE en Castellano.
+    2.  Creación de Historia: Genera una versión CORTA (para el diálogo), una versión LARGA (para el registro) y la SOLUCIÓN SECRETA.
+        La historia debe ser de COMPLEJIDAD BAJA/MEDIA, requiriendo 2-3 preguntas clave para deducir la solución.
+        Evita soluciones obvias o basadas en un único hecho.
+        Formato de salida para la creación de historia:
+        ```json
+        {
+            "HISTORIA_CORTA": "[Tu historia corta aquí]",
+            "HISTORIA_LARGA": "[Tu historia larga aquí]",
+            "SOLUCION": "[La solución secreta aquí]"
+        }
+        ```
+        Asegúrate de que tu respuesta contenga ÚNICAMENTE el bloque de código JSON con el formato especificado, sin texto introductorio ni de cierre.
+    3.  Regla de Respuesta a Preguntas: Cuando el Detective haga una pregunta, DEBES responder ESTRICTAMENTE con una de estas tres palabras: 'Sí', 'No', o 'Irrelevante'. Tu respuesta DEBE basarse ÚNICAMENTE en la 'Historia Larga' y la 'Solución' que te han sido proporcionadas. NO generes texto adicional, explicaciones, ni JSON. Solo la palabra clave.
+    4.  No uses emojis ni texto que no sea Castellano (excepto términos técnicos).
+    5.  No uses usted.
+    6.  No uses español neutro o latino americano.
+""").strip()
 
-    print_color("Iniciando juego Black Story...", Fore.CYAN)
-    print_color(f"Juez (IA 1) usará: {args.m1}", Fore.GREEN)
-    print_color(f"Detective (IA 2) usará: {args.m2}", Fore.RED)
+DETECTIVE_SYSTEM_PROMPT = textwrap.dedent("""
+    Eres la IA Detective en un juego de Black Story. Tu rol es resolver un misterio formulando preguntas de Sí/No.
+    Restricciones CRÍTICAS:
+    1.  Idioma de Salida: SIEMPRE en Castellano.
+    2.  Restricción de Conocimiento: NO conoces el misterio ni la solución.
+    3.  Estrategia: Solo puedes formular preguntas de respuesta cerrada (Sí/No). Tus preguntas deben estar directamente relacionadas con los detalles presentados en la 'Historia'.
+    4.  Razonamiento Interno: Antes de cada jugada, realiza un paso de razonamiento interno. Este razonamiento NO se muestra en la terminal.
+        Debe guiar la evaluación de tu hipótesis actual y la formulación de la siguiente pregunta para mejorar la calidad de tus deducciones.
+    5.  Formato de Salida (CRÍTICO): En cada turno puedes hacer una pregunta o intentar resolver el misterio.
+        Tu respuesta DEBE ser ÚNICAMENTE un objeto JSON con estas tres claves, en este orden y todas obligatorias:
+        -   "RAZONAMIENTO": tu razonamiento interno.
+        -   "TIPO": "PREGUNTA" si haces una pregunta de Sí/No o "SOLUCION" si intentas resolver el misterio.
+        -   "TEXTO": la pregunta o el intento de solución, nunca vacío.
 
-    try:
-        juez_model = loading_animation(f"Cargando modelo Juez ({args.m1})...", load_model, args.m1, GEMINI_API_KEY, OLLAMA_BASE_URL)
-        detective_model = loading_animation(f"Cargando modelo Detective ({args.m2})...", load_model, args.m2, GEMINI_API_KEY, OLLAMA_BASE_URL)
-    except ValueError as e:
-        print_color(get_bubble_ascii(f"Error al cargar modelos: {e}", "Sistema", Fore.RED), Fore.RED)
-        return
+        Ejemplo de pregunta:
+        ```json
+        {
+            "RAZONAMIENTO": "[Tu razonamiento interno aquí]",
+            "TIPO": "PREGUNTA",
+            "TEXTO": "¿El culpable es un hombre?"
+        }
+        ```
+        Ejemplo de solución:
+        ```json
+        {
+            "RAZONAMIENTO": "[Tu razonamiento interno aquí]",
+            "TIPO": "SOLUCION",
+            "TEXTO": "La víctima murió por envenenamiento."
+        }
+        ```
+        No añadas texto introductorio ni de cierre fuera del JSON.
+    6.  No uses emojis ni texto que no sea Castellano (excepto términos técnicos).
+    7.  No uses usted.
+    8.  No uses español neutro o latino americano.
+""").strip()
 
-    print_color("Modelos cargados correctamente. ¡Comienza el juego!", Fore.CYAN)
+MAX_TURNS = 10
+VALID_JUDGE_ANSWERS = ["Sí", "No", "Irrelevante"]
+# Una respuesta válida del Juez es una sola palabra: más allá de este límite se corta el stream
+JUDGE_ANSWER_MAX_CHARS = 40
+# Tokens que puede generar el Juez al responder (holgura para las comillas del string JSON de Ollama)
+JUDGE_ANSWER_MAX_TOKENS = 8
+# Llamadas al Juez por pregunta si la respuesta llega vacía o cortada (la segunda, sin límite de tokens)
+JUDGE_ANSWER_ATTEMPTS = 2
+JUDGE_ANSWER_RETRY = "Responde únicamente con una de estas palabras: 'Sí', 'No' o 'Irrelevante'."
 
-    # --- Prompts del Sistema ---
-    JUDGE_SYSTEM_PROMPT = textwrap.dedent("""
-        Eres la IA Juez en un juego de Black Story. Tu rol es crear un misterio y responder a las preguntas del Detective.
-        Restricciones CRÍTICAS:
-        1.  Idioma de Salida: SIEMPRE en Castellano.
-        2.  Creación de Historia: Genera una versión CORTA (para el diálogo), una versión LARGA (para el registro) y la SOLUCIÓN SECRETA.
-            La historia debe ser de COMPLEJIDAD BAJA/MEDIA, requiriendo 2-3 preguntas clave para deducir la solución.
-            Evita soluciones obvias o basadas en un único hecho.
-            Formato de salida para la creación de historia:
-            ```json
-            {
-                "HISTORIA_CORTA": "[Tu historia corta aquí]",
-                "HISTORIA_LARGA": "[Tu historia larga aquí]",
-                "SOLUCION": "[La solución secreta aquí]"
-            }
-            ```
-            Asegúrate de que tu respuesta contenga ÚNICAMENTE el bloque de código JSON con el formato especificado, sin texto introductorio ni de cierre.
-        3.  Regla de Respuesta a Preguntas: Cuando el Detective haga una pregunta, DEBES responder ESTRICTAMENTE con una de estas tres palabras: 'Sí', 'No', o 'Irrelevante'. Tu respuesta DEBE basarse ÚNICAMENTE en la 'Historia Larga' y la 'Solución' que te han sido proporcionadas. NO generes texto adicional, explicaciones, ni JSON. Solo la palabra clave.
-        4.  No uses emojis ni texto que no sea Castellano (excepto términos técnicos).
-        5.  No uses usted.
-        6.  No uses español neutro o latino americano.
-    """).strip()
-
-    DETECTIVE_SYSTEM_PROMPT = textwrap.dedent("""
-        Eres la IA Detective en un juego de Black Story. Tu rol es resolver un misterio formulando preguntas de Sí/No.
-        Restricciones CRÍTICAS:
-        1.  Idioma de Salida: SIEMPRE en Castellano.
-        2.  Restricción de Conocimiento: NO conoces el misterio ni la solución.
-        3.  Estrategia: Solo puedes formular preguntas de respuesta cerrada (Sí/No). Tus preguntas deben estar directamente relacionadas con los detalles presentados en la 'Historia'.
-        4.  Razonamiento Interno: Antes de cada pregunta, realiza un paso de 'Razonamiento' interno. Este razonamiento NO se muestra en la terminal.
-            Debe guiar la evaluación de tu hipótesis actual y la formulación de la siguiente pregunta para mejorar la calidad de tus deducciones.
-            Formato de salida para la pregunta (CRÍTICO: DEBE incluir "PREGUNTA"):
-            Tu respuesta DEBE comenzar con tu razonamiento interno, seguido por el bloque JSON.
-            Es ABSOLUTAMENTE CRÍTICO que la salida sea EXACTAMENTE un bloque de código JSON con la clave "PREGUNTA", precedido por el razonamiento.
-            Ejemplo:
-            RAZONAMIENTO: [Tu razonamiento interno aquí, NO VISIBLE EN TERMINAL]
-            ```json
-            {
-                "PREGUNTA": "[Tu pregunta de Sí/No aquí, SIEMPRE presente y no vacía]"
-            }
-            ```
-            Asegúrate de que tu respuesta contenga el razonamiento y ÚNICAMENTE el bloque de código JSON con el formato especificado, sin texto introductorio ni de cierre adicional. La clave "PREGUNTA" es obligatoria y no puede estar vacía.
-        5.  Formato de Salida Flexible: En cada turno, puedes elegir entre hacer una pregunta o intentar resolver el misterio.
-            Tu respuesta DEBE ser un bloque de código JSON con una de las siguientes claves:
-            -   "PREGUNTA": "[Tu pregunta de Sí/No aquí]" (Si quieres hacer una pregunta)
-            -   "SOLUCION": "[Tu intento de solución aquí]" (Si quieres intentar resolver el misterio)
-            
-            Ejemplo de pregunta:
-            RAZONAMIENTO: [Tu razonamiento interno aquí]
-            ```json
-            {
-                "PREGUNTA": "¿El culpable es un hombre?"
-            }
-            ```
-            Ejemplo de solución:
-            RAZONAMIENTO: [Tu razonamiento interno aquí]
-            ```json
-            {
-                "SOLUCION": "La víctima murió por envenenamiento."
-            }
-            ```
-            Asegúrate de que tu respuesta contenga el razonamiento y ÚNICAMENTE el bloque de código JSON con el formato especificado, sin texto introductorio ni de cierre adicional. La clave elegida ("PREGUNTA" o "SOLUCION") es obligatoria y no puede estar vacía.
-        6.  No uses emojis ni texto que no sea Castellano (excepto términos técnicos).
-        7.  No uses usted.
-        8.  No uses español neutro o latino americano.
-    """).strip()
-
-    # --- Generación de la Historia por el Juez ---
-    print_color("Juez, por favor, crea una Black Story.", Fore.CYAN)
-    
-    judge_story_prompt = JUDGE_SYSTEM_PROMPT + "\n\nCrea una nueva Black Story de complejidad baja/media."
-    
-    try:
-        story_response = loading_animation("Juez creando la historia...", juez_model.generate, judge_story_prompt)
-        
-        story_short = ""
-        story_long = ""
-        solution = ""
-
-        story_short = ""
-        story_long = ""
-        solution = ""
-        
-        import json
-        parsed_response = None
-
-        # Intenta extraer de un bloque de código Markdown
-        json_block_start = story_response.find("```json")
-        json_block_end = story_response.rfind("```")
-
-        if json_block_start != -1 and json_block_end != -1 and json_block_start < json_block_end:
-            json_content = story_response[json_block_start + len("```json"):json_block_end].strip()
-            try:
-                parsed_response = json.loads(json_content)
-            except json.JSONDecodeError:
-                pass # Falló la extracción del bloque Markdown, intenta el siguiente método
-        
-        # Si no se extrajo de Markdown, intenta extraer buscando { y }
-        if parsed_response is None:
-            json_start = story_response.find("{")
-            json_end = story_response.rfind("}")
-
-            if json_start != -1 and json_end != -1 and json_start < json_end:
-                json_content = story_response[json_start : json_end + 1].strip()
-                try:
-                    parsed_response = json.loads(json_content)
-                except json.JSONDecodeError:
-                    pass # Falló la extracción de { }, parsed_response seguirá siendo None
+# --- Extracción de Respuestas de los Modelos ---
 
-        if parsed_response:
-            story_short = parsed_response.get("HISTORIA_CORTA", "").strip()
-            story_long = parsed_response.get("HISTORIA_LARGA", "").strip()
-            solution = parsed_response.get("SOLUCION", "").strip()
-        else:
-            raise ValueError("El Juez no generó un JSON válido o en el formato esperado.")
-
-        if not (story_short and story_long and solution):
-            raise ValueError("El Juez no generó la historia o solución en el formato esperado (campos vacíos).")
-
-        # Guardar historia larga y solución
-        timestamp = datetime.now().strftime("%d-%m-%Y %H-%M")
-        filename = os.path.join(PROMPTS_DIR, f"{timestamp}.txt")
-        def log_to_file(filepath, message):
-            with open(filepath, "a", encoding="utf-8") as f:
-                f.write(message + "\n")
-
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(f"--- Historia Larga ---\n{story_long}\n\n--- Solución ---\n{solution}\n\n--- Interacción ---\n")
-        
-        print_color(get_bubble_ascii(f"Historia y solución guardadas en {filename}", "Sistema", Fore.CYAN), Fore.CYAN)
-        log_to_file(filename, f"Historia: {story_short}")
-
-        # Mostrar historia larga en la terminal
-        print_color(f"\n[Registro de Historia Larga]\n[{datetime.now().strftime('%Y-%m-%d %H:%M')}]\n{story_long}\n---", Fore.CYAN)
-        
-        # Iniciar el juego con la historia corta
-        print_color(get_bubble_ascii(story_short, f"Juez ({juez_model.name})", Fore.GREEN), Fore.GREEN)
-        input("[PULSA INTRO PARA CONTINUAR]")
+STORY_KEYS = ("HISTORIA_CORTA", "HISTORIA_LARGA", "SOLUCION")
+DETECTIVE_ACTIONS = ("PREGUNTA", "SOLUCION")
+# La jugada va en TIPO/TEXTO; las claves PREGUNTA/SOLUCION del formato anterior se siguen aceptando
+DETECTIVE_KEYS = ("TIPO", "TEXTO") + DETECTIVE_ACTIONS
 
-        # --- Bucle del Juego ---
-        turn_count = 0
-        conversation_history = [] # Almacenar el historial de preguntas y respuestas
+# Esquemas de salida estructurada que se piden al backend (Ollama `format`, Gemini `response_schema`)
+STORY_SCHEMA = {
+    "type": "object",
+    "properties": {key: {"type": "string"} for key in STORY_KEYS},
+    "required": list(STORY_KEYS),
+}
+DETECTIVE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "RAZONAMIENTO": {"type": "string"},
+        "TIPO": {"type": "string", "enum": list(DETECTIVE_ACTIONS)},
+        "TEXTO": {"type": "string"},
+    },
+    "required": ["RAZONAMIENTO", "TIPO", "TEXTO"],
+}
 
-        while True:
-            turn_count += 1
-            print_color(f"\n--- Turno {turn_count} ---", Fore.CYAN)
-            log_to_file(filename, f"\n--- Turno {turn_count} ---")
-
-            if turn_count > 10:
-                system_message = f"Se ha alcanzado el límite de 10 turnos. El Detective no ha resuelto el misterio. La solución era: {solution}"
-                print_color(get_bubble_ascii(system_message, "Sistema", Fore.MAGENTA), Fore.MAGENTA)
-                log_to_file(filename, f"Sistema: {system_message}")
-                break
+# Reintentos pidiendo al modelo que corrija una respuesta sin JSON válido
+MAX_REPAIR_ATTEMPTS = 2
 
-            # Forzar al Detective a intentar una solución en el turno 10 si no lo ha hecho antes
-            force_solution_attempt = (turn_count == 10)
+def extract_json_object(text, expected_keys=()):
+    """
+    Busca el primer objeto JSON del texto que contenga alguna de las claves esperadas, tolerando
+    texto alrededor y bloques Markdown. Retorna (objeto, inicio) o (None, -1).
+    Cada "{" es un posible inicio y tras un fallo se reintenta desde la siguiente, así que con texto
+    malformado lleno de llaves el coste puede ser cuadrático; con respuestas válidas basta un intento.
+    """
+    decoder = json.JSONDecoder()
+    json_start = text.find("{")
+    while json_start != -1:
+        try:
+            parsed, json_end = decoder.raw_decode(text, json_start)
+        except json.JSONDecodeError:
+            json_start = text.find("{", json_start + 1)
+            continue
+        if isinstance(parsed, dict) and (not expected_keys or any(k in parsed for k in expected_keys)):
+            return parsed, json_start
+        # Objeto válido pero ajeno (p. ej. dentro del razonamiento): seguir después de él
+        json_start = text.find("{", json_end)
+    return None, -1
 
-            # Detective formula una pregunta o intenta una solución
-            detective_prompt = DETECTIVE_SYSTEM_PROMPT + f"\n\nHistoria: {story_short}\n"
-            if conversation_history:
-                detective_prompt += "Historial de conversación:\n" + "\n".join(conversation_history)
-            detective_prompt += f"\nTurno actual: {turn_count}. Tienes hasta el turno 10 para resolver el misterio."
-            if force_solution_attempt:
-                detective_prompt += " DEBES intentar una solución en este turno."
-            detective_prompt += "¿Qué quieres hacer?"
+class JsonStreamDetector:
+    """
+    Criterio de parada para streams (stop_at) que detecta el cierre del objeto JSON esperado.
+    Recorre solo el texto nuevo en cada llamada, contando llaves fuera de las cadenas, así que
+    el coste total es lineal en la longitud de la respuesta.
+    """
+    def __init__(self, expected_keys=()):
+        self.expected_keys = expected_keys
+        self.position = 0
+        self.depth = 0
+        self.object_start = -1
+        self.in_string = False
+        self.escaped = False
+        self.result = None
 
-            if detective_model.name == "gemma3:270m":
-                print_color(get_bubble_ascii("Advertencia: El modelo 'gemma3:270m' es muy pequeño y puede tener dificultades para generar preguntas/soluciones en el formato JSON requerido. Se recomienda usar un modelo más grande.", "Sistema", Fore.YELLOW), Fore.YELLOW)
-                input("[PULSA INTRO PARA CONTINUAR]")
+    SIGNIFICANT = re.compile(r'[{}"\\]')
 
-            detective_response = detective_model.generate(detective_prompt)
-            
-            reasoning = ""
-            question = ""
-            solution_attempt_text = ""
-            parsed_detective_json = None
-            error_message = ""
-
-            # Extraer el bloque JSON
-            json_block_start = detective_response.find("```json")
-            json_block_end = detective_response.rfind("```")
-            
-            json_content_to_parse = ""
-            reasoning_end_index = len(detective_response)
-
-            if json_block_start != -1 and json_block_end != -1 and json_block_start < json_block_end:
-                json_content_to_parse = detective_response[json_block_start + len("```json"):json_block_end].strip()
-                reasoning_end_index = json_block_start
+    def __call__(self, text):
+        while True:
+            if self.escaped:
+                # El carácter escapado quedó para este fragmento: se salta sin interpretarlo
+                if self.position >= len(text):
+                    return False
+                self.escaped = False
+                self.position += 1
+                continue
+            if self.depth == 0:
+                # Fuera de un objeto solo importa la siguiente llave de apertura
+                self.position = text.find("{", self.position)
+                if self.position == -1:
+                    self.position = len(text)
+                    return False
             else:
-                json_start = detective_response.find("{")
-                json_end = detective_response.rfind("}")
+                match = self.SIGNIFICANT.search(text, self.position)
+                if match is None:
+                    self.position = len(text)
+                    return False
+                self.position = match.start()
+            char = text[self.position]
+            if self.in_string:
+                if char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0 and self._accept(text[self.object_start:self.position + 1]):
+                    self.position += 1
+                    return True
+            self.position += 1
 
-                if json_start != -1 and json_end != -1 and json_start < json_end:
-                    json_content_to_parse = detective_response[json_start : json_end + 1].strip()
-                    reasoning_end_index = json_start
-                else:
-                    error_message = "No se encontró un bloque JSON válido en la respuesta del Detective. "
-            
+    def _accept(self, candidate):
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            return False # Llaves en texto libre: seguir buscando
+        if isinstance(parsed, dict) and (not self.expected_keys or any(k in parsed for k in self.expected_keys)):
+            self.result = parsed
+            return True
+        return False
+
+def parse_story_response(story_response):
+    """Extrae la historia corta, la historia larga y la solución del JSON generado por el Juez."""
+    parsed_response, _ = extract_json_object(story_response, STORY_KEYS)
+
+    if not parsed_response:
+        raise ValueError("El Juez no generó un JSON válido o en el formato esperado.")
+
+    story_short = str(parsed_response.get("HISTORIA_CORTA", "")).strip()
+    story_long = str(parsed_response.get("HISTORIA_LARGA", "")).strip()
+    solution = str(parsed_response.get("SOLUCION", "")).strip()
+
+    if not (story_short and story_long and solution):
+        raise ValueError("El Juez no generó la historia o solución en el formato esperado (campos vacíos).")
+
+    return story_short, story_long, solution
+
+def parse_detective_response(detective_response):
+    """
+    Extrae el razonamiento, la pregunta y el intento de solución de la respuesta del Detective.
+    Retorna (reasoning, question, solution_attempt_text, error_message).
+    """
+    parsed_detective_json, json_start = extract_json_object(detective_response, DETECTIVE_KEYS)
+    if parsed_detective_json is None:
+        return "", "", "", "No se encontró un bloque JSON válido en la respuesta del Detective. "
+
+    action = normalize_text(str(parsed_detective_json.get("TIPO") or "")).strip().upper()
+    if action in DETECTIVE_ACTIONS:
+        text = str(parsed_detective_json.get("TEXTO") or "").strip()
+        question, solution_attempt_text = (text, "") if action == "PREGUNTA" else ("", text)
+    else:
+        question = str(parsed_detective_json.get("PREGUNTA") or "").strip()
+        solution_attempt_text = str(parsed_detective_json.get("SOLUCION") or "").strip()
+
+    # El razonamiento va dentro del JSON; en respuestas del formato anterior, antes del bloque
+    reasoning = str(parsed_detective_json.get("RAZONAMIENTO") or "").strip()
+    if not reasoning:
+        reasoning_start_tag = "RAZONAMIENTO:"
+        reasoning_text_potential = detective_response[:json_start]
+        reasoning_start_index = reasoning_text_potential.find(reasoning_start_tag)
+        if reasoning_start_index != -1:
+            reasoning = reasoning_text_potential[reasoning_start_index + len(reasoning_start_tag):].replace("```json", "").strip()
+        else:
+            reasoning = "No se encontró el razonamiento explícito."
+
+    error_message = "" if question or solution_attempt_text else "El JSON del Detective no contiene una jugada ('TIPO' y 'TEXTO'). "
+    return reasoning, question, solution_attempt_text, error_message
+
+def build_repair_message(expected_keys):
+    """Mensaje para pedir al modelo que repita su última respuesta como JSON válido."""
+    keys = ", ".join(f'"{key}"' for key in expected_keys)
+    return (f"Tu respuesta anterior no contenía un JSON válido con las claves {keys}. "
+            "Repite tu respuesta ÚNICAMENTE como un objeto JSON válido, sin texto adicional.")
+
+# --- Streaming de Respuestas ---
+
+def collect_stream(chunks, stop_at=None, on_chunk=None):
+    """
+    Concatena los fragmentos de un stream. Si stop_at(texto_acumulado) es cierto se deja de leer
+    y se cierra el stream, lo que corta la generación en el backend.
+    """
+    text = ""
+    try:
+        for chunk in chunks:
+            text += chunk
+            if on_chunk:
+                on_chunk(chunk, text)
+            if stop_at and stop_at(text):
+                break
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+    return text
+
+class JsonFieldStreamer:
+    """
+    Extrae de forma incremental el valor de texto de la primera clave JSON encontrada
+    de entre `keys`, para poder mostrarlo mientras el modelo todavía lo está generando.
+    """
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'n': ' ', 't': ' ', 'r': '', 'b': '', 'f': ''}
+
+    def __init__(self, keys):
+        self.pattern = re.compile(r'"(' + "|".join(re.escape(k) for k in keys) + r')"\s*:\s*"')
+        self.longest_key = max(len(k) for k in keys) + 8
+        self.buffer = ""
+        self.key = None
+        self.position = 0
+        self.search_from = 0
+        self.done = False
+
+    def feed(self, chunk):
+        """Añade un fragmento y retorna el texto nuevo del valor (cadena vacía si no hay)."""
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.key is None:
+            match = self.pattern.search(self.buffer, self.search_from)
+            if not match:
+                # Solo se vuelve a buscar en el final, por si la clave quedó partida entre fragmentos
+                self.search_from = max(0, len(self.buffer) - self.longest_key)
+                return ""
+            self.key = match.group(1)
+            self.position = match.end()
+
+        output = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if char == '"':
+                self.done = True
+                break
+            if char == "\\":
+                if self.position + 1 >= len(self.buffer):
+                    break # Escape incompleto, esperar al siguiente fragmento
+                escaped = self.buffer[self.position + 1]
+                if escaped == "u":
+                    if self.position + 6 > len(self.buffer):
+                        break
+                    output.append(chr(int(self.buffer[self.position + 2:self.position + 6], 16)))
+                    self.position += 6
+                    continue
+                output.append(self.ESCAPES.get(escaped, escaped))
+                self.position += 2
+                continue
+            output.append(char)
+            self.position += 1
+        return "".join(output)
+
+JUDGE_STORY_REQUEST = "Crea una nueva Black Story de complejidad baja/media."
+
+def build_detective_turn_message(story_short, feedback, turn_count, max_turns=MAX_TURNS):
+    """
+    Construye el mensaje del turno para la sesión del Detective. Solo contiene lo nuevo:
+    la historia en el primer turno y, después, la respuesta del turno anterior.
+    """
+    message = f"Historia: {story_short}\n" if turn_count == 1 else f"{feedback}\n"
+    message += f"Turno actual: {turn_count}. Tienes hasta el turno {max_turns} para resolver el misterio."
+    if turn_count == max_turns:
+        message += " DEBES intentar una solución en este turno."
+    message += "¿Qué quieres hacer?"
+    return message
+
+def build_judge_question_message(question):
+    """Construye el mensaje con la pregunta del Detective para la sesión del Juez."""
+    return f"Pregunta del Detective: {question}\n\nResponde estrictamente con 'Sí', 'No' o 'Irrelevante'."
+
+# --- Respuestas del Juez ---
+
+# Primera palabra de la respuesta, en minúsculas y sin tildes -> respuesta canónica
+JUDGE_ANSWER_WORDS = {"si": "Sí", "no": "No", "irrelevante": "Irrelevante"}
+# Historias (por modelo Juez) cuyas respuestas se conservan en memoria
+JUDGE_CACHE_MAX_STORIES = 256
+
+def normalize_judge_answer(text):
+    """
+    Lleva una respuesta del Juez a 'Sí', 'No' o 'Irrelevante' ignorando mayúsculas, tildes,
+    comillas y puntuación ("sí.", "NO", '"Irrelevante"'). Retorna None si no empieza por ninguna.
+    """
+    words = re.findall(r"[a-z]+", normalize_text(text))
+    return JUDGE_ANSWER_WORDS.get(words[0]) if words else None
+
+def is_truncated_judge_answer(text):
+    """True si la respuesta del Juez está vacía o es el principio de una válida ("Irrelev"): merece reintentarse."""
+    words = re.findall(r"[a-z]+", normalize_text(text))
+    if not words:
+        return True
+    return len(words) == 1 and any(valid.startswith(words[0]) for valid in JUDGE_ANSWER_WORDS)
+
+def judge_question_key(question):
+    """
+    Clave de caché de una pregunta: sus palabras en orden y en minúsculas, sin puntuación ni
+    espacios de más. Se conservan todas las palabras y las tildes, porque un pronombre o una tilde
+    cambian la pregunta: "¿Lo mató?" y "¿La mató?", o "¿Él la envenenó?" y "¿El la envenenó?".
+    """
+    return " ".join(re.findall(r"\w+", unicodedata.normalize("NFC", question).lower()))
+
+def story_fingerprint(story_long, solution):
+    """Identificador de una historia por su contenido (la respuesta del Juez solo depende de él)."""
+    return hashlib.sha256(f"{story_long}\n{solution}".encode("utf-8")).hexdigest()[:16]
+
+class JudgeAnswerCache:
+    """
+    Respuestas del Juez por (modelo Juez, historia) y clave de pregunta, para las `max_stories` historias
+    más recientes. Si varias partidas hacen la misma pregunta a la vez, solo la primera llama al Juez
+    (begin/pending/end).
+    """
+    def __init__(self, max_stories=JUDGE_CACHE_MAX_STORIES):
+        self.max_stories = max_stories
+        self._stories = OrderedDict()
+        self._inflight = {} # (historia, clave de la pregunta) -> Future de la llamada en curso
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, story_key, question):
+        key = judge_question_key(question)
+        with self._lock:
+            answers = self._stories.get(story_key)
+            answer = answers.get(key) if answers and key else None
+            if answer is None:
+                self.misses += 1
+                return None
+            self._stories.move_to_end(story_key)
+            self.hits += 1
+            return answer
+
+    def put(self, story_key, question, answer):
+        key = judge_question_key(question)
+        if not key:
+            return
+        with self._lock:
+            self._put(story_key, key, answer)
+
+    def _put(self, story_key, key, answer):
+        self._stories.setdefault(story_key, {})[key] = answer
+        self._stories.move_to_end(story_key)
+        while len(self._stories) > self.max_stories:
+            self._stories.popitem(last=False)
+
+    def pending(self, story_key, question):
+        """Future con la respuesta si otra partida está haciendo ahora esta pregunta al Juez, o None."""
+        with self._lock:
+            return self._inflight.get((story_key, judge_question_key(question)))
+
+    def begin(self, story_key, question):
+        """
+        Registra que esta partida va a hacer la pregunta al Juez, para que las demás esperen su
+        respuesta. Retorna el identificador que hay que pasar a end(), o None si no se comparte.
+        Si otra partida ya la está haciendo, esta no publica nada: solo guarda su respuesta.
+        """
+        inflight_key = (story_key, judge_question_key(question))
+        if not inflight_key[1]:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            if self._inflight.setdefault(inflight_key, future) is not future:
+                future = None
+        return inflight_key, future
+
+    def end(self, token, answer):
+        """Publica la respuesta (None si no hubo una válida) a quienes esperaban y la guarda si es válida."""
+        if token is None:
+            return
+        inflight_key, future = token
+        with self._lock:
+            # Solo quien creó la espera la retira: la de otra partida sigue en curso
+            if future is not None and self._inflight.get(inflight_key) is future:
+                del self._inflight[inflight_key]
+            if answer is not None:
+                self._put(*inflight_key, answer)
+        if future is not None and not future.done():
+            future.set_result(answer)
+
+    def clear(self):
+        with self._lock:
+            self._stories.clear()
+
+# Caché compartida por todas las partidas del proceso
+JUDGE_ANSWERS = JudgeAnswerCache()
+
+# --- Métricas y Trazas de las Llamadas a los Modelos ---
+
+# Segundos mínimos de generación para calcular tokens/segundo: con menos (respuestas que llegan
+# de una vez) la división da cifras absurdas y la llamada se muestra como "-"
+MIN_TOKENS_PER_SEC_WINDOW = 0.05
+
+def tokens_per_second(completion_tokens, start, first_token, end):
+    """
+    Tokens/segundo de una llamada, medidos desde el primer token o, si la respuesta llegó de
+    una vez, desde el inicio de la petición. Retorna None si la ventana es demasiado corta.
+    """
+    for since in (first_token, start):
+        if since is not None and end - since >= MIN_TOKENS_PER_SEC_WINDOW:
+            return completion_tokens / (end - since)
+    return None
+
+class MetricsRecorder:
+    """
+    Registra cada llamada a un modelo: tiempo total, tiempo hasta el primer token, tokens de
+    prompt y de respuesta y tokens/segundo, etiquetada por partida, rol, fase y turno.
+    Se alimenta de los eventos de GameSession y es seguro entre hilos, así que un único
+    registro puede compartirse entre todas las partidas de un torneo.
+    """
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.records = []
+        self._open = {} # Llamadas en curso por (partida, llamada)
+        self._by_game = {} # Registros de las partidas que aún no han terminado
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        """
+        Suscriptor de GameSession: abre un registro con cada evento 'llamada', anota el primer
+        fragmento y lo completa con 'fin_llamada' (que trae la fase definitiva y el uso de tokens).
+        Al terminar la partida deja sus registros en result["calls"].
+        """
+        kind = event["type"]
+        if kind == "llamada":
+            self._open[(event["game_id"], event["call_id"])] = {
+                "game": event["game"], "role": event["role"], "model": event["model"], "phase": event["phase"],
+                "turn": event["turn"], "started": event["time"], "first_token": None,
+            }
+        elif kind == "fragmento":
+            record = self._open.get((event["game_id"], event["call_id"]))
+            if record is not None and record["first_token"] is None:
+                record["first_token"] = event["time"]
+        elif kind == "fin_llamada":
+            record = self._open.pop((event["game_id"], event["call_id"]), None)
+            if record is not None:
+                self._finish(record, event)
+        elif kind == "fin":
+            with self._lock:
+                event["result"]["calls"] = self._by_game.pop(event["game_id"], [])
+
+    def _finish(self, record, event):
+        start, first_token, end = record.pop("started"), record.pop("first_token"), event["time"]
+        usage = event.get("usage") or {}
+        completion_tokens = usage.get("completion_tokens") or 0
+        record.update({
+            "phase": event["phase"],
+            "start": start - self.origin,
+            "wall_time": end - start,
+            "ttft": (first_token - start) if first_token is not None else None,
+            "prompt_tokens": usage.get("prompt_tokens") or 0,
+            "completion_tokens": completion_tokens,
+            "tokens_per_sec": tokens_per_second(completion_tokens, start, first_token, end),
+            "thread": threading.get_ident(),
+        })
+        with self._lock:
+            self.records.append(record)
+            self._by_game.setdefault(event["game_id"], []).append(record)
+
+    def summarize(self, records=None):
+        """Agrega los registros por (rol, fase). Retorna una lista de filas ordenada."""
+        groups = {}
+        for record in (self.records if records is None else records):
+            groups.setdefault((record["role"], record["phase"]), []).append(record)
+        rows = []
+        for (role, phase), group in sorted(groups.items()):
+            ttfts = [r["ttft"] for r in group if r["ttft"] is not None]
+            rates = [r["tokens_per_sec"] for r in group if r["tokens_per_sec"] is not None]
+            rows.append({
+                "role": role,
+                "phase": phase,
+                "calls": len(group),
+                "wall_time": sum(r["wall_time"] for r in group),
+                "avg_wall_time": sum(r["wall_time"] for r in group) / len(group),
+                "avg_ttft": sum(ttfts) / len(ttfts) if ttfts else None,
+                "prompt_tokens": sum(r["prompt_tokens"] for r in group),
+                "completion_tokens": sum(r["completion_tokens"] for r in group),
+                "tokens_per_sec": sum(rates) / len(rates) if rates else None,
+            })
+        return rows
+
+    def write_chrome_trace(self, path):
+        """
+        Escribe los registros en formato Chrome trace-event (chrome://tracing, Perfetto).
+        Cada partida es un hilo de la línea temporal y cada llamada un evento completo.
+        """
+        with self._lock:
+            records = list(self.records)
+        game_ids = {}
+        events = []
+        for record in records:
+            if record["game"] not in game_ids:
+                game_ids[record["game"]] = len(game_ids) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": game_ids[record["game"]],
+                               "args": {"name": str(record["game"])}})
+            tid = game_ids[record["game"]]
+            ts = record["start"] * 1e6
+            events.append({
+                "name": f"{record['role']} {record['phase']}",
+                "cat": record["role"],
+                "ph": "X",
+                "ts": ts,
+                "dur": record["wall_time"] * 1e6,
+                "pid": 1,
+                "tid": tid,
+                "args": {k: record[k] for k in ("model", "turn", "ttft", "prompt_tokens", "completion_tokens", "tokens_per_sec")},
+            })
+            if record["ttft"] is not None:
+                events.append({"name": "primer token", "cat": record["role"], "ph": "i", "s": "t",
+                               "ts": ts + record["ttft"] * 1e6, "pid": 1, "tid": tid})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+def print_metrics_summary(rows, title="--- Métricas de las llamadas a los modelos ---"):
+    """Imprime la tabla resumen de métricas por rol y fase."""
+    header = f"{'Rol':<10} {'Fase':<10} {'Llamadas':>8} {'Total s':>8} {'Media s':>8} {'TTFT s':>7} {'Tok. prompt':>11} {'Tok. resp.':>10} {'Tok/s':>7}"
+    print_color(f"\n{title}", Fore.CYAN)
+    print_color(header, Fore.CYAN)
+    print_color("-" * len(header), Fore.CYAN)
+    for row in rows:
+        ttft = f"{row['avg_ttft']:.2f}" if row["avg_ttft"] is not None else "-"
+        rate = f"{row['tokens_per_sec']:.1f}" if row["tokens_per_sec"] is not None else "-"
+        print_color(
+            f"{row['role']:<10} {row['phase']:<10} {row['calls']:>8} {row['wall_time']:>8.2f} {row['avg_wall_time']:>8.2f} "
+            f"{ttft:>7} {row['prompt_tokens']:>11} {row['completion_tokens']:>10} {rate:>7}",
+            Fore.CYAN,
+        )
+
+# --- Almacén de Partidas (SQLite) ---
+
+class MinHasher:
+    """
+    Firmas MinHash sobre trigramas de palabras para detectar historias casi duplicadas.
+    Las firmas se dividen en bandas (LSH): dos historias son candidatas si coinciden en alguna banda.
+    """
+    PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=3, seed=1):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = random.Random(seed) # Semilla fija: las firmas guardadas deben ser comparables entre ejecuciones
+        self.params = [(rng.randrange(1, self.PRIME), rng.randrange(0, self.PRIME)) for _ in range(num_perm)]
+
+    def shingles(self, text):
+        words = re.findall(r'\w+', text.lower())
+        if len(words) < self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+                  for s in self.shingles(text)]
+        if not hashes:
+            return [0] * self.num_perm
+        return [min((a * h + b) % self.PRIME for h in hashes) for a, b in self.params]
+
+    def band_keys(self, signature):
+        return [(band, hashlib.blake2b(repr(signature[band * self.rows:(band + 1) * self.rows]).encode(), digest_size=8).hexdigest())
+                for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(signature_a, signature_b):
+        return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+# Crecimiento relativo del corpus de soluciones a partir del cual se recalcula su IDF
+IDF_REFRESH_GROWTH = 0.1
+
+class GameStore:
+    """
+    Almacén estructurado de historias, partidas y transcripciones en SQLite. Cada partida tiene un
+    identificador único y cada historia guarda su firma MinHash, de modo que se pueden consultar
+    resultados por modelo o por historia y marcar las historias casi duplicadas al insertarlas.
+    Es seguro entre hilos: todas las operaciones comparten una conexión protegida por un lock.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stories (
+            id TEXT PRIMARY KEY,
+            model TEXT,
+            short TEXT NOT NULL,
+            long TEXT NOT NULL,
+            solution TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            duplicate_of TEXT,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS story_bands (
+            band INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            story_id TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_story_bands ON story_bands (band, bucket);
+        CREATE TABLE IF NOT EXISTS games (
+            id TEXT PRIMARY KEY,
+            story_id TEXT,
+            judge_model TEXT NOT NULL,
+            detective_model TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            solved INTEGER NOT NULL,
+            turns INTEGER NOT NULL,
+            invalid_judge_answer INTEGER NOT NULL,
+            wall_time REAL NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            error TEXT,
+            filename TEXT,
+            started REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_games_story ON games (story_id);
+        CREATE INDEX IF NOT EXISTS idx_games_detective ON games (detective_model);
+        CREATE TABLE IF NOT EXISTS turns (
+            game_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            turn INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            content TEXT NOT NULL,
+            PRIMARY KEY (game_id, seq)
+        );
+    """
+
+    def __init__(self, path, duplicate_threshold=0.8):
+        self.path = path
+        self.duplicate_threshold = duplicate_threshold
+        self.hasher = MinHasher()
+        self._lock = threading.Lock()
+        # Frecuencias de términos de las soluciones, actualizadas solo con las historias nuevas
+        self._idf_rowid = 0
+        self._idf_documents = 0
+        self._idf_frequency = {}
+        self._idf_cache = None # (número de historias, IDF de sus soluciones)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+
+    @staticmethod
+    def story_text(story_short, story_long, solution):
+        return f"{story_short}\n{story_long}\n{solution}"
+
+    def _find_near_duplicates(self, signature, exclude_id=None):
+        candidates = set()
+        for band, bucket in self.hasher.band_keys(signature):
+            rows = self.connection.execute("SELECT story_id FROM story_bands WHERE band = ? AND bucket = ?", (band, bucket))
+            candidates.update(row[0] for row in rows)
+        candidates.discard(exclude_id)
+        duplicates = []
+        for story_id in candidates:
+            row = self.connection.execute("SELECT signature FROM stories WHERE id = ?", (story_id,)).fetchone()
+            similarity = MinHasher.similarity(signature, json.loads(row[0]))
+            if similarity >= self.duplicate_threshold:
+                duplicates.append((story_id, similarity))
+        return sorted(duplicates, key=lambda item: -item[1])
+
+    def near_duplicates(self, story_short, story_long, solution):
+        """Retorna [(id de historia, similitud estimada)] de las historias guardadas parecidas a esta."""
+        signature = self.hasher.signature(self.story_text(story_short, story_long, solution))
+        with self._lock:
+            return self._find_near_duplicates(signature)
+
+    def add_story(self, story_short, story_long, solution, model=None):
+        """
+        Guarda una historia (si no existía) y retorna (id, id de la historia de la que es casi
+        duplicado o None).
+        """
+        text = self.story_text(story_short, story_long, solution)
+        story_id = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            row = self.connection.execute("SELECT duplicate_of FROM stories WHERE id = ?", (story_id,)).fetchone()
+            if row is not None:
+                return story_id, row[0]
+            signature = self.hasher.signature(text)
+            duplicates = self._find_near_duplicates(signature, exclude_id=story_id)
+            duplicate_of = duplicates[0][0] if duplicates else None
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO stories (id, model, short, long, solution, signature, duplicate_of, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (story_id, model, story_short, story_long, solution, json.dumps(signature), duplicate_of, time.time()),
+                )
+                self.connection.executemany(
+                    "INSERT INTO story_bands (band, bucket, story_id) VALUES (?, ?, ?)",
+                    [(band, bucket, story_id) for band, bucket in self.hasher.band_keys(signature)],
+                )
+            return story_id, duplicate_of
+
+    def save_game(self, result, transcript):
+        """Guarda el resultado de una partida y su transcripción turno a turno."""
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO games (id, story_id, judge_model, detective_model, outcome, solved, turns, "
+                "invalid_judge_answer, wall_time, prompt_tokens, error, filename, started) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result["game_id"], result.get("story_id"), result["juez"], result["detective"], result["outcome"],
+                 int(result["solved"]), result["turns"], int(result["invalid_judge_answer"]), result["wall_time"],
+                 result["prompt_tokens"], result["error"], result["filename"], result["started"]),
+            )
+            self.connection.execute("DELETE FROM turns WHERE game_id = ?", (result["game_id"],))
+            self.connection.executemany(
+                "INSERT INTO turns (game_id, seq, turn, role, kind, content) VALUES (?, ?, ?, ?, ?, ?)",
+                [(result["game_id"], seq, event["turn"], event["role"], event["kind"], event["content"])
+                 for seq, event in enumerate(transcript)],
+            )
+
+    def solution_idf(self, min_documents=20):
+        """
+        IDF (build_idf) de las soluciones guardadas, para ponderar SolutionMatcher. Solo se tokenizan
+        las historias nuevas y la IDF se recalcula cuando el corpus crece un IDF_REFRESH_GROWTH;
+        con menos de `min_documents` historias retorna None.
+        """
+        with self._lock:
+            # Las historias nunca se borran, así que basta con leer las de rowid posterior
+            rows = self.connection.execute("SELECT rowid, solution FROM stories WHERE rowid > ? ORDER BY rowid",
+                                           (self._idf_rowid,)).fetchall()
+            if rows:
+                self._idf_rowid = rows[-1][0]
+                self._idf_documents += len(rows)
+                count_document_terms((solution for _, solution in rows), self._idf_frequency)
+            if self._idf_documents < min_documents:
+                return None
+            cached = self._idf_cache
+            if cached is None or self._idf_documents >= cached[0] * (1 + IDF_REFRESH_GROWTH):
+                self._idf_cache = cached = (self._idf_documents, idf_from_frequencies(self._idf_frequency, self._idf_documents))
+            return cached[1]
+
+    def solve_rate_by_detective(self, unique_stories=False):
+        """Tasa de resolución por modelo Detective. Con unique_stories se ignoran las historias casi duplicadas."""
+        query = ("SELECT g.detective_model, COUNT(*), SUM(g.solved), AVG(CASE WHEN g.solved THEN g.turns END) "
+                 "FROM games g LEFT JOIN stories s ON s.id = g.story_id ")
+        if unique_stories:
+            query += "WHERE s.duplicate_of IS NULL "
+        query += "GROUP BY g.detective_model ORDER BY SUM(g.solved) * 1.0 / COUNT(*) DESC"
+        with self._lock:
+            rows = self.connection.execute(query).fetchall()
+        return [{"detective": model, "games": games, "solved": solved or 0,
+                 "solve_rate": (solved or 0) / games, "avg_turns_to_solve": avg_turns}
+                for model, games, solved, avg_turns in rows]
+
+    def resolve_id(self, table, prefix):
+        """
+        Identificador completo de una historia (`table="stories"`) o partida (`table="games"`) a partir
+        de un prefijo suyo. Lanza ValueError si no hay uno único.
+        """
+        if table not in ("stories", "games"):
+            raise ValueError(f"Tabla desconocida: {table}")
+        with self._lock:
+            rows = self.connection.execute(f"SELECT id FROM {table} WHERE substr(id, 1, ?) = ? LIMIT 2",
+                                           (len(prefix), prefix)).fetchall() if prefix else []
+        if len(rows) != 1:
+            what = "historia" if table == "stories" else "partida"
+            problem = f"No hay ninguna {what}" if not rows else f"Hay varias {what}s"
+            raise ValueError(f"{problem} con el identificador '{prefix}'.")
+        return rows[0][0]
+
+    def story(self, story_id):
+        """Historia guardada como dict (HISTORIA_CORTA, HISTORIA_LARGA, SOLUCION, duplicate_of) o None."""
+        with self._lock:
+            row = self.connection.execute("SELECT short, long, solution, duplicate_of FROM stories WHERE id = ?",
+                                          (story_id,)).fetchone()
+        return dict(zip(STORY_KEYS + ("duplicate_of",), row)) if row else None
+
+    def games_for_story(self, story_id):
+        """Todas las partidas jugadas con una historia."""
+        with self._lock:
+            cursor = self.connection.execute(
+                "SELECT id, judge_model, detective_model, outcome, turns, wall_time FROM games WHERE story_id = ? ORDER BY started",
+                (story_id,),
+            )
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def game(self, game_id):
+        """Resultado guardado de una partida como dict o None."""
+        with self._lock:
+            cursor = self.connection.execute("SELECT * FROM games WHERE id = ?", (game_id,))
+            row = cursor.fetchone()
+            return dict(zip([c[0] for c in cursor.description], row)) if row else None
+
+    def transcript(self, game_id):
+        """Transcripción de una partida, en el orden en que se enviaron los mensajes."""
+        with self._lock:
+            cursor = self.connection.execute(
+                "SELECT turn, role, kind, content FROM turns WHERE game_id = ? ORDER BY seq", (game_id,))
+            return [{"turn": t, "role": r, "kind": k, "content": c} for t, r, k, c in cursor.fetchall()]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+def print_store_stats(store, unique_stories=False):
+    """Imprime la tasa de resolución por modelo Detective guardada en el almacén."""
+    header = f"{'Detective':<30} {'Partidas':>8} {'Resueltas':>9} {'Tasa':>6} {'Turnos':>7}"
+    title = "--- Resultados por Detective" + (" (sin historias duplicadas)" if unique_stories else "") + " ---"
+    print_color(f"\n{title}", Fore.CYAN)
+    print_color(header, Fore.CYAN)
+    print_color("-" * len(header), Fore.CYAN)
+    for row in store.solve_rate_by_detective(unique_stories):
+        avg_turns = f"{row['avg_turns_to_solve']:.1f}" if row["avg_turns_to_solve"] is not None else "-"
+        print_color(f"{row['detective'][:30]:<30} {row['games']:>8} {row['solved']:>9} {row['solve_rate']:>6.0%} {avg_turns:>7}", Fore.CYAN)
+
+def print_story_games(store, story_id):
+    """Imprime una historia guardada y todas las partidas que se han jugado con ella."""
+    story = store.story(story_id)
+    print_color(f"\n--- Historia {story_id} ---", Fore.CYAN)
+    print_color(story["HISTORIA_CORTA"], Fore.YELLOW)
+    print_color(f"Solución: {story['SOLUCION']}", Fore.YELLOW)
+    if story["duplicate_of"]:
+        print_color(f"Casi duplicada de la historia {story['duplicate_of']}", Fore.YELLOW)
+    header = f"{'Partida':<8} {'Juez':<20} {'Detective':<20} {'Resultado':<26} {'Turnos':>6} {'Tiempo':>8}"
+    print_color(f"\n{header}", Fore.CYAN)
+    print_color("-" * len(header), Fore.CYAN)
+    for game in store.games_for_story(story_id):
+        print_color(f"{game['id'][:8]:<8} {game['judge_model'][:20]:<20} {game['detective_model'][:20]:<20} "
+                    f"{game['outcome'][:26]:<26} {game['turns']:>6} {game['wall_time']:>7.1f}s", Fore.CYAN)
+
+def print_game_transcript(store, game_id):
+    """Imprime el resultado y la transcripción guardados de una partida."""
+    game = store.game(game_id)
+    print_color(f"\n--- Partida {game_id} ---", Fore.CYAN)
+    print_color(f"Historia: {game['story_id'] or '-'}  Juez: {game['judge_model']}  Detective: {game['detective_model']}", Fore.CYAN)
+    print_color(f"Resultado: {game['outcome']} en {game['turns']} turnos ({game['wall_time']:.1f}s)", Fore.CYAN)
+    for event in store.transcript(game_id):
+        color = Fore.GREEN if event["role"] == "Detective" else Fore.YELLOW
+        print_color(f"\n[{event['turn']}] {event['role']} ({event['kind']}):", color)
+        print(event["content"])
+
+# --- Reserva de Historias Pregeneradas ---
+
+def generate_story(judge_session, send_stream=None, consume=None):
+    """
+    Pide al Juez una historia con salida estructurada y, si no llega un JSON válido, le pide que
+    la corrija hasta MAX_REPAIR_ATTEMPTS veces. Retorna (historia corta, historia larga, solución).
+    send_stream(phase, message, **kwargs) y consume(chunks, stop_at) permiten instrumentar la llamada.
+    """
+    if send_stream is None:
+        send_stream = lambda phase, message, **kwargs: judge_session.send_stream(message, **kwargs)
+    if consume is None:
+        consume = lambda chunks, stop_at: collect_stream(chunks, stop_at=stop_at)
+
+    message = JUDGE_STORY_REQUEST
+    for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
+        phase = "historia" if attempt == 0 else "reparacion"
+        story_response = consume(send_stream(phase, message, response_schema=STORY_SCHEMA), JsonStreamDetector(STORY_KEYS))
+        try:
+            return parse_story_response(story_response)
+        except ValueError:
+            if attempt == MAX_REPAIR_ATTEMPTS:
+                raise
+            message = build_repair_message(STORY_KEYS)
+
+def story_messages(story):
+    """Historial con el que se abre la sesión del Juez para una historia ya generada."""
+    payload = {key: story[key] for key in STORY_KEYS}
+    return [
+        {'role': 'user', 'content': JUDGE_STORY_REQUEST},
+        {'role': 'assistant', 'content': json.dumps(payload, ensure_ascii=False)},
+    ]
+
+# Segundos que una partida espera a la reserva antes de generar su propia historia
+STORY_POOL_WAIT = 30
+# Fallos seguidos del backend tras los que un hilo de la reserva deja de intentarlo
+STORY_POOL_MAX_FAILURES = 5
+# Generaciones por historia nueva, contando las descartadas por casi duplicadas
+STORY_ATTEMPTS_PER_STORY = 3
+
+class StoryPool:
+    """
+    Reserva de historias validadas de un Juez que unos hilos mantienen llena hasta `target_depth`, para
+    que las partidas no esperen a generarla; con `path` persiste en JSONL y con `store` descarta las
+    casi duplicadas. Los hilos se rinden tras varios fallos o duplicadas seguidas.
+    """
+    def __init__(self, juez_model, target_depth=4, workers=1, path=None, store=None):
+        self.juez_model = juez_model
+        self.target_depth = target_depth
+        self.workers = workers
+        self.path = path
+        self.store = store
+        self.stories = []
+        self.failures = 0
+        self.duplicates = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self._alive = 0
+        self._stopped = False
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.stories = [json.loads(line) for line in f if line.strip()]
+
+    @staticmethod
+    def default_path(juez_model):
+        safe_name = re.sub(r'[^\w.-]+', '_', juez_model.name)
+        return os.path.join(PROMPTS_DIR, "pool", f"{safe_name}.jsonl")
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for story in self.stories:
+                f.write(json.dumps(story, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def generate_one(self):
+        """Genera y valida una historia nueva (sin añadirla a la reserva)."""
+        session = self.juez_model.start_session(JUDGE_SYSTEM_PROMPT)
+        story_short, story_long, solution = generate_story(session)
+        return {"HISTORIA_CORTA": story_short, "HISTORIA_LARGA": story_long, "SOLUCION": solution,
+                "model": self.juez_model.name, "created": time.time()}
+
+    def accept(self, story):
+        """Registra la historia en el almacén; retorna False si es casi duplicada de otra."""
+        if not self.store:
+            return True
+        fields = (story["HISTORIA_CORTA"], story["HISTORIA_LARGA"], story["SOLUCION"])
+        # Incluye la propia historia si ya estaba guardada (similitud 1.0)
+        if self.store.near_duplicates(*fields):
+            with self._condition:
+                self.duplicates += 1
+            return False
+        story["story_id"], _ = self.store.add_story(*fields, self.juez_model.name)
+        return True
+
+    def add(self, story):
+        with self._condition:
+            self.stories.append(story)
+            self._save()
+            self._condition.notify_all()
+
+    def prefill(self, count, on_story=None, max_attempts=None):
+        """
+        Genera `count` historias nuevas de forma síncrona y las añade a la reserva. Las duplicadas
+        no cuentan, con un máximo de `max_attempts` generaciones (por defecto, STORY_ATTEMPTS_PER_STORY por historia).
+        """
+        added = 0
+        for _ in range(max_attempts or count * STORY_ATTEMPTS_PER_STORY):
+            if added == count:
+                break
+            story = self.generate_one()
+            if self.accept(story):
+                self.add(story)
+                added += 1
+                if on_story:
+                    on_story(added)
+        return added
+
+    def _worker(self):
+        failures = rejected = 0
+        try:
+            while True:
+                with self._condition:
+                    while not self._stopped and len(self.stories) >= self.target_depth:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                try:
+                    story = self.generate_one()
+                    if self.accept(story):
+                        self.add(story)
+                        failures = rejected = 0
+                        continue
+                    rejected += 1
+                except Exception:
+                    # Un fallo del backend no debe tumbar la reserva: se espera y se reintenta
+                    failures += 1
+                    with self._condition:
+                        self.failures += 1
+                # Un Juez que repite historias también espera, para no generar en bucle
+                if failures >= STORY_POOL_MAX_FAILURES or rejected >= STORY_ATTEMPTS_PER_STORY:
+                    return
+                with self._condition:
+                    self._condition.wait(min(30, 2 ** (failures + rejected)))
+        finally:
+            with self._condition:
+                self._alive -= 1
+                self._condition.notify_all() # pop() deja de esperar si ya no quedan hilos
+
+    def start(self):
+        """Arranca los hilos que rellenan la reserva en segundo plano."""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            with self._condition:
+                self._alive += 1
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def pop(self, timeout=None):
+        """
+        Retorna la historia más antigua de la reserva. Si está vacía y hay hilos rellenándola, espera
+        (hasta `timeout` segundos); si no, retorna None y la partida debe generar su propia historia.
+        """
+        with self._condition:
+            if not self.stories and self._alive and not self._stopped:
+                self._condition.wait_for(lambda: self.stories or self._stopped or not self._alive, timeout)
+            if not self.stories:
+                return None
+            story = self.stories.pop(0)
+            self._save()
+            self._condition.notify_all() # Despierta a los hilos para reponer
+            return story
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+# --- Registro de Transcripciones ---
+
+# Flujo de eventos JSONL compartido por todas las partidas (una línea por mensaje)
+EVENTS_FILENAME = "events.jsonl"
+
+class TranscriptWriter:
+    """
+    Escritor de registros en segundo plano: un único hilo consume una cola de escrituras y las vuelca
+    por lotes (en cada flush, cada `flush_interval` segundos y al salir), así que las líneas de
+    partidas concurrentes nunca se entremezclan.
+    """
+    _STOP = object()
+
+    def __init__(self, flush_interval=1.0, batch_size=512):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._files = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def create(self, path, text=""):
+        """Crea (o trunca) el archivo `path` con el texto inicial `text`."""
+        self._ensure_started()
+        self._queue.put(("create", path, text))
+
+    def write(self, path, line):
+        """Añade una línea al archivo `path`."""
+        self._ensure_started()
+        self._queue.put(("write", path, line + "\n"))
+
+    def write_event(self, path, event):
+        """Añade un evento como una línea JSON al archivo `path`."""
+        self.write(path, json.dumps(event, ensure_ascii=False))
+
+    def flush(self, wait=False):
+        """Vuelca a disco lo escrito hasta ahora. Con `wait` bloquea hasta que esté escrito."""
+        self._ensure_started()
+        done = threading.Event() if wait else None
+        self._queue.put(("flush", None, done))
+        if done:
+            done.wait()
+
+    def close_file(self, path, wait=False):
+        """Vuelca y cierra el archivo `path` (fin de la partida)."""
+        self._ensure_started()
+        done = threading.Event() if wait else None
+        self._queue.put(("close", path, done))
+        if done:
+            done.wait()
+
+    def close(self):
+        """Escribe todo lo pendiente, cierra los archivos y detiene el hilo."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put((self._STOP, None, None))
+        thread.join()
+
+    def _run(self):
+        while True:
             try:
-                if json_content_to_parse:
-                    parsed_detective_json = json.loads(json_content_to_parse)
-                    question = parsed_detective_json.get("PREGUNTA", "").strip()
-                    solution_attempt_text = parsed_detective_json.get("SOLUCION", "").strip()
-                else:
-                    parsed_detective_json = None
-            except json.JSONDecodeError as e:
-                error_message += f"Error al parsear JSON: {e}. Contenido: '{json_content_to_parse}'"
-                parsed_detective_json = None
-
-            # Extraer el razonamiento de la parte anterior al bloque JSON
-            reasoning_start_tag = "RAZONAMIENTO:"
-            reasoning_text_potential = detective_response[:reasoning_end_index].strip()
-            
-            reasoning_start_index = reasoning_text_potential.find(reasoning_start_tag)
-            if reasoning_start_index != -1:
-                reasoning = reasoning_text_potential[reasoning_start_index + len(reasoning_start_tag):].strip()
+                operations = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                self._flush_all()
+                continue
+            # Se procesan en bloque todas las operaciones ya encoladas
+            while len(operations) < self.batch_size:
+                try:
+                    operations.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for kind, path, payload in operations:
+                if kind is self._STOP:
+                    self._flush_all()
+                    for handle in self._files.values():
+                        handle.close()
+                    self._files.clear()
+                    return
+                try:
+                    self._apply(kind, path, payload)
+                except OSError as e:
+                    self.last_error = e
+                if kind in ("flush", "close") and payload is not None:
+                    payload.set()
+
+    def _apply(self, kind, path, payload):
+        if kind == "create":
+            self._close(path)
+            self._files[path] = open(path, "w", encoding="utf-8")
+            self._files[path].write(payload)
+            self._dirty.add(path)
+        elif kind == "write":
+            handle = self._files.get(path)
+            if handle is None:
+                handle = self._files[path] = open(path, "a", encoding="utf-8")
+            handle.write(payload)
+            self._dirty.add(path)
+        elif kind == "flush":
+            self._flush_all()
+        elif kind == "close":
+            self._close(path)
+
+    def _close(self, path):
+        handle = self._files.pop(path, None)
+        self._dirty.discard(path)
+        if handle:
+            handle.close()
+
+    def _flush_all(self):
+        for path in list(self._dirty):
+            try:
+                self._files[path].flush()
+            except OSError as e:
+                self.last_error = e
+        self._dirty.clear()
+
+# Escritor compartido por todas las partidas del proceso
+TRANSCRIPTS = TranscriptWriter()
+
+class TranscriptLog:
+    """
+    Suscriptor de GameSession que escribe el registro de una partida con un TranscriptWriter:
+    el archivo de texto legible y el flujo de eventos JSONL de stories/.
+    """
+    def __init__(self, writer=None, events_path=None):
+        self.writer = writer or TRANSCRIPTS
+        self.events_path = events_path or os.path.join(PROMPTS_DIR, EVENTS_FILENAME)
+        self.filename = None
+
+    def __call__(self, event):
+        kind = event["type"]
+        if kind == "historia":
+            self.filename = event["filename"]
+            if event.get("resumed"):
+                # La partida reanudada sigue en el mismo archivo
+                self.writer.write(self.filename, f"\n--- Partida reanudada tras el turno {event['turn']} ---")
             else:
-                reasoning = "No se encontró el razonamiento explícito."
+                self.writer.create(self.filename, f"--- Historia Larga ---\n{event['story_long']}\n\n--- Solución ---\n{event['solution']}\n\n--- Interacción ---\n")
+        elif kind == "turno":
+            self.writer.flush() # Límite de turno: lo escrito en el turno anterior llega a disco
+            if self.filename:
+                self.writer.write(self.filename, f"\n--- Turno {event['turn']} ---")
+        elif kind == "mensaje":
+            self.writer.write_event(self.events_path, {"game_id": event["game_id"], "time": time.time(), "turn": event["turn"],
+                                                       "role": event["role"], "kind": event["kind"], "content": event["content"]})
+            if self.filename:
+                prefix = "Detective (Intento de solución)" if event["kind"] == "solucion" else event["role"]
+                self.writer.write(self.filename, f"{prefix}: {event['content']}")
+        elif kind == "fin":
+            result = event["result"]
+            self.writer.write_event(self.events_path, {"game_id": event["game_id"], "time": time.time(), "turn": result["turns"],
+                                                       "role": "Sistema", "kind": "fin", "content": result["outcome"],
+                                                       "juez": result["juez"], "detective": result["detective"]})
+            if self.filename:
+                self.writer.close_file(self.filename)
+            self.writer.flush()
+        elif kind == "interrupcion":
+            self.writer.flush()
 
-            # Opcional: Imprimir el razonamiento para depuración
-            # print_color(f"Razonamiento del Detective (interno): {reasoning}", Fore.BLUE)
+# --- Puntos de Control de las Partidas ---
 
-            if question:
-                print_color(get_bubble_ascii(question, f"Detective ({detective_model.name})", Fore.RED), Fore.RED)
-                log_to_file(filename, f"Detective: {question}")
-                input("[PULSA INTRO PARA CONTINUAR]")
+CHECKPOINTS_DIR = os.path.join(PROMPTS_DIR, "checkpoints")
+CHECKPOINT_VERSION = 1
+# Resultados con los que la partida queda pendiente de reanudar; el resto la terminan
+RESUMABLE_OUTCOMES = ("error", "formato_invalido_detective")
+# Reanudaciones de una misma partida antes de darla por perdida y borrar su punto de control
+MAX_RESUMES = 3
 
-                # Juez responde a la pregunta
-                judge_answer_prompt = JUDGE_SYSTEM_PROMPT + f"\n\nHistoria: {story_short}\nSolución: {solution}\nPregunta del Detective: {question}\n\nResponde estrictamente con 'Sí', 'No' o 'Irrelevante'."
-                judge_answer = juez_model.generate(judge_answer_prompt).strip()
+class CheckpointStore:
+    """
+    Puntos de control de las partidas en curso: un JSON por partida (<game_id>.json) con lo
+    necesario para continuarla desde el último turno completo (historia, conversaciones de
+    ambos modelos, turno, transcripción y modelos). Cada escritura es atómica (archivo temporal
+    y os.replace), así que un corte a mitad de escritura deja intacto el punto de control anterior.
+    """
+    def __init__(self, directory=CHECKPOINTS_DIR):
+        self.directory = directory
+
+    def path(self, game_id):
+        return os.path.join(self.directory, f"{game_id}.json")
+
+    def save(self, state):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(state["game_id"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def delete(self, game_id):
+        try:
+            os.remove(self.path(game_id))
+        except FileNotFoundError:
+            pass
+
+    def load(self, game_id):
+        """
+        Carga el punto de control de una partida por su identificador o un prefijo suyo (como los
+        8 caracteres de los nombres de archivo). Lanza ValueError si no hay uno único.
+        """
+        matches = [state for state in self.pending() if state["game_id"].startswith(game_id)] if game_id else []
+        if len(matches) != 1:
+            problem = "No hay ninguna partida pendiente" if not matches else "Hay varias partidas pendientes"
+            raise ValueError(f"{problem} con el identificador '{game_id}'.")
+        return matches[0]
+
+    def pending(self, model_args=None):
+        """
+        Partidas pendientes de reanudar, de la más antigua a la más reciente. Con `model_args`
+        (argumentos -m1 y -m2), solo las de esa pareja de modelos.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        states = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue # Archivo ajeno o ilegible: se ignora
+            if state.get("version") != CHECKPOINT_VERSION:
+                continue
+            if model_args is not None and tuple(state.get("model_args") or ()) != tuple(model_args):
+                continue
+            states.append(state)
+        return sorted(states, key=lambda state: state["updated"])
+
+# --- Lógica Principal del Juego ---
+
+class GameSession:
+    """
+    Partida como máquina de estados asíncrona que emite cada paso como evento a sus suscriptores
+    (TerminalUI, TranscriptLog, MetricsRecorder). Con `checkpoints` guarda un punto de control por turno
+    y con `resume` continúa desde uno.
+    """
+    def __init__(self, juez_model, detective_model, game_tag=None, max_turns=MAX_TURNS, story=None, store=None, subscribers=(),
+                 answer_cache=JUDGE_ANSWERS, checkpoints=None, model_args=None, resume=None):
+        self.juez_model = juez_model
+        self.detective_model = detective_model
+        self.max_turns = max_turns
+        self.story = story
+        self.store = store
+        self.subscribers = list(subscribers)
+        self.answer_cache = answer_cache # None desactiva la caché de respuestas del Juez
+        self.story_key = None # (modelo Juez, huella de la historia), en cuanto se conoce la historia
+        self.checkpoints = checkpoints
+        self.model_args = model_args
+        self.checkpointed = False # Si hay un punto de control guardado de esta partida
+        self.feedback = "" # Lo que el Detective debe saber del turno anterior
+        self.resumes = 0
+        self.elapsed_before = 0.0 # Tiempo jugado antes de reanudar
+        self._run_started = None
+        self._task = None # Tarea que ejecuta run(), para poder detenerla con stop()
+        self.stop_reason = None
+        self.game_id = uuid.uuid4().hex
+        self.game_label = game_tag or self.game_id[:8]
+        self.turn = 0
+        self.transcript = [] # Eventos de la partida para el almacén: turno, rol, tipo y contenido
+        self._call_ids = itertools.count(1)
+        self.result = {
+            "game_id": self.game_id,
+            "story_id": None,
+            "started": time.time(),
+            "juez": juez_model.name,
+            "detective": detective_model.name,
+            "outcome": "error",
+            "solved": False,
+            "turns": 0,
+            "invalid_judge_answer": False,
+            "judge_cache_hits": 0,
+            "resumes": 0,
+            "checkpoint": None,
+            "error": None,
+            "filename": None,
+            "wall_time": 0.0,
+            "prompt_tokens": 0,
+            "calls": [],
+        }
+        # Cada rol mantiene su propia conversación: el system prompt solo se procesa una vez
+        self.judge_session = juez_model.start_session(JUDGE_SYSTEM_PROMPT, story_messages(story) if story else None)
+        self.detective_session = detective_model.start_session(DETECTIVE_SYSTEM_PROMPT)
+        if resume:
+            self.restore(resume)
+
+    # Campos del resultado que se conservan en el punto de control
+    CHECKPOINT_RESULT_KEYS = ("started", "story_id", "filename", "judge_cache_hits")
+
+    def snapshot(self):
+        """Estado de la partida al final del último turno completo, para el punto de control."""
+        return {
+            "version": CHECKPOINT_VERSION,
+            "game_id": self.game_id,
+            "game_tag": self.game_label,
+            "model_args": list(self.model_args) if self.model_args else None,
+            "juez": self.juez_model.name,
+            "detective": self.detective_model.name,
+            "max_turns": self.max_turns,
+            "turn": self.turn,
+            "feedback": self.feedback,
+            "story": self.story,
+            "judge_messages": self.judge_session.messages,
+            "judge_usage": self.judge_session.turn_usage,
+            "detective_messages": self.detective_session.messages,
+            "detective_usage": self.detective_session.turn_usage,
+            "transcript": self.transcript,
+            "result": {key: self.result[key] for key in self.CHECKPOINT_RESULT_KEYS},
+            "elapsed": self.elapsed(),
+            "resumes": self.resumes,
+            "updated": time.time(),
+        }
+
+    def restore(self, state):
+        """Retoma la partida desde un punto de control (ver snapshot())."""
+        self.game_id = state["game_id"]
+        self.game_label = state["game_tag"] or self.game_id[:8]
+        self.max_turns = state["max_turns"]
+        self.turn = state["turn"]
+        self.feedback = state["feedback"]
+        self.story = state["story"]
+        self.transcript = list(state["transcript"])
+        self.judge_session = self.juez_model.start_session(JUDGE_SYSTEM_PROMPT, state["judge_messages"])
+        self.judge_session.turn_usage = list(state["judge_usage"])
+        self.detective_session = self.detective_model.start_session(DETECTIVE_SYSTEM_PROMPT, state["detective_messages"])
+        self.detective_session.turn_usage = list(state["detective_usage"])
+        self.result.update(state["result"], game_id=self.game_id)
+        self.elapsed_before = state["elapsed"]
+        self.resumes = self.result["resumes"] = state["resumes"] + 1
+        self.checkpointed = True
+
+    def elapsed(self):
+        """Segundos jugados, incluidos los de antes de reanudar."""
+        running = time.perf_counter() - self._run_started if self._run_started is not None else 0.0
+        return self.elapsed_before + running
+
+    def save_checkpoint(self):
+        if self.checkpoints:
+            self.checkpoints.save(self.snapshot())
+            self.checkpointed = True
+
+    def finish_checkpoint(self):
+        """
+        Al terminar la partida borra su punto de control, salvo si acabó por un error del que se
+        puede reanudar (y no se ha reanudado ya MAX_RESUMES veces).
+        """
+        if not self.checkpoints or not self.checkpointed:
+            return
+        if self.result["outcome"] in RESUMABLE_OUTCOMES and self.resumes < MAX_RESUMES:
+            self.result["checkpoint"] = self.checkpoints.path(self.game_id)
+        else:
+            self.checkpoints.delete(self.game_id)
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def stop(self, reason):
+        """
+        Detiene la partida en curso (p. ej. otro Detective ha ganado la carrera): se cancela la
+        llamada pendiente, lo que corta la generación en el backend, y run() termina con el
+        resultado 'cancelada', que no se guarda en el almacén ni deja punto de control.
+        """
+        if self._task is not None and not self._task.done():
+            self.stop_reason = reason
+            self._task.cancel()
 
-                if judge_answer not in ["Sí", "No", "Irrelevante"]:
-                    system_message = f"El Juez dio una respuesta inválida: '{judge_answer}'. Fin del juego."
-                    print_color(get_bubble_ascii(system_message, "Sistema", Fore.RED), Fore.RED)
-                    log_to_file(filename, f"Sistema: {system_message}")
+    async def emit(self, event_type, /, **fields):
+        """Envía un evento a todos los suscriptores, esperando a los que son corrutinas."""
+        event = {"type": event_type, "game_id": self.game_id, "game": self.game_label, "turn": self.turn, "time": time.perf_counter(), **fields}
+        for subscriber in self.subscribers:
+            outcome = subscriber(event)
+            if outcome is not None and inspect.isawaitable(outcome):
+                await outcome
+        return event
+
+    async def say(self, role, kind, content, **fields):
+        """Emite un mensaje de la partida, que queda en la transcripción."""
+        self.transcript.append({"turn": self.turn, "role": role, "kind": kind, "content": content})
+        await self.emit("mensaje", role=role, kind=kind, content=content, **fields)
+
+    async def announce(self, content, tone="info", pause=False):
+        """Mensaje del Sistema. `tone` (info, aviso, error, exito, oro, final) orienta su presentación."""
+        await self.say("Sistema", "sistema", content, tone=tone, pause=pause)
+
+    async def call(self, session, role, phase, content, stop_at=None, **kwargs):
+        """
+        Envía un mensaje a una sesión emitiendo 'llamada' y un 'fragmento' por trozo recibido.
+        Retorna (texto, id de la llamada); quien llama emite 'fin_llamada' con end_call() una vez
+        conoce la fase definitiva. Si la llamada falla, 'fin_llamada' se emite aquí.
+        """
+        call_id = next(self._call_ids)
+        await self.emit("llamada", call_id=call_id, role=role, phase=phase, model=session.model.name)
+        text = ""
+        chunks = session.asend_stream(content, **kwargs)
+        try:
+            async for chunk in chunks:
+                text += chunk
+                await self.emit("fragmento", call_id=call_id, role=role, phase=phase, text=chunk)
+                if stop_at and stop_at(text):
+                    break # Cerrar el stream corta la generación en el backend
+        except Exception as e:
+            await chunks.aclose()
+            await self.end_call(session, call_id, role, phase, error=str(e))
+            raise
+        await chunks.aclose()
+        return text, call_id
+
+    async def end_call(self, session, call_id, role, phase, **fields):
+        usage = session.turn_usage[-1] if session.turn_usage else {}
+        await self.emit("fin_llamada", call_id=call_id, role=role, phase=phase, model=session.model.name, usage=usage, **fields)
+
+    async def generate_story(self):
+        """Como generate_story(), emitiendo los eventos de cada llamada al Juez."""
+        message = JUDGE_STORY_REQUEST
+        for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
+            phase = "historia" if attempt == 0 else "reparacion"
+            story_response, call_id = await self.call(self.judge_session, "Juez", phase, message,
+                                                      stop_at=JsonStreamDetector(STORY_KEYS), response_schema=STORY_SCHEMA)
+            await self.end_call(self.judge_session, call_id, "Juez", phase)
+            try:
+                return parse_story_response(story_response)
+            except ValueError:
+                if attempt == MAX_REPAIR_ATTEMPTS:
+                    raise
+                message = build_repair_message(STORY_KEYS)
+
+    async def detective_move(self, message):
+        """
+        Pide al Detective su jugada con salida estructurada, reintentando si no hay JSON válido.
+        Retorna (respuesta, razonamiento, pregunta, solución, error).
+        """
+        for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
+            phase = "pregunta" if attempt == 0 else "reparacion"
+            # Se deja de leer en cuanto se cierra el JSON para no pagar texto sobrante
+            response, call_id = await self.call(self.detective_session, "Detective", phase, message,
+                                                stop_at=JsonStreamDetector(DETECTIVE_KEYS), response_schema=DETECTIVE_SCHEMA)
+            reasoning, question, solution_attempt_text, error_message = parse_detective_response(response)
+            await self.end_call(self.detective_session, call_id, "Detective",
+                                "solucion" if solution_attempt_text and not question else phase)
+            if question or solution_attempt_text:
+                break
+            message = build_repair_message(DETECTIVE_SCHEMA["required"])
+        return response, reasoning, question, solution_attempt_text, error_message
+
+    async def judge_answer(self, question):
+        """
+        Pide al Juez que responda a una pregunta. Retorna (respuesta, desde_caché): la respuesta
+        canónica (normalize_judge_answer) o, si no es válida, el texto tal cual. Las preguntas ya
+        respondidas sobre la misma historia se sirven desde la caché sin llamar al modelo.
+        """
+        message = build_judge_question_message(question)
+        cache = self.answer_cache if self.story_key else None
+        cached = cache.get(self.story_key, question) if cache else None
+        if not cached and cache:
+            waiting = cache.pending(self.story_key, question)
+            if waiting is not None:
+                # Otra partida ya está haciendo esta pregunta: se espera su respuesta (shield para
+                # que cancelar esta partida no cancele la espera de las demás)
+                cached = await asyncio.shield(waiting)
+        if cached:
+            # La conversación del Juez queda igual que si hubiera respondido él
+            self.judge_session.record(message, cached)
+            self.result["judge_cache_hits"] += 1
+            return cached, True
+        inflight = cache.begin(self.story_key, question) if cache else None
+        normalized = None
+        try:
+            for attempt in range(JUDGE_ANSWER_ATTEMPTS):
+                phase = "respuesta" if attempt == 0 else "respuesta_reintento"
+                # El reintento va sin límite de tokens, por si fue el límite lo que cortó la respuesta
+                limit = {"max_tokens": JUDGE_ANSWER_MAX_TOKENS} if attempt == 0 else {}
+                answer, call_id = await self.call(self.judge_session, "Juez", phase, message,
+                                                  stop_at=lambda text: len(text) > JUDGE_ANSWER_MAX_CHARS,
+                                                  choices=VALID_JUDGE_ANSWERS, **limit)
+                await self.end_call(self.judge_session, call_id, "Juez", phase)
+                normalized = normalize_judge_answer(answer)
+                if normalized or not is_truncated_judge_answer(answer):
                     break
+                message = JUDGE_ANSWER_RETRY
+        finally:
+            # Si la llamada falla o se cancela, quienes esperaban preguntan por su cuenta
+            if cache:
+                cache.end(inflight, normalized)
+        if normalized is None:
+            return answer.strip(), False
+        return normalized, False
 
-                print_color(get_bubble_ascii(judge_answer, f"Juez ({juez_model.name})", Fore.GREEN), Fore.GREEN)
-                log_to_file(filename, f"Juez: {judge_answer}")
-                input("[PULSA INTRO PARA CONTINUAR]")
+    async def report_tokens(self, judge_answered):
+        usage = lambda session: dict(session.turn_usage[-1]) if session.turn_usage else {}
+        await self.emit("tokens", detective=usage(self.detective_session), juez=usage(self.judge_session) if judge_answered else None)
+
+    async def run(self):
+        """Juega la partida completa y retorna el diccionario con su resultado."""
+        self._run_started = time.perf_counter()
+        self._task = asyncio.current_task()
+        await self.emit("inicio", juez=self.juez_model.name, detective=self.detective_model.name,
+                        story_from_pool=self.story is not None and not self.resumes, resumed=self.resumes > 0,
+                        max_turns=self.max_turns)
+        try:
+            await self.play()
+        except asyncio.CancelledError:
+            if self.stop_reason is None:
+                # Ctrl-C o cancelación del torneo: la partida queda en su último punto de control
+                checkpoint = self.checkpoints.path(self.game_id) if self.checkpoints and self.checkpointed else None
+                await self.emit("interrupcion", checkpoint=checkpoint)
+                raise
+            # Parada pedida con stop(): la cancelación era nuestra y la partida termina aquí
+            self._task.uncancel()
+            self.result["outcome"] = "cancelada"
+            self.result["error"] = self.stop_reason
+            await self.announce(f"Partida detenida: {self.stop_reason}", "aviso")
+        except Exception as e:
+            self.result["outcome"] = "error"
+            self.result["error"] = str(e)
+            await self.emit("error", message=str(e))
+        # La partida ya ha terminado: un stop() a partir de aquí no debe cancelar el guardado
+        self._task = None
+        result = self.result
+        result["prompt_tokens"] = self.judge_session.total_prompt_tokens + self.detective_session.total_prompt_tokens
+        result["wall_time"] = self.elapsed()
+        self.finish_checkpoint()
+        await self.emit("fin", result=result)
+        if self.store and result["outcome"] != "cancelada":
+            # MinHash y escrituras en SQLite: fuera del bucle, como la IDF
+            await asyncio.to_thread(self.store.save_game, result, self.transcript)
+        return result
+
+    async def play(self):
+        result = self.result
+        # --- Generación de la Historia por el Juez ---
+        if self.story:
+            story_short, story_long, solution = (self.story[key] for key in STORY_KEYS)
+        else:
+            story_short, story_long, solution = await self.generate_story()
+        self.story_key = (self.juez_model.name, story_fingerprint(story_long, solution))
+
+        if not result["filename"]:
+            # El prefijo del identificador evita que dos partidas del mismo minuto compartan archivo
+            timestamp = datetime.now().strftime("%d-%m-%Y %H-%M")
+            result["filename"] = os.path.join(PROMPTS_DIR, f"{timestamp} {self.game_id[:8]}.txt")
+        # La solución se tokeniza y pondera una sola vez para todos los intentos de la partida
+        # La IDF lee SQLite: fuera del bucle para no frenar al resto de partidas
+        idf = await asyncio.to_thread(self.store.solution_idf) if self.store else None
+        solution_matcher = SolutionMatcher(solution, idf=idf)
+        if self.store:
+            result["story_id"] = self.story.get("story_id") if self.story else None
+            if not result["story_id"]:
+                result["story_id"], _ = await asyncio.to_thread(self.store.add_story, story_short, story_long, solution, self.juez_model.name)
+        # Desde aquí self.story es la historia de la partida, la que se guarda en los puntos de control
+        self.story = {"HISTORIA_CORTA": story_short, "HISTORIA_LARGA": story_long, "SOLUCION": solution, "story_id": result["story_id"]}
+
+        resumed = self.resumes > 0
+        await self.emit("historia", story_short=story_short, story_long=story_long, solution=solution, filename=result["filename"], resumed=resumed)
+        if resumed:
+            await self.announce(f"Partida reanudada tras el turno {self.turn}.", "aviso")
+        else:
+            # Iniciar el juego con la historia corta
+            await self.say("Historia", "historia", story_short, pause=True)
+
+        # --- Bucle del Juego ---
+        max_turns = self.max_turns
+        while True:
+            # Punto de control al final de cada turno completo (y tras la historia)
+            self.save_checkpoint()
+            self.turn += 1
+            turn_count = self.turn
+            await self.emit("turno", max_turns=max_turns)
+
+            if turn_count > max_turns:
+                await self.announce(f"Se ha alcanzado el límite de {max_turns} turnos. El Detective no ha resuelto el misterio. La solución era: {solution}", "final")
+                result["outcome"] = "no_resuelto"
+                result["turns"] = max_turns
+                return
+
+            result["turns"] = turn_count
+
+            # Detective formula una pregunta o intenta una solución (forzada en el último turno)
+            detective_message = build_detective_turn_message(story_short, self.feedback, turn_count, max_turns)
+            detective_response, reasoning, question, solution_attempt_text, error_message = await self.detective_move(detective_message)
 
-                # Añadir al historial de conversación
-                conversation_history.append(f"Detective: {question}")
-                conversation_history.append(f"Juez: {judge_answer}")
+            if question:
+                await self.say("Detective", "pregunta", question, pause=True)
+
+                # Juez responde a la pregunta
+                judge_answer, from_cache = await self.judge_answer(question)
+                if judge_answer not in VALID_JUDGE_ANSWERS:
+                    await self.announce(f"El Juez dio una respuesta inválida: '{judge_answer}'. Fin del juego.", "error")
+                    result["outcome"] = "respuesta_invalida_juez"
+                    result["invalid_judge_answer"] = True
+                    return
+
+                await self.say("Juez", "respuesta", judge_answer, pause=True, cached=from_cache)
+                self.feedback = f"Juez: {judge_answer}"
+                await self.report_tokens(judge_answered=not from_cache)
 
             elif solution_attempt_text:
-                print_color(get_bubble_ascii(f"Intento de solución: {solution_attempt_text}", f"Detective ({detective_model.name})", Fore.RED), Fore.RED)
-                log_to_file(filename, f"Detective (Intento de solución): {solution_attempt_text}")
-                input("[PULSA INTRO PARA CONTINUAR]")
-                
+                await self.say("Detective", "solucion", solution_attempt_text, pause=True)
+
                 # Comparar solución
-                if compare_solutions_flexible(solution_attempt_text, solution):
-                    if turn_count == 10:
-                        system_message = "¡El Detective ha resuelto el misterio en el turno 10! Fin del juego."
-                        print_color(get_bubble_ascii(system_message, "Sistema", Fore.YELLOW), Fore.YELLOW) # Dorado
-                        log_to_file(filename, f"Sistema: {system_message}")
+                solved = solution_matcher.matches(solution_attempt_text)
+                await self.emit("veredicto", solved=solved, attempt=solution_attempt_text)
+                if solved:
+                    if turn_count == max_turns:
+                        await self.announce(f"¡El Detective ha resuelto el misterio en el turno {max_turns}! Fin del juego.", "oro")
                     else:
-                        system_message = "¡El Detective ha resuelto el misterio! Fin del juego."
-                        print_color(get_bubble_ascii(system_message, "Sistema", Fore.GREEN), Fore.GREEN)
-                        log_to_file(filename, f"Sistema: {system_message}")
-                    break
-                else:
-                    system_message = "El Detective no ha acertado la solución."
-                    print_color(get_bubble_ascii(system_message, "Sistema", Fore.YELLOW), Fore.YELLOW)
-                    log_to_file(filename, f"Sistema: {system_message}")
-                    if turn_count == 10:
-                        system_message = f"El Detective no acertó en el turno 10. Fin de la partida. La solución era: {solution}"
-                        print_color(get_bubble_ascii(system_message, "Sistema", Fore.MAGENTA), Fore.MAGENTA)
-                        log_to_file(filename, f"Sistema: {system_message}")
-                        break
-                    else:
-                        system_message = "Continúa el juego."
-                        print_color(get_bubble_ascii(system_message, "Sistema", Fore.YELLOW), Fore.YELLOW)
-                        log_to_file(filename, f"Sistema: {system_message}")
-                        input("[PULSA INTRO PARA CONTINUAR]")
+                        await self.announce("¡El Detective ha resuelto el misterio! Fin del juego.", "exito")
+                    result["outcome"] = "resuelto"
+                    result["solved"] = True
+                    return
+                await self.announce("El Detective no ha acertado la solución.", "aviso")
+                if turn_count == max_turns:
+                    await self.announce(f"El Detective no acertó en el turno {max_turns}. Fin de la partida. La solución era: {solution}", "final")
+                    result["outcome"] = "no_resuelto"
+                    return
+                await self.announce("Continúa el juego.", "aviso", pause=True)
+                self.feedback = "Sistema: Tu intento de solución no es correcto. Continúa el juego."
+                await self.report_tokens(judge_answered=False)
             else:
                 full_error_output = f"{error_message}Respuesta completa del Detective: {detective_response}"
-                system_message = f"El Detective no formuló una pregunta o solución válida o el formato JSON es incorrecto. {full_error_output}"
-                print_color(get_bubble_ascii(system_message, "Sistema", Fore.RED), Fore.RED)
-                log_to_file(filename, f"Sistema: {system_message}")
-                break
+                await self.announce(f"El Detective no formuló una pregunta o solución válida o el formato JSON es incorrecto. {full_error_output}", "error")
+                result["outcome"] = "formato_invalido_detective"
+                return
+
+class TerminalUI:
+    """
+    Suscriptor de GameSession que dibuja la partida en la terminal: bocadillos, texto del Detective
+    a medida que llega, progreso de la historia, tokens por turno y la tabla de métricas final.
+    Las pausas ("PULSA INTRO") esperan en un hilo para no bloquear el bucle de eventos.
+    Debe suscribirse después de MetricsRecorder para tener las llamadas en el evento 'fin'.
+    """
+    TONE_COLORS = {"info": Fore.CYAN, "aviso": Fore.YELLOW, "error": Fore.RED, "exito": Fore.GREEN,
+                   "oro": Fore.YELLOW, "final": Fore.MAGENTA}
+    DETECTIVE_FIELDS = {"PREGUNTA": "", "SOLUCION": "Intento de solución: "}
+    # Gemini ordena las claves alfabéticamente, así que TIPO puede llegar después de TEXTO
+    DETECTIVE_ACTION = re.compile(r'"TIPO"\s*:\s*"(PREGUNTA|SOLUCION)"')
+    PROGRESS_MESSAGE = "Juez creando la historia..."
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.juez = self.detective = ""
+        self.streamer = None
+        self.bubble = None
+        self.action = None
+        self.pending = ""
+        self.streamed_key = None
+        self.progress = 0
+
+    @staticmethod
+    def show(text, speaker_name, color):
+        print_color(get_bubble_ascii(text, speaker_name, color), color)
+
+    async def pause(self):
+        # Hilo daemon y no del ejecutor: si la partida se interrumpe con Ctrl-C, el cierre del
+        # bucle de eventos no se queda esperando a que termine input()
+        loop = asyncio.get_running_loop()
+        pressed = loop.create_future()
+
+        def wait_for_enter():
+            try:
+                input("[PULSA INTRO PARA CONTINUAR]")
+            except EOFError:
+                pass
+            try:
+                loop.call_soon_threadsafe(lambda: pressed.done() or pressed.set_result(None))
+            except RuntimeError:
+                pass # El bucle ya se cerró
+
+        threading.Thread(target=wait_for_enter, daemon=True).start()
+        await pressed
 
+    def show_resume_hint(self, game_id):
+        print_color(f"La partida se ha guardado: puedes continuarla con --resume {game_id[:8]}", Fore.YELLOW)
+
+    async def __call__(self, event):
+        kind = event["type"]
+        if kind == "inicio":
+            self.juez, self.detective = event["juez"], event["detective"]
+        elif kind == "llamada":
+            self.progress = 0
+            if event["role"] == "Detective":
+                self.streamer = JsonFieldStreamer(["TEXTO", *self.DETECTIVE_FIELDS])
+                self.bubble = StreamingBubble(f"Detective ({self.detective})", Fore.RED)
+                self.action = None
+                self.pending = ""
+                self.streamed_key = None
+            elif event["phase"] == "historia":
+                print_color("Juez, por favor, crea una Black Story.", Fore.CYAN)
+        elif kind == "fragmento":
+            if event["role"] == "Detective":
+                self.pending += self.streamer.feed(event["text"])
+                if self.streamer.key and self.action is None:
+                    if self.streamer.key in self.DETECTIVE_FIELDS:
+                        self.action = self.streamer.key
+                    else:
+                        # El texto se retiene hasta saber si es una pregunta o una solución
+                        match = self.DETECTIVE_ACTION.search(self.streamer.buffer)
+                        self.action = match.group(1) if match else None
+                if self.action:
+                    if not self.bubble.opened:
+                        self.bubble.feed(self.DETECTIVE_FIELDS[self.action])
+                    if self.pending:
+                        self.bubble.feed(self.pending)
+                        self.pending = ""
+            elif event["phase"] in ("historia", "reparacion"):
+                # Se muestra cuántos caracteres se han recibido en lugar de un spinner
+                self.progress += len(event["text"])
+                sys.stdout.write(f"\r{self.PROGRESS_MESSAGE} {self.progress} caracteres")
+                sys.stdout.flush()
+        elif kind == "fin_llamada":
+            if event["role"] == "Detective":
+                if self.bubble.opened:
+                    self.bubble.close()
+                self.streamed_key = self.action if self.bubble.opened else None
+            elif self.progress:
+                sys.stdout.write("\r" + " " * (len(self.PROGRESS_MESSAGE) + 24) + "\r") # Limpiar la línea
+                sys.stdout.flush()
+                self.progress = 0
+        elif kind == "historia":
+            self.show(f"Historia y solución guardadas en {event['filename']}", "Sistema", Fore.CYAN)
+            # Mostrar historia larga en la terminal
+            print_color(f"\n[Registro de Historia Larga]\n[{datetime.now().strftime('%Y-%m-%d %H:%M')}]\n{event['story_long']}\n---", Fore.CYAN)
+            if event.get("resumed"):
+                # La historia corta no se vuelve a emitir como mensaje: se recuerda aquí
+                self.show(event["story_short"], f"Juez ({self.juez})", Fore.GREEN)
+        elif kind == "turno":
+            print_color(f"\n--- Turno {event['turn']} ---", Fore.CYAN)
+            if self.detective == "gemma3:270m" and event["turn"] <= event["max_turns"]:
+                self.show("Advertencia: El modelo 'gemma3:270m' es muy pequeño y puede tener dificultades para generar preguntas/soluciones en el formato JSON requerido. Se recomienda usar un modelo más grande.", "Sistema", Fore.YELLOW)
+                await self.pause()
+        elif kind == "mensaje":
+            await self.show_message(event)
+        elif kind == "tokens":
+            def fmt(usage):
+                if usage is None:
+                    return "-"
+                approx = "≈" if usage.get("estimated") else ""
+                return f"{approx}{usage.get('prompt_tokens', 0)} ({usage.get('new_tokens', 0)} nuevos)"
+            print_color(f"Tokens de prompt (turno {event['turn']}): Detective {fmt(event['detective'])}, Juez {fmt(event['juez'])}", Fore.BLUE)
+        elif kind == "error":
+            self.show(f"Ocurrió un error durante el juego: {event['message']}", "Sistema", Fore.RED)
+        elif kind == "interrupcion":
+            if event["checkpoint"]:
+                self.show_resume_hint(event["game_id"])
+        elif kind == "fin":
+            if self.metrics and event["result"]["calls"]:
+                print_metrics_summary(self.metrics.summarize(event["result"]["calls"]))
+            if event["result"]["checkpoint"]:
+                self.show_resume_hint(event["game_id"])
+
+    async def show_message(self, event):
+        role, content = event["kind"], event["content"]
+        if role == "historia":
+            self.show(content, f"Juez ({self.juez})", Fore.GREEN)
+        elif role == "pregunta":
+            if self.streamed_key != "PREGUNTA":
+                self.show(content, f"Detective ({self.detective})", Fore.RED)
+        elif role == "respuesta":
+            self.show(content, f"Juez ({self.juez}, ya respondida)" if event.get("cached") else f"Juez ({self.juez})", Fore.GREEN)
+        elif role == "solucion":
+            if self.streamed_key != "SOLUCION":
+                self.show(f"Intento de solución: {content}", f"Detective ({self.detective})", Fore.RED)
+        else:
+            self.show(content, "Sistema", self.TONE_COLORS.get(event.get("tone"), Fore.CYAN))
+        if event.get("pause"):
+            await self.pause()
+
+def play_game(juez_model, detective_model, interactive=True, game_tag=None, max_turns=MAX_TURNS, metrics=None, story=None, store=None, transcripts=None,
+              checkpoints=None, model_args=None, resume=None):
+    """
+    Juega una partida (envoltorio síncrono de GameSession con sus suscriptores habituales), mostrándola
+    en la terminal si `interactive`. Retorna un diccionario con el resultado de la partida.
+    """
+    if metrics is None:
+        metrics = MetricsRecorder()
+    session = GameSession(juez_model, detective_model, game_tag, max_turns, story, store,
+                          subscribers=[metrics, TranscriptLog(transcripts)],
+                          checkpoints=checkpoints, model_args=model_args, resume=resume)
+    if interactive:
+        session.subscribe(TerminalUI(metrics))
+    return run_async(session.run())
+
+# --- Varios Detectives contra la misma Historia ---
+
+ENSEMBLE_MODES = ("race", "compare")
+
+class DetectiveEnsemble:
+    """
+    Varios Detectives, cada uno con su GameSession, contra una misma historia generada una sola vez y el
+    mismo Juez. Con mode 'compare' todos juegan hasta el final; con 'race' gana el primero que acierta
+    y las demás partidas se detienen.
+    """
+    def __init__(self, juez_model, detective_models, mode="compare", max_turns=MAX_TURNS, store=None,
+                 subscribers=None, checkpoints=None, model_args=None):
+        if mode not in ENSEMBLE_MODES:
+            raise ValueError(f"Modo no soportado: {mode}. Use uno de {', '.join(ENSEMBLE_MODES)}.")
+        self.juez_model = juez_model
+        self.detective_models = list(detective_models)
+        self.mode = mode
+        self.max_turns = max_turns
+        self.store = store
+        self.subscribers = subscribers or (lambda detective_model: ())
+        self.checkpoints = checkpoints
+        self.model_args = model_args
+        self.sessions = []
+        self.winner = None # Resultado del Detective ganador, si alguno resolvió el misterio
+
+    def _session(self, index, story):
+        detective_model = self.detective_models[index]
+        model_args = (self.model_args[0], self.model_args[1][index]) if self.model_args else None
+        return GameSession(self.juez_model, detective_model, f"d{index + 1}", self.max_turns, story, self.store,
+                           subscribers=self.subscribers(detective_model), checkpoints=self.checkpoints, model_args=model_args)
+
+    async def run(self):
+        """Juega la historia con todos los Detectives y retorna sus resultados, en el orden de los Detectives."""
+        # La partida del primer Detective genera la historia; las demás la reciben ya hecha
+        leader = self._session(0, None)
+        story_short, story_long, solution = await leader.generate_story()
+        story = {"HISTORIA_CORTA": story_short, "HISTORIA_LARGA": story_long, "SOLUCION": solution, "story_id": None}
+        if self.store:
+            story["story_id"], _ = await asyncio.to_thread(self.store.add_story, story_short, story_long, solution, self.juez_model.name)
+        leader.story = dict(story)
+        self.sessions = [leader] + [self._session(index, dict(story)) for index in range(1, len(self.detective_models))]
+
+        tasks = [asyncio.create_task(session.run()) for session in self.sessions]
+        if self.mode == "race":
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                if result["solved"]:
+                    self.winner = result
+                    for session in self.sessions:
+                        session.stop(f"{result['detective']} resolvió el misterio antes.")
+                    break
+        results = await asyncio.gather(*tasks)
+        if self.winner is None:
+            # En modo compare gana quien resolvió en menos turnos (y, a igualdad, en menos tiempo)
+            solved = [result for result in results if result["solved"]]
+            self.winner = min(solved, key=lambda result: (result["turns"], result["wall_time"])) if solved else None
+        return results
+
+class EnsembleUI:
+    """
+    Suscriptor compartido por las partidas de un DetectiveEnsemble. Como los Detectives juegan a
+    la vez, en lugar de bocadillos y pausas muestra una línea por mensaje con el nombre del Detective.
+    """
+    ROLE_COLORS = {"Detective": Fore.RED, "Juez": Fore.GREEN}
+
+    def __init__(self):
+        self.detectives = {} # game_id -> nombre del Detective
+        self.story_shown = False
+        self.progress = 0
+
+    def __call__(self, event):
+        kind = event["type"]
+        if kind == "inicio":
+            self.detectives[event["game_id"]] = event["detective"]
+        elif kind == "fragmento" and event["role"] == "Juez" and event["phase"] in ("historia", "reparacion"):
+            self.progress += len(event["text"])
+            sys.stdout.write(f"\r{TerminalUI.PROGRESS_MESSAGE} {self.progress} caracteres")
+            sys.stdout.flush()
+        elif kind == "historia" and not self.story_shown:
+            self.story_shown = True
+            if self.progress:
+                sys.stdout.write("\r" + " " * (len(TerminalUI.PROGRESS_MESSAGE) + 24) + "\r")
+            TerminalUI.show(event["story_short"], "Historia", Fore.GREEN)
+        elif kind == "mensaje" and event["kind"] != "historia":
+            detective = self.detectives.get(event["game_id"], event["game"])
+            shared = " (ya respondida)" if event.get("cached") else ""
+            prefix = "Intento de solución: " if event["kind"] == "solucion" else ""
+            color = self.ROLE_COLORS.get(event["role"], TerminalUI.TONE_COLORS.get(event.get("tone"), Fore.CYAN))
+            print_color(f"[{detective}] {event['role']}{shared}: {prefix}{event['content']}", color)
+        elif kind == "error":
+            print_color(f"[{self.detectives.get(event['game_id'], event['game'])}] Error: {event['message']}", Fore.RED)
+
+def play_ensemble(juez_model, detective_models, mode="compare", interactive=True, max_turns=MAX_TURNS, metrics=None,
+                  store=None, transcripts=None, checkpoints=None, model_args=None):
+    """
+    Juega una misma historia con varios Detectives a la vez (ver DetectiveEnsemble). Cada
+    Detective tiene su propia transcripción y sus llamadas se registran en `metrics`.
+    Retorna (resultados en el orden de los Detectives, resultado del ganador o None).
+    """
+    if metrics is None:
+        metrics = MetricsRecorder()
+    ui = EnsembleUI() if interactive else None
+
+    def subscribers(detective_model):
+        return [metrics, TranscriptLog(transcripts)] + ([ui] if ui else [])
+
+    ensemble = DetectiveEnsemble(juez_model, detective_models, mode, max_turns, store, subscribers, checkpoints, model_args)
+    results = run_async(ensemble.run())
+    return results, ensemble.winner
+
+def print_ensemble_report(results, mode, winner=None):
+    """Imprime la comparación de los Detectives de un DetectiveEnsemble."""
+    header = f"{'Detective':<30} {'Resultado':<26} {'Turnos':>6} {'s':>7} {'Tok. prompt':>11} {'Juez':>5} {'Compartidas':>11}"
+    title = "carrera" if mode == "race" else "comparación"
+    print_color(f"\n--- Detectives contra la misma historia ({title}) ---", Fore.CYAN)
+    print_color(header, Fore.CYAN)
+    print_color("-" * len(header), Fore.CYAN)
+    for result in results:
+        judge_calls = sum(1 for call in result["calls"] if call["role"] == "Juez" and call["phase"] == "respuesta")
+        print_color(f"{result['detective'][:30]:<30} {result['outcome'][:26]:<26} {result['turns']:>6} {result['wall_time']:>7.2f} "
+                    f"{result['prompt_tokens']:>11} {judge_calls:>5} {result['judge_cache_hits']:>11}", Fore.CYAN)
+    if winner:
+        print_color(f"Gana {winner['detective']}: resolvió el misterio en el turno {winner['turns']} ({winner['wall_time']:.2f}s).", Fore.YELLOW)
+    else:
+        print_color("Ningún Detective resolvió el misterio.", Fore.MAGENTA)
+
+# --- Modo Batch / Torneo ---
+
+def build_model_pairs(judge_args, detective_args, matrix=False):
+    """
+    Construye la lista de parejas (Juez, Detective).
+    Con matrix=True se enfrentan todos los Jueces contra todos los Detectives;
+    si no, se emparejan por posición (-m1 i-ésimo con -m2 i-ésimo).
+    """
+    if matrix:
+        return list(itertools.product(judge_args, detective_args))
+    if len(judge_args) != len(detective_args):
+        raise ValueError("Sin --matrix, el número de -m1 y -m2 debe coincidir para emparejarlos por posición.")
+    return list(zip(judge_args, detective_args))
+
+def run_batch(pairs, games_per_pair, workers=4, model_loader=None, metrics=None, story_pool_depth=0, store=None, checkpoints=None):
+    """
+    Juega games_per_pair partidas headless por pareja, `workers` a la vez, en un único bucle de eventos,
+    tras precargar todos los modelos (warmup_models). Reanuda primero las partidas interrumpidas si hay
+    `checkpoints` y toma las historias de una StoryPool si story_pool_depth > 0. Retorna los resultados.
+    """
+    if model_loader is None:
+        model_loader = lambda model_arg: load_model(model_arg, GEMINI_API_KEY, OLLAMA_BASE_URL)
+    if metrics is None:
+        metrics = MetricsRecorder()
+
+    # Los modelos se cargan una sola vez por argumento y se comparten entre partidas; se comprueban
+    # y precargan todos a la vez antes de empezar, para que ninguna partida falle o espere por ello
+    models = {}
+    for judge_arg, detective_arg in pairs:
+        for model_arg in (judge_arg, detective_arg):
+            if model_arg not in models:
+                models[model_arg] = model_loader(model_arg)
+    warmup_models(models, on_ready=lambda model_arg, seconds: print_color(f"Modelo {model_arg} listo en {seconds:.1f}s.", Fore.CYAN))
+
+    story_pools = {}
+    if story_pool_depth > 0:
+        for judge_arg in {judge_arg for judge_arg, _ in pairs}:
+            juez_model = models[judge_arg]
+            story_pools[judge_arg] = StoryPool(juez_model, story_pool_depth, path=StoryPool.default_path(juez_model), store=store).start()
+
+    jobs = []
+    for pair_index, (judge_arg, detective_arg) in enumerate(pairs):
+        pending = checkpoints.pending((judge_arg, detective_arg))[:games_per_pair] if checkpoints else []
+        for state in pending:
+            jobs.append((judge_arg, detective_arg, state["game_tag"], state))
+        for game_index in range(len(pending), games_per_pair):
+            jobs.append((judge_arg, detective_arg, f"p{pair_index}-g{game_index}", None))
+    resumed = sum(1 for job in jobs if job[3])
+    if resumed:
+        print_color(f"Se reanudan {resumed} partida(s) interrumpida(s) en una ejecución anterior.", Fore.CYAN)
+
+    results = []
+    try:
+        run_async(play_games(jobs, models, story_pools, workers, metrics, store, results, checkpoints))
+    finally:
+        for pool in story_pools.values():
+            pool.stop()
+    sys.stdout.write("\n")
+    return results
+
+async def play_games(jobs, models, story_pools, workers, metrics, store, results, checkpoints=None):
+    """
+    Juega todas las partidas de un torneo en un único bucle de eventos, con `workers` partidas
+    en curso a la vez. Cada trabajo es (-m1, -m2, etiqueta, punto de control a reanudar o None).
+    Cada resultado se añade a `results` en cuanto termina su partida.
+    """
+    # Los modelos sin cliente asíncrono usan hilos del ejecutor: como mucho uno por partida en curso
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers + 4))
+    slots = asyncio.Semaphore(workers)
+
+    async def play_job(judge_arg, detective_arg, game_tag, resume):
+        async with slots:
+            pool = story_pools.get(judge_arg) if not resume else None
+            # Si la reserva no entrega a tiempo, la partida genera su propia historia
+            story = await asyncio.to_thread(pool.pop, STORY_POOL_WAIT) if pool else None
+            session = GameSession(models[judge_arg], models[detective_arg], game_tag, MAX_TURNS, story, store,
+                                  subscribers=[metrics, TranscriptLog()], checkpoints=checkpoints,
+                                  model_args=(judge_arg, detective_arg), resume=resume)
+            result = await session.run()
+        result["pair"] = (judge_arg, detective_arg)
+        results.append(result)
+        sys.stdout.write(f"\rPartidas completadas: {len(results)}/{len(jobs)}")
+        sys.stdout.flush()
+
+    try:
+        await asyncio.gather(*(play_job(*job) for job in jobs))
+    finally:
+        # Dentro del bucle, antes de que asyncio.run cierre el ejecutor: así los hilos parados
+        # en pop() vuelven enseguida en lugar de bloquear la salida (Ctrl-C)
+        for pool in story_pools.values():
+            pool.stop()
+
+def summarize_results(results):
+    """Calcula las métricas agregadas de una lista de resultados de partidas."""
+    total = len(results)
+    solved = [r for r in results if r["solved"]]
+    wall_times = [r["wall_time"] for r in results]
+    return {
+        "games": total,
+        "solve_rate": len(solved) / total if total else 0.0,
+        "avg_turns_to_solve": sum(r["turns"] for r in solved) / len(solved) if solved else None,
+        "invalid_judge_rate": sum(1 for r in results if r["invalid_judge_answer"]) / total if total else 0.0,
+        "error_rate": sum(1 for r in results if r["outcome"] in ("error", "formato_invalido_detective")) / total if total else 0.0,
+        "avg_wall_time": sum(wall_times) / total if total else 0.0,
+        "min_wall_time": min(wall_times) if wall_times else 0.0,
+        "max_wall_time": max(wall_times) if wall_times else 0.0,
+        "avg_prompt_tokens": sum(r["prompt_tokens"] for r in results) / total if total else 0.0,
+        "judge_cache_hits": sum(r.get("judge_cache_hits", 0) for r in results),
+    }
+
+def print_batch_report(results, pairs, total_wall_time):
+    """Imprime el informe agregado del modo batch, por pareja y global."""
+    header = f"{'Juez':<24} {'Detective':<24} {'Partidas':>8} {'Resueltas':>9} {'Turnos':>7} {'Juez inv.':>9} {'Errores':>8} {'s/partida':>10} {'Tok. prompt':>11}"
+    print_color("\n--- Informe del Torneo ---", Fore.CYAN)
+    print_color(header, Fore.CYAN)
+    print_color("-" * len(header), Fore.CYAN)
+
+    def format_row(judge_label, detective_label, summary):
+        avg_turns = f"{summary['avg_turns_to_solve']:.1f}" if summary["avg_turns_to_solve"] is not None else "-"
+        return (f"{judge_label[:24]:<24} {detective_label[:24]:<24} {summary['games']:>8} "
+                f"{summary['solve_rate']:>9.0%} {avg_turns:>7} {summary['invalid_judge_rate']:>9.0%} "
+                f"{summary['error_rate']:>8.0%} {summary['avg_wall_time']:>10.2f} {summary['avg_prompt_tokens']:>11.0f}")
+
+    for pair in pairs:
+        pair_results = [r for r in results if r["pair"] == pair]
+        print_color(format_row(pair[0], pair[1], summarize_results(pair_results)), Fore.CYAN)
+
+    overall = summarize_results(results)
+    print_color("-" * len(header), Fore.CYAN)
+    print_color(format_row("TOTAL", "", overall), Fore.CYAN)
+    games_per_hour = overall["games"] / total_wall_time * 3600 if total_wall_time else 0.0
+    print_color(
+        f"Tiempo por partida: media {overall['avg_wall_time']:.2f}s, mín {overall['min_wall_time']:.2f}s, máx {overall['max_wall_time']:.2f}s. "
+        f"Tiempo total: {total_wall_time:.2f}s ({games_per_hour:.0f} partidas/hora).",
+        Fore.CYAN,
+    )
+    if overall["judge_cache_hits"]:
+        print_color(f"Preguntas respondidas desde la caché del Juez (sin llamar al modelo): {overall['judge_cache_hits']}.", Fore.CYAN)
+
+def main():
+    parser = argparse.ArgumentParser(description="Juego Black Story CLI con IA Juez y Detective.")
+    parser.add_argument("-m1", action="append", help="Modelo para la IA Juez (ej. 'ollama \"gemma3:270m\"', 'gemini-2.5-flash', 'openai \"gpt-4o-mini\"' o 'anthropic \"nombre\"'). Repetible en modo batch.")
+    parser.add_argument("-m2", action="append", help="Modelo para la IA Detective (ej. 'ollama \"qwen3\"' o 'gemini-2.5-flash'). Repetible en modo batch.")
+    parser.add_argument("--batch", type=int, metavar="N", help="Modo headless: juega N partidas por cada pareja de modelos y muestra un informe agregado.")
+    parser.add_argument("--matrix", action="store_true", help="En modo batch, enfrenta todos los -m1 contra todos los -m2 en lugar de emparejarlos por posición.")
+    parser.add_argument("--workers", type=int, default=4, help="Número de partidas simultáneas en modo batch (por defecto: 4).")
+    parser.add_argument("--cassette", metavar="RUTA", help="Archivo donde grabar/reproducir las llamadas a los modelos.")
+    parser.add_argument("--cassette-mode", choices=CassetteModel.MODES, default="record", help="record: sirve lo grabado y graba lo nuevo; replay: solo reproduce; passthrough: ignora el cassette.")
+    parser.add_argument("--cassette-max-entries", type=int, help="Número máximo de respuestas en el cassette; se expulsan las más antiguas.")
+    parser.add_argument("--cassette-max-age", type=float, metavar="SEGUNDOS", help="Edad máxima de una respuesta grabada antes de descartarla.")
+    parser.add_argument("--story-pool", type=int, default=0, metavar="N", help="Mantiene en segundo plano una reserva de N historias listas por cada Juez.")
+    parser.add_argument("--prefill-stories", type=int, metavar="N", help="Genera N historias para la reserva de cada -m1 y termina (no necesita -m2).")
+    parser.add_argument("--store", default=os.path.join(PROMPTS_DIR, "games.db"), metavar="RUTA", help="Base de datos SQLite con historias, partidas y transcripciones (por defecto: stories/games.db).")
+    parser.add_argument("--stats", action="store_true", help="Muestra la tasa de resolución por Detective guardada en el almacén y termina.")
+    parser.add_argument("--unique-stories", action="store_true", help="Con --stats, ignora las partidas jugadas con historias casi duplicadas.")
+    parser.add_argument("--story-games", metavar="ID", help="Muestra una historia del almacén y todas las partidas jugadas con ella (basta un prefijo del identificador) y termina.")
+    parser.add_argument("--transcript", metavar="ID", help="Muestra la transcripción guardada de una partida (basta el prefijo de 8 caracteres) y termina.")
+    parser.add_argument("--trace", metavar="RUTA", help="Escribe una línea temporal de las llamadas en formato Chrome trace-event (JSON).")
+    parser.add_argument("--ensemble", choices=ENSEMBLE_MODES, help="Varios -m2 contra la misma historia y el mismo -m1 a la vez. race: gana el primero que resuelve y se detiene al resto; compare: todos juegan hasta el final.")
+    parser.add_argument("--resume", metavar="ID", help="Continúa una partida interrumpida desde su último turno completo (basta el prefijo de 8 caracteres). Usa sus modelos salvo que se indiquen -m1/-m2.")
+    args = parser.parse_args()
+    query = args.stats or args.story_games or args.transcript
+    if not query and not args.resume:
+        if not args.m1:
+            parser.error("el argumento -m1 es obligatorio")
+        if not args.m2 and args.prefill_stories is None:
+            parser.error("el argumento -m2 es obligatorio")
+
+    store = GameStore(args.store)
+    if query:
+        try:
+            if args.stats:
+                print_store_stats(store, args.unique_stories)
+            if args.story_games:
+                print_story_games(store, store.resolve_id("stories", args.story_games))
+            if args.transcript:
+                print_game_transcript(store, store.resolve_id("games", args.transcript))
+        except ValueError as e:
+            print_color(get_bubble_ascii(str(e), "Sistema", Fore.RED), Fore.RED)
+        finally:
+            store.close()
+        return
+
+    cassette = None
+    if args.cassette:
+        cassette = Cassette(args.cassette, max_entries=args.cassette_max_entries, max_age=args.cassette_max_age)
+
+    def model_loader(model_arg):
+        return load_model_with_cassette(model_arg, cassette, args.cassette_mode)
+
+    metrics = MetricsRecorder()
+    try:
+        run_cli(parser, args, model_loader, metrics, store)
+    finally:
+        store.close()
+        if cassette:
+            cassette.close()
+        if args.trace and metrics.records:
+            metrics.write_chrome_trace(args.trace)
+            print_color(f"Traza guardada en {args.trace}", Fore.CYAN)
+
+def run_cli(parser, args, model_loader, metrics, store=None):
+    """
+    Ejecuta el modo batch, el prellenado de historias, la reanudación de una partida o la
+    partida interactiva según los argumentos.
+    """
+    if args.prefill_stories is not None:
+        prefill_stories(args.m1, args.prefill_stories, model_loader, store)
+        return
+
+    checkpoints = CheckpointStore()
+    if args.resume:
+        if (args.m1 and len(args.m1) > 1) or (args.m2 and len(args.m2) > 1):
+            parser.error("--resume acepta un único -m1 y un único -m2.")
+        resume_game(args.resume, args.m1[0] if args.m1 else None, args.m2[0] if args.m2 else None,
+                    model_loader, metrics, store, checkpoints)
+        return
+
+    if args.ensemble:
+        if args.batch is not None or args.matrix:
+            parser.error("--ensemble no se combina con --batch ni --matrix.")
+        if len(args.m1) > 1:
+            parser.error("--ensemble acepta un único -m1.")
+        run_ensemble(args.m1[0], args.m2, args.ensemble, model_loader, metrics, store, checkpoints)
+        return
+
+    if args.batch is not None or args.matrix:
+        games_per_pair = args.batch if args.batch is not None else 1
+        try:
+            pairs = build_model_pairs(args.m1, args.m2, args.matrix)
+        except ValueError as e:
+            parser.error(str(e))
+        print_color(f"Iniciando torneo Black Story: {len(pairs)} pareja(s) x {games_per_pair} partida(s), {args.workers} en paralelo.", Fore.CYAN)
+        batch_start = time.perf_counter()
+        try:
+            results = run_batch(pairs, games_per_pair, args.workers, model_loader, metrics, args.story_pool, store, checkpoints)
+        except (ValueError, ModelUnavailable) as e:
+            print_color(get_bubble_ascii(f"Error al cargar modelos: {e}", "Sistema", Fore.RED), Fore.RED)
+            return
+        except KeyboardInterrupt:
+            print_color("\nTorneo interrumpido: las partidas en curso se reanudarán en la próxima ejecución con los mismos modelos.", Fore.YELLOW)
+            return
+        print_batch_report(results, pairs, time.perf_counter() - batch_start)
+        print_metrics_summary(metrics.summarize())
+        return
+
+    if len(args.m1) > 1 or len(args.m2) > 1:
+        parser.error("El modo interactivo acepta un único -m1 y un único -m2. Usa --batch o --matrix para varias parejas, o --ensemble para varios Detectives.")
+    judge_arg, detective_arg = args.m1[0], args.m2[0]
+
+    print_color("Iniciando juego Black Story...", Fore.CYAN)
+    print_color(f"Juez (IA 1) usará: {judge_arg}", Fore.GREEN)
+    print_color(f"Detective (IA 2) usará: {detective_arg}", Fore.RED)
+
+    try:
+        models = prepare_models([judge_arg, detective_arg], model_loader)
+    except (ValueError, ModelUnavailable) as e:
+        print_color(get_bubble_ascii(f"Error al cargar modelos: {e}", "Sistema", Fore.RED), Fore.RED)
+        return
+    juez_model, detective_model = models[judge_arg], models[detective_arg]
+
+    print_color("Modelos cargados correctamente. ¡Comienza el juego!", Fore.CYAN)
+    story = None
+    pool = None
+    if args.story_pool > 0:
+        # Se toma una historia ya lista si la hay; mientras tanto la reserva se repone para la siguiente partida
+        pool = StoryPool(juez_model, args.story_pool, path=StoryPool.default_path(juez_model), store=store).start()
+        story = pool.pop(timeout=0)
+        if story:
+            print_color("Historia tomada de la reserva.", Fore.CYAN)
+    try:
+        play_game(juez_model, detective_model, interactive=True, metrics=metrics, story=story, store=store,
+                  checkpoints=checkpoints, model_args=(judge_arg, detective_arg))
+    except KeyboardInterrupt:
+        print_color("\nPartida interrumpida.", Fore.YELLOW)
+    finally:
+        if pool:
+            pool.stop()
+
+def run_ensemble(judge_arg, detective_args, mode, model_loader, metrics, store=None, checkpoints=None):
+    """Carga los modelos y juega una historia con varios Detectives a la vez (ver DetectiveEnsemble)."""
+    print_color(f"Iniciando Black Story con {len(detective_args)} Detective(s) a la vez ({mode})...", Fore.CYAN)
+    print_color(f"Juez (IA 1) usará: {judge_arg}", Fore.GREEN)
+    print_color(f"Detectives (IA 2) usarán: {', '.join(detective_args)}", Fore.RED)
+    try:
+        models = prepare_models([judge_arg] + list(detective_args), model_loader)
+    except (ValueError, ModelUnavailable) as e:
+        print_color(get_bubble_ascii(f"Error al cargar modelos: {e}", "Sistema", Fore.RED), Fore.RED)
+        return
+    juez_model = models[judge_arg]
+    detective_models = [models[detective_arg] for detective_arg in detective_args]
+    try:
+        results, winner = play_ensemble(juez_model, detective_models, mode, metrics=metrics, store=store,
+                                        checkpoints=checkpoints, model_args=(judge_arg, detective_args))
+    except KeyboardInterrupt:
+        print_color("\nPartidas interrumpidas: cada Detective puede continuar la suya con --resume.", Fore.YELLOW)
+        return
     except Exception as e:
-        print_color(get_bubble_ascii(f"Ocurrió un error durante el juego: {e}", "Sistema", Fore.RED), Fore.RED)
+        print_color(get_bubble_ascii(f"Error al generar la historia: {e}", "Sistema", Fore.RED), Fore.RED)
+        return
+    print_ensemble_report(results, mode, winner)
+    print_metrics_summary(metrics.summarize())
+
+def resume_game(game_id, judge_arg, detective_arg, model_loader, metrics, store=None, checkpoints=None):
+    """Continúa en la terminal una partida interrumpida desde su punto de control."""
+    checkpoints = checkpoints or CheckpointStore()
+    try:
+        state = checkpoints.load(game_id)
+    except ValueError as e:
+        pending = ", ".join(f"{s['game_id'][:8]} ({s['juez']} / {s['detective']}, turno {s['turn']})" for s in checkpoints.pending())
+        print_color(get_bubble_ascii(f"{e} Partidas pendientes: {pending or 'ninguna'}.", "Sistema", Fore.RED), Fore.RED)
+        return
+    saved_args = state["model_args"] or (None, None)
+    judge_arg, detective_arg = judge_arg or saved_args[0], detective_arg or saved_args[1]
+    if not judge_arg or not detective_arg:
+        print_color(get_bubble_ascii("El punto de control no guarda los modelos de la partida: indícalos con -m1 y -m2.", "Sistema", Fore.RED), Fore.RED)
+        return
+
+    print_color(f"Reanudando la partida {state['game_id'][:8]} tras el turno {state['turn']} de {state['max_turns']}...", Fore.CYAN)
+    print_color(f"Juez (IA 1) usará: {judge_arg}", Fore.GREEN)
+    print_color(f"Detective (IA 2) usará: {detective_arg}", Fore.RED)
+    try:
+        models = prepare_models([judge_arg, detective_arg], model_loader)
+    except (ValueError, ModelUnavailable) as e:
+        print_color(get_bubble_ascii(f"Error al cargar modelos: {e}", "Sistema", Fore.RED), Fore.RED)
+        return
+    juez_model, detective_model = models[judge_arg], models[detective_arg]
+    try:
+        play_game(juez_model, detective_model, interactive=True, metrics=metrics, store=store,
+                  checkpoints=checkpoints, model_args=(judge_arg, detective_arg), resume=state)
+    except KeyboardInterrupt:
+        print_color("\nPartida interrumpida.", Fore.YELLOW)
+
+def prefill_stories(judge_args, count, model_loader, store=None):
+    """Genera `count` historias por cada modelo Juez y las guarda en su reserva en disco."""
+    try:
+        models = prepare_models(judge_args, model_loader)
+    except (ValueError, ModelUnavailable) as e:
+        print_color(get_bubble_ascii(f"Error al cargar modelos: {e}", "Sistema", Fore.RED), Fore.RED)
+        return
+    for judge_arg, juez_model in models.items():
+        pool = StoryPool(juez_model, path=StoryPool.default_path(juez_model), store=store)
+        print_color(f"Generando {count} historia(s) con {judge_arg}...", Fore.CYAN)
+        try:
+            pool.prefill(count, on_story=lambda done: print_color(f"Historia {done}/{count} lista.", Fore.CYAN))
+        except Exception as e:
+            print_color(get_bubble_ascii(f"Error al generar historias: {e}", "Sistema", Fore.RED), Fore.RED)
+        if pool.duplicates:
+            print_color(f"Se descartaron {pool.duplicates} historia(s) casi duplicadas.", Fore.YELLOW)
+        print_color(f"Reserva de {judge_arg}: {len(pool.stories)} historia(s) en {pool.path}", Fore.CYAN)
+
+# --- Comparación de Soluciones ---
+
+# Umbral de la puntuación de SolutionMatcher a partir del cual un intento se da por correcto
+# (calibrado con benchmarks/bench_matcher.py sobre intentos etiquetados)
+SOLUTION_MATCH_THRESHOLD = 0.4
+# Términos de la solución que el intento debe contener como mínimo (todos si la solución tiene menos):
+# en soluciones cortas el umbral solo no basta, "Lo envenenó su hermano" cubre la mitad de "Lo envenenó su mujer"
+SOLUTION_MIN_MATCHED_TERMS = 3
 
-def compare_solutions_flexible(detective_solution, actual_solution, threshold=0.6):
+# Palabras vacías del español, ya sin tildes (se comparan tras normalize_text). Las negaciones
+# ("no", "sin", "nada", "ni") no lo son: "no murió" y "murió" son soluciones opuestas
+SPANISH_STOPWORDS = frozenset("""
+a al algo alguien algun alguna algunas alguno algunos ante antes aqui asi aun aunque bajo cada como con contra
+cual cuales cuando de del desde donde dos durante e el ella ellas ello ellos en entonces entre era eran eres es
+esa esas ese eso esos esta estaba estaban estado estan estar este esto estos fue fueron fui ha habia habian
+haber han has hasta hay he la las le les lo los mas me mi mientras mis misma mismo mucho muy
+nos nosotros o os otra otras otro otros para pero poco por porque que quien quienes se sea ser si sido siempre
+sino sobre su sus tambien tan tanto te tenia tenian tiene tienen todo todos tras tu tus un una unas uno unos
+y ya yo
+""".split())
+
+# Sufijos del stemmer ligero, de más largo a más corto
+SPANISH_SUFFIXES = (
+    "amientos", "imientos", "amiento", "imiento", "aciones", "uciones", "adoras", "adores", "ancias",
+    "encias", "mente", "acion", "ucion", "adora", "ador", "ancia", "encia", "idad", "ivas", "ivos",
+    "iendo", "ando", "aron", "ieron", "aban", "ados", "adas", "idos", "idas", "aba", "ado", "ada", "ido",
+    "ida", "iva", "ivo", "ar", "er", "ir", "as", "es", "os", "a", "e", "o", "s",
+)
+MIN_STEM_CHARS = 3
+
+def normalize_text(text):
+    """Pasa el texto a minúsculas y le quita las tildes (la ñ queda como n)."""
+    text = text.lower()
+    if text.isascii():
+        return text
+    # Tras la descomposición las tildes son caracteres aparte que la codificación ASCII descarta
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+@functools.lru_cache(maxsize=65536)
+def spanish_stem(word):
+    """Stemmer ligero para el español: quita el sufijo más largo dejando al menos MIN_STEM_CHARS letras."""
+    for suffix in SPANISH_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_CHARS:
+            return word[:-len(suffix)]
+    return word
+
+def solution_terms(text):
+    """Tokeniza un texto en raíces normalizadas, sin palabras vacías."""
+    return [spanish_stem(word) for word in re.findall(r"\w+", normalize_text(text)) if word not in SPANISH_STOPWORDS]
+
+def count_document_terms(documents, document_frequency=None):
+    """Suma a `document_frequency` (término -> número de documentos que lo contienen) los documentos dados."""
+    if document_frequency is None:
+        document_frequency = {}
+    for document in documents:
+        for term in set(solution_terms(document)):
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    return document_frequency
+
+def idf_from_frequencies(document_frequency, total):
+    """IDF de BM25 a partir de las frecuencias de documento de un corpus de `total` documentos."""
+    idf = {term: math.log(1 + (total - count + 0.5) / (count + 0.5)) for term, count in document_frequency.items()}
+    idf[None] = math.log(1 + (total + 0.5) / 0.5)
+    return idf
+
+def build_idf(documents):
     """
-    Compara la solución del detective con la solución real de forma flexible.
-    Retorna True si un porcentaje de palabras clave de la solución real están presentes
-    en la solución del detective.
+    Calcula la IDF de BM25 de cada término sobre un corpus de soluciones.
+    Los términos que no aparecen en el corpus reciben la IDF máxima (clave None).
     """
-    # Limpiar y tokenizar las soluciones
-    def clean_and_tokenize(text):
-        text = text.lower()
-        # Eliminar puntuación y dividir en palabras
-        words = re.findall(r'\b\w+\b', text)
-        # Filtrar palabras comunes (stop words) si es necesario, para este caso simple no lo haré
-        return set(words)
+    documents = list(documents)
+    return idf_from_frequencies(count_document_terms(documents), len(documents))
 
-    detective_words = clean_and_tokenize(detective_solution)
-    actual_words = clean_and_tokenize(actual_solution)
+def _numpy():
+    """Importa NumPy solo cuando se usa la API por lotes; retorna None si no está instalado."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
 
-    # Calcular la intersección de palabras
-    common_words = detective_words.intersection(actual_words)
+class SolutionMatcher:
+    """
+    Puntúa intentos de solución (entre 0 y 1) contra la solución secreta, tokenizada una sola vez y
+    ponderada con BM25 (IDF de build_idf si se pasa `idf`): fracción de su peso presente en el intento.
+    Un intento acierta si alcanza el umbral y contiene al menos `min_matched_terms` términos de la solución.
+    """
+    def __init__(self, solution, threshold=SOLUTION_MATCH_THRESHOLD, idf=None, k1=1.2, min_matched_terms=SOLUTION_MIN_MATCHED_TERMS):
+        self.solution = solution
+        self.threshold = threshold
+        counts = {}
+        for term in solution_terms(solution):
+            counts[term] = counts.get(term, 0) + 1
+        default_idf = idf.get(None, 1.0) if idf else 1.0
+        self.weights = {
+            term: (idf.get(term, default_idf) if idf else 1.0) * count * (k1 + 1) / (count + k1)
+            for term, count in counts.items()
+        }
+        self.total_weight = sum(self.weights.values())
+        self.min_matched = min(min_matched_terms, len(self.weights))
+        self._vector = None
 
-    # Calcular el porcentaje de palabras clave de la solución real que están en la solución del detective
-    if not actual_words:
-        return True # Si la solución real está vacía, cualquier cosa es correcta (caso borde)
+    def _score_terms(self, attempt):
+        """(puntuación, términos de la solución presentes) de un intento."""
+        attempt_terms = set(solution_terms(attempt))
+        matched = [term for term in self.weights if term in attempt_terms]
+        if not self.total_weight:
+            return 1.0, 0
+        return sum(self.weights[term] for term in matched) / self.total_weight, len(matched)
 
-    match_percentage = len(common_words) / len(actual_words)
-    return match_percentage >= threshold
+    def score(self, attempt):
+        """Puntuación de un intento (1.0 si la solución no tiene términos)."""
+        return self._score_terms(attempt)[0]
+
+    def matches(self, attempt):
+        """True si el intento alcanza el umbral con suficientes términos de la solución."""
+        score, matched = self._score_terms(attempt)
+        return score >= self.threshold and matched >= self.min_matched
+
+    def score_many(self, attempts):
+        """
+        Puntúa muchos intentos a la vez: se construye una matriz de presencia intentos × términos
+        de la solución y se multiplica por el vector de pesos. Retorna un array de NumPy
+        (o una lista si NumPy no está instalado).
+        """
+        return self.matches_many(attempts)[0]
+
+    def matches_many(self, attempts):
+        """
+        Como score_many, pero retorna (puntuaciones, aciertos) con el mismo criterio que matches().
+        """
+        np = _numpy()
+        if np is None:
+            results = [self._score_terms(attempt) for attempt in attempts]
+            return ([score for score, _ in results],
+                    [score >= self.threshold and matched >= self.min_matched for score, matched in results])
+        if not self.total_weight:
+            return np.ones(len(attempts)), np.ones(len(attempts), dtype=bool)
+        if self._vector is None:
+            self._index = {term: column for column, term in enumerate(self.weights)}
+            self._vector = np.fromiter(self.weights.values(), dtype=np.float64, count=len(self.weights))
+        rows, columns = [], []
+        index = self._index
+        for row, attempt in enumerate(attempts):
+            for term in set(solution_terms(attempt)):
+                column = index.get(term)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        presence = np.zeros((len(attempts), len(index)), dtype=np.float64)
+        presence[rows, columns] = 1.0
+        scores = presence @ self._vector / self.total_weight
+        return scores, (scores >= self.threshold) & (presence.sum(axis=1) >= self.min_matched)
+
+def score_solution_pairs(attempts, solutions, threshold=SOLUTION_MATCH_THRESHOLD, idf=None):
+    """
+    Puntúa pares (intento, solución) en bloque, p. ej. todos los intentos de un torneo o de un
+    corpus grabado. Los intentos se agrupan por solución para reutilizar un SolutionMatcher
+    por solución. Retorna (puntuaciones, aciertos) como arrays de NumPy (o listas sin NumPy).
+    """
+    groups = {}
+    for position, solution in enumerate(solutions):
+        groups.setdefault(solution, []).append(position)
+    np = _numpy()
+    scores = np.zeros(len(attempts)) if np is not None else [0.0] * len(attempts)
+    hits = np.zeros(len(attempts), dtype=bool) if np is not None else [False] * len(attempts)
+    for solution, positions in groups.items():
+        group_scores, group_hits = SolutionMatcher(solution, threshold, idf).matches_many([attempts[position] for position in positions])
+        for position, value, hit in zip(positions, group_scores, group_hits):
+            scores[position] = value
+            hits[position] = hit
+    return scores, hits
+
+def compare_solutions_flexible(detective_solution, actual_solution, threshold=SOLUTION_MATCH_THRESHOLD):
+    """
+    Compara la solución del detective con la solución real de forma flexible.
+    Retorna True si la puntuación de SolutionMatcher alcanza el umbral.
+    Dentro de una partida es preferible crear un SolutionMatcher una sola vez.
+    """
+    return SolutionMatcher(actual_solution, threshold).matches(detective_solution)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,152 @@
+"""
+Pruebas del cassette de respuestas (Cassette / CassetteModel) con SyntheticModel como modelo interno.
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+DETECTIVE_PROMPT = [{"role": "user", "content": "Haz tu siguiente pregunta."}]
+
+class CassetteTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cassette.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup_after_reopen_uses_saved_index(self):
+        cassette = main.Cassette(self.path)
+        cassette.put("a", "m", "uno", {"completion_tokens": 3})
+        cassette.close()
+        reopened = main.Cassette(self.path)
+        entry = reopened.get("a")
+        self.assertEqual(entry["response"], "uno")
+        self.assertEqual(entry["usage"], {"completion_tokens": 3})
+        self.assertIsNone(reopened.get("b"))
+
+    def test_rebuild_after_truncated_line(self):
+        cassette = main.Cassette(self.path)
+        cassette.put("a", "m", "uno")
+        cassette.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, "ab") as f:
+            f.write(b'{"key": "b", "mod') # Escritura interrumpida: sin salto de línea
+        # El índice guardado ya no corresponde al archivo y se reconstruye
+        cassette = main.Cassette(self.path)
+        self.assertEqual(cassette.get("a")["response"], "uno")
+        self.assertIsNone(cassette.get("b"))
+        self.assertEqual(os.path.getsize(self.path), size)
+        cassette.put("c", "m", "tres")
+        cassette.close()
+        # Sin índice también se recuperan todas las entradas completas
+        os.remove(self.path + ".idx")
+        cassette = main.Cassette(self.path)
+        self.assertEqual(cassette.get("a")["response"], "uno")
+        self.assertEqual(cassette.get("c")["response"], "tres")
+
+    def test_rebuild_skips_corrupt_line(self):
+        cassette = main.Cassette(self.path)
+        cassette.put("a", "m", "uno")
+        cassette.close()
+        with open(self.path, "ab") as f:
+            f.write(b"no es json\n")
+        cassette = main.Cassette(self.path)
+        cassette.put("b", "m", "dos")
+        self.assertEqual(cassette.get("a")["response"], "uno")
+        self.assertEqual(cassette.get("b")["response"], "dos")
+        self.assertEqual(cassette._dead_bytes, len(b"no es json\n"))
+
+    def test_evicts_oldest_beyond_max_entries(self):
+        cassette = main.Cassette(self.path, max_entries=2)
+        for key in ("a", "b", "c"):
+            cassette.put(key, "m", key.upper())
+        self.assertIsNone(cassette.get("a"))
+        self.assertEqual(cassette.get("b")["response"], "B")
+        self.assertEqual(cassette.get("c")["response"], "C")
+
+    def test_expires_entries_older_than_max_age(self):
+        cassette = main.Cassette(self.path, max_age=60)
+        with mock.patch("main.time.time", return_value=1000.0):
+            cassette.put("a", "m", "uno")
+        with mock.patch("main.time.time", return_value=1030.0):
+            self.assertEqual(cassette.get("a")["response"], "uno")
+        with mock.patch("main.time.time", return_value=1061.0):
+            self.assertIsNone(cassette.get("a"))
+
+    def test_compacts_when_half_the_file_is_dead(self):
+        cassette = main.Cassette(self.path)
+        cassette.put("a", "m", "primera")
+        for i in range(5):
+            cassette.put("b", "m", f"versión {i}")
+        # Cada sustitución deja bytes muertos; al superar la mitad del archivo se reescribe
+        self.assertLessEqual(cassette._dead_bytes, os.path.getsize(self.path) // 2)
+        with open(self.path, encoding="utf-8") as f:
+            keys = [json.loads(line)["key"] for line in f]
+        self.assertLess(len(keys), 6)
+        self.assertEqual(cassette.get("a")["response"], "primera")
+        self.assertEqual(cassette.get("b")["response"], "versión 4")
+        cassette.close()
+        self.assertEqual(main.Cassette(self.path).get("b")["response"], "versión 4")
+
+class CassetteModelTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cassette = main.Cassette(os.path.join(self.tmp.name, "cassette.jsonl"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def model(self, mode):
+        return main.CassetteModel(main.SyntheticModel(seed=1, chunk_chars=8), self.cassette, mode=mode)
+
+    def test_record_then_replay(self):
+        recorded = self.model("record").chat(DETECTIVE_PROMPT, system="Eres el Detective")
+        usage = {}
+        replayed = self.model("replay").chat(DETECTIVE_PROMPT, system="Eres el Detective", usage=usage)
+        self.assertEqual(replayed, recorded)
+        self.assertIn("completion_tokens", usage)
+
+    def test_replay_miss_raises(self):
+        model = self.model("replay")
+        with self.assertRaises(main.CassetteMiss):
+            model.chat(DETECTIVE_PROMPT, system="Eres el Detective")
+        with self.assertRaises(main.CassetteMiss):
+            next(model.chat_stream(DETECTIVE_PROMPT, system="Eres el Detective"))
+
+    def test_options_are_part_of_the_key(self):
+        self.model("record").chat(DETECTIVE_PROMPT, system="Eres el Detective", max_tokens=8)
+        with self.assertRaises(main.CassetteMiss):
+            self.model("replay").chat(DETECTIVE_PROMPT, system="Eres el Detective")
+
+    def test_passthrough_does_not_record(self):
+        self.model("passthrough").chat(DETECTIVE_PROMPT, system="Eres el Detective")
+        with self.assertRaises(main.CassetteMiss):
+            self.model("replay").chat(DETECTIVE_PROMPT, system="Eres el Detective")
+
+    def test_partial_stream_records_what_was_consumed(self):
+        stream = self.model("record").chat_stream(DETECTIVE_PROMPT, system="Eres el Detective")
+        consumed = next(stream) + next(stream)
+        stream.close() # El consumidor corta el stream
+        replayed = "".join(self.model("replay").chat_stream(DETECTIVE_PROMPT, system="Eres el Detective"))
+        self.assertEqual(replayed, consumed)
+
+    def test_async_stream_records_full_response(self):
+        async def consume(model):
+            return "".join([chunk async for chunk in model.achat_stream(DETECTIVE_PROMPT, system="Eres el Detective")])
+        recorded = asyncio.run(consume(self.model("record")))
+        self.assertEqual(asyncio.run(consume(self.model("replay"))), recorded)
+
+if __name__ == "__main__":
+    unittest.main()
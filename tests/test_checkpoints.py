@@ -0,0 +1,130 @@
+"""
+Pruebas de los puntos de control: una partida interrumpida a mitad se reanuda desde su último
+turno completo y termina igual que si no se hubiera cortado.
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+MAX_TURNS = 5
+
+class ScriptedJudge(main.SyntheticModel):
+    """Juez sintético determinista: responde 'No' a todo."""
+    def __init__(self):
+        super().__init__("juez-guionizado", seed=1)
+
+    def _respond(self, messages, system):
+        if "Pregunta del Detective" in messages[-1]["content"]:
+            return "No"
+        return super()._respond(messages, system)
+
+class ScriptedDetective(main.SyntheticModel):
+    """Detective que pregunta por el número de turno, resuelve en el último y falla con `error` en `fail_at_turn`."""
+    def __init__(self, fail_at_turn=None, error=ConnectionError("se ha perdido la conexión")):
+        super().__init__("detective-guionizado", solve_rate=0.0, seed=2)
+        self.fail_at_turn = fail_at_turn
+        self.error = error
+
+    def _respond(self, messages, system):
+        prompt = messages[-1]["content"]
+        turn = int(re.search(r"Turno actual: (\d+)", prompt).group(1))
+        if turn == self.fail_at_turn:
+            raise self.error
+        if "DEBES intentar una solución" in prompt:
+            action, text = "SOLUCION", self.SOLUTION
+        else:
+            action, text = "PREGUNTA", f"¿Pasó algo en el turno {turn}?"
+        return self._json_block({"RAZONAMIENTO": "", "TIPO": action, "TEXTO": text})
+
+class CheckpointResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.checkpoints = main.CheckpointStore(os.path.join(self.tmp.name, "checkpoints"))
+        self.store = main.GameStore(os.path.join(self.tmp.name, "games.db"))
+        self.addCleanup(self.store.close)
+
+    def session(self, detective, resume=None):
+        # Sin caché de respuestas: cada partida pregunta de verdad al Juez
+        return main.GameSession(ScriptedJudge(), detective, max_turns=MAX_TURNS, store=self.store, answer_cache=None,
+                                checkpoints=self.checkpoints, resume=resume)
+
+    def play(self, session):
+        return main.run_async(session.run())
+
+    def assert_same_game(self, resumed, reference):
+        for key in ("outcome", "solved", "turns", "story_id"):
+            self.assertEqual(resumed.result[key], reference.result[key], key)
+        # La única diferencia es el aviso de la reanudación, justo tras el último turno completo
+        notes = [i for i, event in enumerate(resumed.transcript) if event["content"].startswith("Partida reanudada")]
+        self.assertEqual(len(notes), 1)
+        transcript = list(resumed.transcript)
+        note = transcript.pop(notes[0])
+        self.assertEqual(note["turn"], transcript[notes[0] - 1]["turn"])
+        self.assertEqual(transcript, reference.transcript)
+        self.assertEqual(resumed.judge_session.messages, reference.judge_session.messages)
+        self.assertEqual(resumed.detective_session.messages, reference.detective_session.messages)
+
+    def test_resumed_game_matches_uninterrupted_game(self):
+        reference = self.session(ScriptedDetective())
+        self.assertEqual(self.play(reference)["outcome"], "resuelto")
+        self.assertEqual(self.checkpoints.pending(), [])
+
+        interrupted = self.session(ScriptedDetective(fail_at_turn=3))
+        result = self.play(interrupted)
+        self.assertEqual(result["outcome"], "error")
+        self.assertEqual(result["checkpoint"], self.checkpoints.path(interrupted.game_id))
+        state = self.checkpoints.load(interrupted.game_id[:8])
+        self.assertEqual(state["turn"], 2)
+
+        resumed = self.session(ScriptedDetective(), resume=state)
+        result = self.play(resumed)
+        self.assertEqual(result["game_id"], interrupted.game_id)
+        self.assertEqual(result["resumes"], 1)
+        self.assert_same_game(resumed, reference)
+        # Terminada la partida, su punto de control desaparece y el almacén guarda la partida completa
+        self.assertFalse(os.path.exists(self.checkpoints.path(interrupted.game_id)))
+        self.assertEqual(self.checkpoints.pending(), [])
+        self.assertEqual(self.store.game(interrupted.game_id)["outcome"], "resuelto")
+        self.assertEqual(self.store.transcript(interrupted.game_id), resumed.transcript)
+
+    def test_cancelled_game_keeps_its_checkpoint(self):
+        reference = self.session(ScriptedDetective())
+        self.play(reference)
+        # Como un Ctrl-C en el turno 4: la cancelación se propaga y el punto de control se conserva
+        interrupted = self.session(ScriptedDetective(fail_at_turn=4, error=asyncio.CancelledError()))
+        with self.assertRaises(asyncio.CancelledError):
+            self.play(interrupted)
+        state = self.checkpoints.load(interrupted.game_id)
+        self.assertEqual(state["turn"], 3)
+        resumed = self.session(ScriptedDetective(), resume=state)
+        self.play(resumed)
+        self.assert_same_game(resumed, reference)
+        self.assertEqual(self.checkpoints.pending(), [])
+
+    def test_checkpoint_is_dropped_after_max_resumes(self):
+        session = self.session(ScriptedDetective(fail_at_turn=2))
+        self.play(session)
+        state = self.checkpoints.load(session.game_id)
+        for _ in range(main.MAX_RESUMES):
+            session = self.session(ScriptedDetective(fail_at_turn=2), resume=state)
+            result = self.play(session)
+            self.assertEqual(result["outcome"], "error")
+            pending = self.checkpoints.pending()
+            state = pending[0] if pending else None
+        self.assertEqual(result["resumes"], main.MAX_RESUMES)
+        self.assertIsNone(result["checkpoint"])
+        self.assertIsNone(state)
+
+if __name__ == "__main__":
+    unittest.main()
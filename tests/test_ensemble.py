@@ -0,0 +1,64 @@
+"""
+Pruebas de DetectiveEnsemble: en modo carrera el primer Detective que acierta detiene al resto.
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+MAX_TURNS = 10
+SLOW_LATENCY = 0.2
+
+class RaceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.checkpoints = main.CheckpointStore(os.path.join(self.tmp.name, "checkpoints"))
+        self.store = main.GameStore(os.path.join(self.tmp.name, "games.db"))
+        self.addCleanup(self.store.close)
+
+    def race(self, detectives):
+        ensemble = main.DetectiveEnsemble(main.SyntheticModel("juez", seed=1), detectives, "race", MAX_TURNS,
+                                          store=self.store, checkpoints=self.checkpoints)
+        return main.run_async(ensemble.run()), ensemble
+
+    def test_first_correct_detective_stops_the_rest(self):
+        # Los lentos no intentan una solución hasta el último turno: jugarían al menos MAX_TURNS * SLOW_LATENCY
+        detectives = [main.SyntheticModel(f"lento-{index}", latency=SLOW_LATENCY, solve_rate=0.0, seed=index) for index in range(2)]
+        detectives.append(main.SyntheticModel("rapido", solve_rate=1.0, seed=3))
+        start = time.perf_counter()
+        results, ensemble = self.race(detectives)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual([result["detective"] for result in results], ["lento-0", "lento-1", "rapido"])
+        self.assertEqual(ensemble.winner["detective"], "rapido")
+        self.assertEqual(results[2]["outcome"], "resuelto")
+        for result in results[:2]:
+            self.assertEqual(result["outcome"], "cancelada")
+            self.assertEqual(result["error"], "rapido resolvió el misterio antes.")
+            self.assertLess(result["turns"], MAX_TURNS)
+        self.assertLess(elapsed, MAX_TURNS * SLOW_LATENCY / 2)
+        # Las partidas canceladas no se guardan ni quedan pendientes de reanudar
+        story_games = self.store.games_for_story(results[2]["story_id"])
+        self.assertEqual([game["detective_model"] for game in story_games], ["rapido"])
+        self.assertEqual(self.checkpoints.pending(), [])
+
+    def test_simultaneous_finishers_are_not_cancelled_while_saving(self):
+        # Todos aciertan en el primer turno: el ganador detiene al resto mientras guardan su resultado
+        detectives = [main.SyntheticModel(f"d{index}", solve_rate=1.0, seed=index) for index in range(4)]
+        results, ensemble = self.race(detectives)
+        self.assertIsNotNone(ensemble.winner)
+        self.assertEqual(ensemble.winner["outcome"], "resuelto")
+        for result in results:
+            self.assertIn(result["outcome"], ("resuelto", "cancelada"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Pruebas de las respuestas del Juez: normalización, reintento de respuestas cortadas, clave de
+caché de las preguntas y caché compartida entre partidas (JudgeAnswerCache).
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+class NormalizeJudgeAnswerTest(unittest.TestCase):
+    def test_canonical_answers(self):
+        for text, expected in (("sí.", "Sí"), ("SI", "Sí"), (" No, claro", "No"), ('"Irrelevante"', "Irrelevante")):
+            self.assertEqual(main.normalize_judge_answer(text), expected)
+
+    def test_invalid_answers(self):
+        for text in ("", "Quizá", "Irrelev", "La respuesta es sí"):
+            self.assertIsNone(main.normalize_judge_answer(text))
+
+    def test_truncated_answers_are_retried(self):
+        for text in ("", "  ", "Irrelev", "s"):
+            self.assertTrue(main.is_truncated_judge_answer(text))
+        for text in ("Quizá", "La respuesta es sí"):
+            self.assertFalse(main.is_truncated_judge_answer(text))
+
+class JudgeQuestionKeyTest(unittest.TestCase):
+    def test_only_case_punctuation_and_spaces_are_normalized(self):
+        self.assertEqual(main.judge_question_key("¿El hombre   murió?"), main.judge_question_key("el HOMBRE murió"))
+
+    def test_pronouns_and_accents_are_kept(self):
+        questions = ["¿Lo mató su hermano?", "¿La mató su hermano?", "¿Él la envenenó?", "¿La envenenó él?",
+                     "¿El la envenenó?", "¿El hombre murió?", "¿Un hombre murió?"]
+        keys = [main.judge_question_key(question) for question in questions]
+        self.assertEqual(len(set(keys)), len(questions))
+
+class JudgeAnswerCacheTest(unittest.TestCase):
+    def test_hits_by_story(self):
+        cache = main.JudgeAnswerCache()
+        cache.put("historia", "¿Lo mató su hermano?", "Sí")
+        self.assertEqual(cache.get("historia", "¿lo mató su hermano"), "Sí")
+        self.assertIsNone(cache.get("historia", "¿La mató su hermano?"))
+        self.assertIsNone(cache.get("otra", "¿Lo mató su hermano?"))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_inflight_question_is_shared(self):
+        async def scenario():
+            cache = main.JudgeAnswerCache()
+            token = cache.begin("historia", "¿Llovía?")
+            waiting = cache.pending("historia", "¿llovía")
+            cache.end(token, "No")
+            return await waiting, cache.pending("historia", "¿Llovía?"), cache.get("historia", "¿Llovía?")
+
+        self.assertEqual(asyncio.run(scenario()), ("No", None, "No"))
+
+    def test_only_the_owner_publishes(self):
+        async def scenario():
+            cache = main.JudgeAnswerCache()
+            owner = cache.begin("historia", "¿Llovía?")
+            waiting = cache.pending("historia", "¿Llovía?")
+            # Otra partida pregunta a la vez y termina antes: no resuelve ni retira la espera ajena
+            cache.end(cache.begin("historia", "¿Llovía?"), "Sí")
+            self.assertFalse(waiting.done())
+            self.assertIs(cache.pending("historia", "¿Llovía?"), waiting)
+            self.assertEqual(cache.get("historia", "¿Llovía?"), "Sí")
+            cache.end(owner, "Sí")
+            return await waiting
+
+        self.assertEqual(asyncio.run(scenario()), "Sí")
+
+    def test_owner_failure_releases_waiters(self):
+        async def scenario():
+            cache = main.JudgeAnswerCache()
+            owner = cache.begin("historia", "¿Llovía?")
+            waiting = cache.pending("historia", "¿Llovía?")
+            cache.end(owner, None) # La llamada del Juez falló o se canceló
+            return await waiting, cache.pending("historia", "¿Llovía?"), cache.get("historia", "¿Llovía?")
+
+        self.assertEqual(asyncio.run(scenario()), (None, None, None))
+
+class TruncatingJudge(main.SyntheticModel):
+    """Juez sintético cuya primera respuesta a cada pregunta llega vacía; registra los argumentos de cada llamada."""
+    def __init__(self):
+        super().__init__("juez-cortado", seed=1)
+        self.kwargs = []
+
+    async def achat(self, messages, system=None, usage=None, **kwargs):
+        self.kwargs.append(kwargs)
+        return await super().achat(messages, system=system, usage=usage, **kwargs)
+
+    def _respond(self, messages, system):
+        prompt = messages[-1]["content"] if messages else ""
+        if "Pregunta del Detective" in prompt:
+            return ""
+        if prompt == main.JUDGE_ANSWER_RETRY:
+            return "No"
+        return super()._respond(messages, system)
+
+class JudgeAnswerRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(main, "PROMPTS_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_empty_answer_is_retried_without_token_limit(self):
+        judge = TruncatingJudge()
+        result = main.play_game(judge, main.SyntheticModel("detective", solve_rate=0.0, seed=2), interactive=False, max_turns=2)
+        phases = [call["phase"] for call in result["calls"] if call["role"] == "Juez"]
+        self.assertEqual(phases, ["historia", "respuesta", "respuesta_reintento"])
+        self.assertFalse(result["invalid_judge_answer"])
+        answer_call, retry_call = judge.kwargs[1:]
+        self.assertEqual(answer_call["max_tokens"], main.JUDGE_ANSWER_MAX_TOKENS)
+        self.assertNotIn("max_tokens", retry_call)
+
+    def test_anthropic_default_token_limit(self):
+        model = main.AnthropicModel.__new__(main.AnthropicModel)
+        main.BaseModel.__init__(model, "claude-x")
+        for kwargs in ({}, {"max_tokens": None}):
+            self.assertEqual(model._arguments([], None, kwargs)["max_tokens"], main.ANTHROPIC_MAX_TOKENS)
+        self.assertEqual(model._arguments([], None, {"max_tokens": 8})["max_tokens"], 8)
+
+if __name__ == "__main__":
+    unittest.main()
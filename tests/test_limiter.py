@@ -0,0 +1,98 @@
+"""
+Pruebas del semáforo compartido por hilos y bucles de eventos (SharedSemaphore / BackendLimiter).
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+class SharedSemaphoreTest(unittest.TestCase):
+    def test_async_waiters_are_served_in_order(self):
+        semaphore = main.SharedSemaphore(1)
+        order = []
+
+        async def worker(index):
+            await semaphore.aacquire()
+            order.append(index)
+            await asyncio.sleep(0.01)
+            semaphore.release()
+
+        async def main_task():
+            await semaphore.aacquire()
+            tasks = []
+            for index in range(5):
+                tasks.append(asyncio.create_task(worker(index)))
+                await asyncio.sleep(0) # Cada tarea se encola antes de crear la siguiente
+            semaphore.release()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main_task())
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+
+    def test_concurrency_is_limited_across_threads_and_coroutines(self):
+        limiter = main.BackendLimiter(max_concurrency=2)
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def hold():
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.01)
+            with lock:
+                active -= 1
+
+        async def ahold():
+            hold()
+
+        threads = [threading.Thread(target=limiter.call, args=(hold,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+
+        async def main_task():
+            await asyncio.gather(*(limiter.acall(ahold) for _ in range(6)))
+
+        asyncio.run(main_task())
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(peak, 2)
+        self.assertEqual(limiter.semaphore._value, 2)
+
+    def test_cancelled_waiter_does_not_leak_the_slot(self):
+        semaphore = main.SharedSemaphore(1)
+
+        async def main_task():
+            await semaphore.aacquire()
+            waiter = asyncio.create_task(semaphore.aacquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            semaphore.release()
+            # Cancelación justo después de entregarle la plaza: debe devolverla
+            await semaphore.aacquire()
+            waiter = asyncio.create_task(semaphore.aacquire())
+            await asyncio.sleep(0)
+            semaphore.release()
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            await asyncio.sleep(0)
+
+        asyncio.run(main_task())
+        self.assertEqual(semaphore._value, 1)
+        self.assertFalse(semaphore._waiters)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Pruebas de la comparación de soluciones (SolutionMatcher y score_solution_pairs).
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+DOLL = "El hombre no murió, era un muñeco."
+POISON = "Lo envenenó su mujer."
+TRAIN = "El hombre murió al caer del tren en marcha mientras dormía en el vagón."
+
+class SolutionMatcherTest(unittest.TestCase):
+    def test_negations_are_content_terms(self):
+        self.assertIn("no", main.solution_terms(DOLL))
+        self.assertIn("sin", main.solution_terms("Murió sin agua."))
+
+    def test_rejects_opposite_or_partial_short_solutions(self):
+        self.assertFalse(main.SolutionMatcher(DOLL).matches("El hombre murió."))
+        matcher = main.SolutionMatcher(POISON)
+        self.assertFalse(matcher.matches("Murió envenenado."))
+        self.assertFalse(matcher.matches("Lo envenenó su hermano."))
+
+    def test_accepts_paraphrases(self):
+        self.assertTrue(main.SolutionMatcher(DOLL).matches("No murió porque era un muñeco."))
+        self.assertTrue(main.SolutionMatcher(POISON).matches("Su mujer lo envenenó."))
+        self.assertTrue(main.SolutionMatcher(TRAIN).matches("El hombre dormía en un vagón y cayó del tren cuando este iba en marcha."))
+
+    def test_short_solutions_need_every_term(self):
+        matcher = main.SolutionMatcher("Era enano.")
+        self.assertEqual(matcher.min_matched, 1)
+        self.assertTrue(matcher.matches("Era un enano."))
+        self.assertEqual(main.SolutionMatcher(POISON).min_matched, 2)
+
+    def test_batch_agrees_with_single_attempts(self):
+        attempts = ["Murió envenenado.", "Su mujer lo envenenó.", "El hombre murió.", "No murió, era un muñeco.", ""]
+        solutions = [POISON, POISON, DOLL, DOLL, TRAIN]
+        scores, hits = main.score_solution_pairs(attempts, solutions)
+        for attempt, solution, score, hit in zip(attempts, solutions, scores, hits):
+            matcher = main.SolutionMatcher(solution)
+            self.assertAlmostEqual(float(score), matcher.score(attempt))
+            self.assertEqual(bool(hit), matcher.matches(attempt))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+Pruebas del registro de métricas de las llamadas a los modelos.
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+class TokensPerSecondTest(unittest.TestCase):
+    def test_measured_from_first_token(self):
+        self.assertAlmostEqual(main.tokens_per_second(100, start=0.0, first_token=1.0, end=3.0), 50.0)
+
+    def test_single_chunk_is_measured_from_request_start(self):
+        # Todo llegó en un único fragmento: la ventana de streaming es casi nula
+        self.assertAlmostEqual(main.tokens_per_second(100, start=0.0, first_token=1.9999, end=2.0), 50.0)
+
+    def test_too_short_window_is_not_reported(self):
+        self.assertIsNone(main.tokens_per_second(100, start=0.0, first_token=0.0001, end=0.0002))
+
+    def test_summary_ignores_unmeasured_calls(self):
+        metrics = main.MetricsRecorder()
+        records = [
+            {"role": "Juez", "phase": "respuesta", "wall_time": 1.0, "ttft": None, "prompt_tokens": 10,
+             "completion_tokens": 1, "tokens_per_sec": rate}
+            for rate in (None, 20.0, 40.0)
+        ]
+        (row,) = metrics.summarize(records)
+        self.assertEqual(row["tokens_per_sec"], 30.0)
+        (row,) = metrics.summarize(records[:1])
+        self.assertIsNone(row["tokens_per_sec"])
+
+if __name__ == "__main__":
+    unittest.main()
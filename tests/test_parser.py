@@ -0,0 +1,111 @@
+"""
+Pruebas de la extracción del JSON de los modelos (extract_json_object, JsonStreamDetector y
+parse_*) y de los reintentos de reparación cuando una respuesta no trae JSON válido.
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+class ExtractJsonObjectTest(unittest.TestCase):
+    def test_fenced_block_after_reasoning(self):
+        text = 'RAZONAMIENTO: pienso\n```json\n{"TIPO": "PREGUNTA", "TEXTO": "¿Llovía?"}\n```'
+        parsed, start = main.extract_json_object(text, main.DETECTIVE_KEYS)
+        self.assertEqual(parsed["TEXTO"], "¿Llovía?")
+        self.assertEqual(text[start], "{")
+
+    def test_skips_unrelated_and_malformed_objects(self):
+        text = 'Uso {"x": 1} y {roto: sí} antes de {"PREGUNTA": "¿Era de noche?"} y {"SOLUCION": "otra"}'
+        parsed, _ = main.extract_json_object(text, main.DETECTIVE_KEYS)
+        self.assertEqual(parsed, {"PREGUNTA": "¿Era de noche?"})
+
+    def test_truncated_json_is_not_found(self):
+        self.assertEqual(main.extract_json_object('```json\n{"TIPO": "PREGUNTA", "TEX', main.DETECTIVE_KEYS), (None, -1))
+
+class JsonStreamDetectorTest(unittest.TestCase):
+    def feed(self, detector, text, size):
+        for end in range(size, len(text) + size, size):
+            if detector(text[:end]):
+                return end
+        return None
+
+    def test_stops_when_expected_object_closes(self):
+        payload = json.dumps({"RAZONAMIENTO": 'llaves } { y comillas \\" dentro', "TIPO": "PREGUNTA", "TEXTO": "¿Sí?"})
+        text = 'Nota {no es json} ' + payload + " texto sobrante"
+        detector = main.JsonStreamDetector(main.DETECTIVE_KEYS)
+        end = self.feed(detector, text, 3)
+        self.assertIsNotNone(end)
+        self.assertLessEqual(end, len(text) - len(" texto sobrante") + 3)
+        self.assertEqual(detector.result["TEXTO"], "¿Sí?")
+
+    def test_ignores_objects_without_expected_keys(self):
+        detector = main.JsonStreamDetector(main.STORY_KEYS)
+        self.assertIsNone(self.feed(detector, '{"PREGUNTA": "x"} sin historia', 4))
+
+class ParseResponsesTest(unittest.TestCase):
+    def test_detective_action(self):
+        response = json.dumps({"RAZONAMIENTO": "r", "TIPO": "solución", "TEXTO": "Fue el tren."})
+        self.assertEqual(main.parse_detective_response(response), ("r", "", "Fue el tren.", ""))
+
+    def test_detective_legacy_keys(self):
+        response = 'RAZONAMIENTO: antes del bloque\n```json\n{"PREGUNTA": "¿Llovía?"}\n```'
+        self.assertEqual(main.parse_detective_response(response), ("antes del bloque", "¿Llovía?", "", ""))
+
+    def test_detective_without_action_is_an_error(self):
+        _, question, solution, error = main.parse_detective_response('{"TIPO": "PREGUNTA", "TEXTO": ""}')
+        self.assertEqual((question, solution), ("", ""))
+        self.assertTrue(error)
+
+    def test_story_with_empty_fields_is_rejected(self):
+        with self.assertRaises(ValueError):
+            main.parse_story_response('{"HISTORIA_CORTA": "a", "HISTORIA_LARGA": "", "SOLUCION": "c"}')
+
+class ScriptedDetective(main.SyntheticModel):
+    """Detective sintético que responde sin JSON las `broken` primeras veces."""
+    def __init__(self, broken):
+        super().__init__("detective-guionizado", solve_rate=1.0, seed=2)
+        self.broken = broken
+        self.prompts = []
+
+    def _respond(self, messages, system):
+        self.prompts.append(messages[-1]["content"])
+        if len(self.prompts) <= self.broken:
+            return "Creo que voy a preguntar por el tren, pero se me olvidó el JSON."
+        return super()._respond(messages, system)
+
+class RepairTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(main, "PROMPTS_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def play(self, detective):
+        return main.play_game(main.SyntheticModel("juez", seed=1), detective, interactive=False, max_turns=1)
+
+    def test_repair_recovers_the_move(self):
+        detective = ScriptedDetective(broken=1)
+        result = self.play(detective)
+        self.assertEqual(result["outcome"], "resuelto")
+        self.assertTrue(detective.prompts[1].startswith("Tu respuesta anterior no contenía un JSON válido"))
+        phases = [call["phase"] for call in result["calls"] if call["role"] == "Detective"]
+        self.assertEqual(phases, ["pregunta", "solucion"])
+
+    def test_gives_up_after_max_repair_attempts(self):
+        detective = ScriptedDetective(broken=main.MAX_REPAIR_ATTEMPTS + 1)
+        result = self.play(detective)
+        self.assertEqual(result["outcome"], "formato_invalido_detective")
+        self.assertEqual(len(detective.prompts), main.MAX_REPAIR_ATTEMPTS + 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Pruebas del almacén de historias, partidas y transcripciones (GameStore) sobre una base de datos
+temporal.
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+STORY = (
+    "Un hombre aparece muerto en un campo con una mochila a la espalda.",
+    "Un hombre aparece muerto en mitad de un campo. Lleva una mochila a la espalda y no hay huellas a su alrededor.",
+    "Saltó en paracaídas y no se le abrió.",
+)
+OTHER_STORY = (
+    "Una mujer pide un vaso de agua en un bar y el camarero le apunta con una pistola.",
+    "Una mujer entra en un bar y pide un vaso de agua. El camarero saca una pistola y le apunta. Ella le da las gracias y se va.",
+    "Tenía hipo y el susto se lo quitó.",
+)
+
+def game_result(game_id, story_id, detective, solved, turns, started):
+    return {"game_id": game_id, "story_id": story_id, "juez": "juez", "detective": detective,
+            "outcome": "resuelto" if solved else "no_resuelto", "solved": solved, "turns": turns,
+            "invalid_judge_answer": False, "wall_time": 1.5, "prompt_tokens": 100, "error": None,
+            "filename": None, "started": started}
+
+class GameStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = main.GameStore(os.path.join(self.tmp.name, "games.db"))
+        self.addCleanup(self.store.close)
+
+    def test_add_story_is_idempotent_and_flags_near_duplicates(self):
+        story_id, duplicate_of = self.store.add_story(*STORY, model="juez")
+        self.assertIsNone(duplicate_of)
+        self.assertEqual(self.store.add_story(*STORY), (story_id, None))
+        # Misma historia con un cambio mínimo en la solución
+        copy_id, duplicate_of = self.store.add_story(STORY[0], STORY[1], STORY[2].replace("Saltó", "Se tiró"))
+        self.assertNotEqual(copy_id, story_id)
+        self.assertEqual(duplicate_of, story_id)
+        other_id, duplicate_of = self.store.add_story(*OTHER_STORY)
+        self.assertIsNone(duplicate_of)
+        self.assertEqual([story for story, _ in self.store.near_duplicates(*OTHER_STORY)], [other_id])
+        self.assertEqual(self.store.story(story_id)["SOLUCION"], STORY[2])
+
+    def test_games_and_transcripts_by_id(self):
+        story_id, _ = self.store.add_story(*STORY)
+        transcript = [
+            {"turn": 1, "role": "Detective", "kind": "pregunta", "content": "¿Llevaba un paracaídas?"},
+            {"turn": 1, "role": "Juez", "kind": "respuesta", "content": "Sí."},
+        ]
+        self.store.save_game(game_result("b-2", story_id, "det-b", False, 20, started=2.0), [])
+        self.store.save_game(game_result("a-1", story_id, "det-a", True, 1, started=1.0), transcript)
+        games = self.store.games_for_story(story_id)
+        self.assertEqual([game["id"] for game in games], ["a-1", "b-2"])
+        self.assertEqual(self.store.transcript("a-1"), transcript)
+        self.assertEqual(self.store.game("b-2")["outcome"], "no_resuelto")
+        # Guardar otra vez la misma partida sustituye su transcripción
+        self.store.save_game(game_result("a-1", story_id, "det-a", True, 1, started=1.0), transcript[:1])
+        self.assertEqual(self.store.transcript("a-1"), transcript[:1])
+
+    def test_resolve_id_by_prefix(self):
+        story_id, _ = self.store.add_story(*STORY)
+        self.assertEqual(self.store.resolve_id("stories", story_id[:6]), story_id)
+        self.store.save_game(game_result("abc-1", story_id, "det", True, 1, started=1.0), [])
+        self.store.save_game(game_result("abd-2", story_id, "det", True, 1, started=2.0), [])
+        self.assertEqual(self.store.resolve_id("games", "abc"), "abc-1")
+        with self.assertRaisesRegex(ValueError, "Hay varias partidas"):
+            self.store.resolve_id("games", "ab")
+        with self.assertRaisesRegex(ValueError, "No hay ninguna partida"):
+            self.store.resolve_id("games", "zz")
+
+    def test_solve_rate_by_detective(self):
+        story_id, _ = self.store.add_story(*STORY)
+        copy_id, _ = self.store.add_story(STORY[0], STORY[1], STORY[2].replace("Saltó", "Se tiró"))
+        self.store.save_game(game_result("1", story_id, "det-a", True, 4, started=1.0), [])
+        self.store.save_game(game_result("2", copy_id, "det-a", False, 20, started=2.0), [])
+        self.store.save_game(game_result("3", story_id, "det-b", False, 20, started=3.0), [])
+        rows = {row["detective"]: row for row in self.store.solve_rate_by_detective()}
+        self.assertEqual((rows["det-a"]["games"], rows["det-a"]["solved"]), (2, 1))
+        self.assertEqual(rows["det-a"]["avg_turns_to_solve"], 4)
+        self.assertEqual(rows["det-b"]["solve_rate"], 0)
+        unique = {row["detective"]: row for row in self.store.solve_rate_by_detective(unique_stories=True)}
+        self.assertEqual(unique["det-a"]["games"], 1)
+        self.assertEqual(unique["det-a"]["solve_rate"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
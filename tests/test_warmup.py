@@ -0,0 +1,154 @@
+"""
+Pruebas de la comprobación y precarga de modelos al arrancar (warmup_models y warmup() de cada
+backend) con modelos sintéticos y un servidor Ollama local de pega.
+
+Uso:
+    uv run python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+try:
+    import ollama
+except ImportError:
+    ollama = None
+
+class BrokenModel(main.BaseModel):
+    def __init__(self, error):
+        super().__init__("roto")
+        self.error = error
+
+    def warmup(self):
+        time.sleep(0.05)
+        raise self.error
+
+class WarmupModelsTest(unittest.TestCase):
+    def test_reports_load_time_per_model(self):
+        ready = []
+        models = {"lento": main.SyntheticModel("lento", latency=0.3), "rapido": main.SyntheticModel("rapido", latency=0.05)}
+        start = time.perf_counter()
+        load_times = main.warmup_models(models, on_ready=lambda label, seconds: ready.append(label))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(ready, ["rapido", "lento"])
+        self.assertGreaterEqual(load_times["lento"], 0.3)
+        self.assertLess(load_times["rapido"], 0.3)
+        # Se cargan a la vez: el total es el del más lento, no la suma
+        self.assertLess(elapsed, 0.3 + 0.05 + 0.2)
+
+    def test_fails_fast_on_unavailable_model(self):
+        models = {"lento": main.SyntheticModel("lento", latency=5), "roto": BrokenModel(main.ModelUnavailable("no existe"))}
+        start = time.perf_counter()
+        with self.assertRaisesRegex(main.ModelUnavailable, "no existe"):
+            main.warmup_models(models)
+        self.assertLess(time.perf_counter() - start, 2)
+
+    def test_other_errors_become_model_unavailable(self):
+        with self.assertRaisesRegex(main.ModelUnavailable, "roto: sin conexión"):
+            main.warmup_models({"roto": BrokenModel(ConnectionError("sin conexión"))})
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """Servidor Ollama de pega: solo tiene descargado `qwen3:latest`."""
+    MODELS = ("qwen3", "qwen3:latest")
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send(200, {"models": [{"name": "qwen3:latest", "model": "qwen3:latest"}]})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+        if self.path == "/api/show":
+            if body.get("model") in self.MODELS:
+                self._send(200, {"modelfile": "", "parameters": "", "template": "", "details": {}, "model_info": {}})
+            else:
+                self._send(404, {"error": f"model '{body.get('model')}' not found"})
+        elif self.path == "/api/generate":
+            self._send(200, {"model": body.get("model"), "created_at": "2024-01-01T00:00:00Z", "response": "", "done": True})
+        else:
+            self._send(404, {"error": "not found"})
+
+@unittest.skipIf(ollama is None, "el paquete ollama no está instalado")
+class OllamaWarmupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_available_model_loads(self):
+        main.OllamaModel("qwen3", self.base_url).warmup()
+
+    def test_missing_model_is_unavailable(self):
+        with self.assertRaises(main.ModelUnavailable) as raised:
+            main.OllamaModel("llama9", self.base_url).warmup()
+        message = str(raised.exception)
+        self.assertIn("ollama pull llama9", message)
+        self.assertIn("disponibles: qwen3:latest", message)
+
+    def test_unreachable_server_is_unavailable(self):
+        with self.assertRaises(main.ModelUnavailable):
+            main.OllamaModel("qwen3", "http://127.0.0.1:9").warmup()
+
+class NotFound(Exception):
+    """Mismo nombre que la excepción de google.api_core para un modelo que no existe."""
+
+class FakeGenai:
+    def __init__(self, error=None):
+        self.error = error
+        self.requested = []
+
+    def get_model(self, name):
+        self.requested.append(name)
+        if self.error:
+            raise self.error
+        return {"name": name}
+
+class GeminiWarmupTest(unittest.TestCase):
+    def model(self, genai):
+        # Sin pasar por __init__: no se configura el SDK ni hace falta una API key real
+        model = main.GeminiModel.__new__(main.GeminiModel)
+        main.BaseModel.__init__(model, "gemini-2.0-flash")
+        model.genai = genai
+        return model
+
+    def test_existing_model(self):
+        genai = FakeGenai()
+        self.model(genai).warmup()
+        self.assertEqual(genai.requested, ["models/gemini-2.0-flash"])
+
+    def test_not_found_maps_to_unavailable(self):
+        with self.assertRaisesRegex(main.ModelUnavailable, "no existe"):
+            self.model(FakeGenai(NotFound("404 models/gemini-2.0-flash is not found"))).warmup()
+
+    def test_rejected_key_maps_to_unavailable(self):
+        with self.assertRaisesRegex(main.ModelUnavailable, "no está disponible con esta API key"):
+            self.model(FakeGenai(PermissionError("403 API key not valid"))).warmup()
+
+if __name__ == "__main__":
+    unittest.main()